@@ -0,0 +1,258 @@
+"""
+Offline epoching of the gaze data of a run around the trial events
+"""
+
+import csv
+import os.path as op
+import sys
+
+import numpy as np
+
+from gazeio import GAZE_MAGIC, load_gaze_binary
+
+# Trial csv columns with the times (s, PsychoPy clock) gaze is epoched around
+EPOCH_EVENTS = ('audio_onset', 'display_feedback', 'response_time')
+
+# Characters of one _et.csv value: np.savetxt's '%.18e' of a negative number (25) and its comma
+_CSV_VALUE_CHARS = 26
+
+# Gaze columns kept in the epochs by default
+EPOCH_CHANNELS = ['xLeftGazePositionOnDisplay', 'yLeftGazePositionOnDisplay', 'leftPupilDiameter',
+                  'xRightGazePositionOnDisplay', 'yRightGazePositionOnDisplay', 'rightPupilDiameter']
+
+
+def run_files(runDir):
+    """Data files of a run in logs/<runid>/
+
+    The wide csv (<runid>.csv) is used for the trials when it exists,
+    otherwise the per-trial log (<runid>_trials.csv) of a session that did not
+    finish. For gaze the binary file (<runid>_et.bin) is used before the csv.
+
+    Returns: Dict with runid, trials (path or None) and gaze (path or None)
+    """
+    runid = op.basename(op.normpath(runDir))
+    stem = op.join(runDir, runid)
+    trials = next((path for path in [stem + '.csv', stem + '_trials.csv'] if op.isfile(path)), None)
+    gaze = next((path for path in [stem + '_et.bin', stem + '_et.csv'] if op.isfile(path)), None)
+    return {'runid': runid, 'trials': trials, 'gaze': gaze}
+
+
+def read_trials(csvPath):
+    """Read a trial csv into columns
+
+    Rows with a missing or extra field (the row being written when a session
+    crashed) are dropped.
+
+    Returns: Dict of column name -> list of values (strings), one per trial
+    """
+    with open(csvPath, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = [row for row in reader if len(row) == len(header)]
+    return {name: [row[ii] for row in rows] for ii, name in enumerate(header)}
+
+
+def event_times(trials, column):
+    """Times of an event column of read_trials as floats
+
+    Trials without the event (empty, 'None', or 0 such as response_time
+    after a timeout) are NaN.
+    """
+    times = np.full(len(next(iter(trials.values()), [])), np.nan)
+    for ii, value in enumerate(trials.get(column, [])):
+        try:
+            times[ii] = float(value)
+        except ValueError:
+            pass
+    times[times <= 0] = np.nan
+    return times
+
+
+def read_gaze_columns(gazePath):
+    """Column names of a binary gaze file or an _et.csv"""
+    with open(gazePath, 'rb') as f:
+        binary = f.read(len(GAZE_MAGIC)) == GAZE_MAGIC
+    if binary:
+        return load_gaze_binary(gazePath)[1]
+    with open(gazePath) as f:
+        return f.readline().lstrip('#').strip().split(',')
+
+
+def iter_gaze_chunks(gazePath, usecols, chunkRows=200000):
+    """Read the samples of a gaze file a block at a time
+
+    Binary files are memory-mapped. The csv is parsed about chunkRows lines
+    at a time (more when many values are NaN) and only the columns in usecols are converted, so a recording of any
+    length is read in bounded memory. A last row cut short by a crash is ignored.
+
+    Args:
+        gazePath: Binary gaze file or _et.csv
+        usecols: Indices of the columns to return
+        chunkRows: Samples per block
+
+    Yields: (n,len(usecols)) float arrays
+    """
+    usecols = list(usecols)
+    with open(gazePath, 'rb') as f:
+        binary = f.read(len(GAZE_MAGIC)) == GAZE_MAGIC
+    if binary:
+        data = load_gaze_binary(gazePath)[0]
+        for start in range(0, data.shape[0], chunkRows):
+            yield np.asarray(data[start:start+chunkRows][:, usecols], dtype=float)
+        return
+    with open(gazePath) as f:
+        nColumns = f.readline().count(',') + 1
+        while True:
+            lines = f.readlines(chunkRows * nColumns * _CSV_VALUE_CHARS)
+            if lines and not lines[-1].endswith('\n'):
+                lines.pop()
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
+
+
+def _grid(tmin, tmax, rate):
+    """Multiples of 1/rate from tmin to tmax"""
+    return np.arange(int(np.ceil(tmin * rate - 1e-9)), int(np.floor(tmax * rate + 1e-9)) + 1) / rate
+
+
+def epoch_gaze(gazePath, events, tmin=-1.0, tmax=3.0, rate=None, channels=EPOCH_CHANNELS, timeColumn=None,
+               method='linear', maxGap=None, chunkRows=200000):
+    """Cut the gaze recording into epochs around events, on a common time grid
+
+    All epochs are sampled at the same times relative to their event. The
+    grid times of every epoch are sorted once, and each block of samples
+    read from the file fills the grid times it spans (located with
+    np.searchsorted), so the recording is read once whatever the number of
+    events, and never held in memory whole. Grid times before or after the
+    recording, across a gap in it, or of events that are NaN are NaN.
+
+    Args:
+        gazePath: Binary gaze file or _et.csv of the run
+        events: Event times (s, PsychoPy clock), e.g. event_times(trials, 'audio_onset')
+        tmin, tmax: Start and end of the epochs (s) relative to the events
+        rate: Sampling rate (Hz) of the grid. None for the rate of the recording
+        channels: Gaze columns to epoch
+        timeColumn: Gaze column with the sample times. None for correctedTime
+            (see eyetracking.ClockSync), or expTime in recordings without it
+        method: 'linear' to interpolate between samples or 'nearest' to take the closest one
+        maxGap: Samples further apart than this (s) are not interpolated between.
+            None for 2.5 sample periods of the recording
+        chunkRows: Samples read from the file at a time
+
+    Returns:
+        epochs: (nEvents,nTimes,nChannels) array
+        times: (nTimes,) grid times (s) relative to the events
+        channels: Column names of the last axis
+    """
+    columns = read_gaze_columns(gazePath)
+    if timeColumn is None:
+        timeColumn = 'correctedTime' if 'correctedTime' in columns else 'expTime'
+    channels = list(channels)
+    missing = [name for name in [timeColumn] + channels if name not in columns]
+    if missing:
+        raise ValueError('%s has no column %s' % (gazePath, ', '.join(missing)))
+    events = np.asarray(events, dtype=float)
+
+    epochs = times = order = targets = None
+    prev = None
+    for chunk in iter_gaze_chunks(gazePath, [columns.index(name) for name in [timeColumn] + channels], chunkRows):
+        chunk = chunk[~np.isnan(chunk[:, 0])]
+        if prev is not None:
+            chunk = np.concatenate([prev, chunk])
+        if chunk.shape[0] < 2:
+            prev = chunk
+            continue
+        t = chunk[:, 0]
+        if np.any(t[1:] < t[:-1]):
+            chunk = chunk[np.argsort(t, kind='stable')]
+            t = chunk[:, 0]
+
+        if epochs is None:
+            # The grid is set by the first block: the sampling rate and gaps are those of the recording
+            period = np.median(np.diff(t))
+            if rate is None:
+                rate = round(1 / period)
+            if maxGap is None:
+                maxGap = 2.5 * period
+            times = _grid(tmin, tmax, rate)
+            flat = (events[:, None] + times[None, :]).ravel()
+            order = np.argsort(flat, kind='stable')
+            order = order[~np.isnan(flat[order])]
+            targets = flat[order]
+            epochs = np.full((events.size * times.size, len(channels)), np.nan)
+
+        lo = np.searchsorted(targets, t[0], 'left')
+        hi = np.searchsorted(targets, t[-1], 'right')
+        if hi > lo:
+            q = targets[lo:hi]
+            idx = np.clip(np.searchsorted(t, q, 'right') - 1, 0, t.size - 2)
+            t0, t1 = t[idx], t[idx + 1]
+            dt = t1 - t0
+            w = np.divide(q - t0, dt, out=np.zeros_like(q), where=dt > 0)
+            before, after = chunk[idx, 1:], chunk[idx + 1, 1:]
+            if method == 'nearest':
+                values = np.where((w > 0.5)[:, None], after, before)
+            else:
+                values = before + w[:, None] * (after - before)
+            values[dt > maxGap] = np.nan
+            epochs[order[lo:hi]] = values
+        prev = chunk[-1:]
+
+    if epochs is None:
+        # An empty recording
+        rate = rate or 1.
+        times = _grid(tmin, tmax, rate)
+        epochs = np.full((events.size * times.size, len(channels)), np.nan)
+    return epochs.reshape(events.size, times.size, len(channels)), times, channels
+
+
+def load_run(runDir, events=EPOCH_EVENTS, tmin=-1.0, tmax=3.0, **kwargs):
+    """Read a run's trials and epoch its gaze data around each trial event
+
+    The epochs of all events are cut in one pass over the gaze file.
+
+    Args:
+        runDir: The run's folder, logs/<runid>
+        events: Trial csv columns to epoch around
+        tmin, tmax: Start and end of the epochs (s) relative to the events
+        **kwargs: Passed on to epoch_gaze (rate, channels, timeColumn, method, maxGap, chunkRows)
+
+    Returns: Dict with
+        runid: Name of the run
+        trials: Trial columns (see read_trials)
+        epochs: Dict of event -> (nTrials,nTimes,nChannels) array. Empty if the run has no gaze data
+        times: Grid times (s) relative to the events
+        channels: Column names of the last axis of the epochs
+    """
+    files = run_files(runDir)
+    if files['trials'] is None:
+        raise FileNotFoundError('No trial csv for %s in %s' % (files['runid'], runDir))
+    trials = read_trials(files['trials'])
+    run = {'runid': files['runid'], 'trials': trials, 'epochs': {}, 'times': None, 'channels': None}
+    if files['gaze'] is None:
+        return run
+    onsets = [event_times(trials, column) for column in events]
+    epochs, run['times'], run['channels'] = epoch_gaze(files['gaze'], np.concatenate(onsets), tmin, tmax, **kwargs)
+    nTrials = onsets[0].size if onsets else 0
+    for ii, column in enumerate(events):
+        run['epochs'][column] = epochs[ii*nTrials:(ii+1)*nTrials]
+    return run
+
+
+if __name__ == '__main__':
+    # python analysis.py logs/<runid> [tmin] [tmax]
+    if len(sys.argv) < 2:
+        print('Usage: python analysis.py <run folder> [tmin] [tmax]')
+        sys.exit(1)
+    runDir = sys.argv[1]
+    limits = [float(a) for a in sys.argv[2:4]]
+    run = load_run(runDir, EPOCH_EVENTS, *limits)
+    if not run['epochs']:
+        print('No gaze data in %s' % runDir)
+        sys.exit(1)
+    outPath = op.join(runDir, run['runid'] + '_epochs.npz')
+    np.savez(outPath, times=run['times'], channels=run['channels'], **run['epochs'])
+    first = next(iter(run['epochs'].values()))
+    print('Saved %d trials x %d samples x %d channels around %s to %s'
+          % (first.shape + (', '.join(run['epochs']), outPath)))
@@ -0,0 +1,639 @@
+"""
+Audio synthesis and loading for the task. Only needs numpy (plus soundfile and
+scipy to read wav files), so buffers can be built without psychopy or an audio
+device
+"""
+
+import csv
+import hashlib
+import os
+import os.path as op
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fractions import Fraction
+
+import numpy as np
+
+
+def apodize(tones, sampleRate):
+    """Ramp the onset and offset of tones the same way psychopy's `hamming=True` does
+
+    A half window of min(5ms, 1/15 of the tone) is applied to each end.
+
+    Args:
+        tones: (..., nSamples) array of tones. Modified in place
+        sampleRate: Sampling rate of the tones
+
+    Returns: tones
+    """
+    hwSize = int(min(sampleRate // 200, tones.shape[-1] // 15))
+    window = np.hanning(2 * hwSize + 1)
+    tones[..., :hwSize] *= window[:hwSize]
+    tones[..., -hwSize:] *= window[hwSize + 1:]
+    return tones
+
+
+def synthesize_tones(frequencies, toneDuration, sampleRate, hamming=True):
+    """Render one pure tone per frequency in a single batched operation
+
+    Produces the same samples as psychopy.sound.Sound(value=f, secs=toneDuration,
+    hamming=hamming).sndArr for every f.
+
+    Args:
+        frequencies: Vector of tone frequencies (Hz)
+        toneDuration: Duration of every tone (s)
+        sampleRate: Sampling rate
+        hamming: Apply psychopy's onset/offset ramp
+
+    Returns: (nTones, nSamples) float64 array
+    """
+    nSamples = int(toneDuration * sampleRate)
+    phase = np.arange(0.0, 1.0, 1.0 / nSamples)
+    cycles = 2 * np.pi * np.asarray(frequencies, dtype=float) * toneDuration
+    tones = np.sin(phase[None, :] * cycles[:, None])
+    if hamming and nSamples > 30:
+        apodize(tones, sampleRate)
+    return tones
+
+
+def to_stereo(tones, out=None):
+    """Join (nTones, nSamples) tones end to end into a (nTones*nSamples, 2) float32 array
+
+    Args:
+        tones: Array of tones
+        out: Optional preallocated (nTones*nSamples, 2) float32 array to write into
+    """
+    mono = np.asarray(tones, dtype=np.float32).reshape(-1)
+    stereo = np.empty((mono.size, 2), dtype=np.float32) if out is None else out
+    stereo[:, 0] = mono
+    stereo[:, 1] = mono
+    return stereo
+
+
+def tone_sequence_frequencies(coherence, frequency, frequency_range, tone_duration=0.025,
+                              sequence_duration=0.5, rng=None):
+    """The shuffled frequency of every tone in a tone sequence
+
+    A fraction `coherence` of the tones are at `frequency`. The rest are shifted by a
+    random amount of up to +/- `frequency_range` octaves.
+
+    Args:
+        rng: np.random.RandomState (or Generator) to draw from. Defaults to the global
+            numpy random state, drawing in the same order the per-tone version did
+
+    Returns: Vector of frequencies
+    """
+    rng = np.random if rng is None else rng
+    num_tones = int(sequence_duration / tone_duration)
+    num_coherent_tones = int(num_tones * coherence)
+    random_octave_shift = rng.uniform(-1, 1, size=num_tones - num_coherent_tones)
+    frequencies = np.concatenate((
+        np.full(num_coherent_tones, frequency, dtype=float),
+        frequency * 2 ** (random_octave_shift * frequency_range)))
+    rng.shuffle(frequencies)
+    return frequencies
+
+
+def tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025,
+                  sequence_duration=0.5, rng=None, out=None):
+    """Render a tone sequence as a stereo float32 array
+
+    See tone_sequence_frequencies for the arguments. `out` is passed to to_stereo.
+    """
+    frequencies = tone_sequence_frequencies(coherence, frequency, frequency_range,
+        tone_duration=tone_duration, sequence_duration=sequence_duration, rng=rng)
+    return to_stereo(synthesize_tones(frequencies, tone_duration, sampleRate), out=out)
+
+
+def read_conditions(filename):
+    """Read a conditions file (e.g. soundslist.csv) into a list of dicts
+
+    Numeric values are converted to int or float, as psychopy's importConditions does.
+    """
+    def convert(value):
+        for cast in [int, float]:
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        return [{key: convert(value) for key, value in row.items()} for row in csv.DictReader(f)]
+
+
+def _render_trials(conditions, seeds, sampleRate, coherence, tone_duration, sequence_duration, out=None):
+    """Render the cue and choice tone sequences of each trial. See StimulusBank"""
+    nSamples = int(tone_duration * sampleRate) * int(sequence_duration / tone_duration)
+    if out is None:
+        out = np.empty((len(conditions), 2, nSamples, 2), dtype=np.float32)
+    for ii, (condition, seed) in enumerate(zip(conditions, seeds)):
+        rng = np.random.RandomState(seed)
+        for jj, prefix in enumerate(['cue', 'choice']):
+            tone_sequence(coherence, condition[prefix + '_frequency'], condition[prefix + '_frequency_range'],
+                sampleRate=sampleRate, tone_duration=tone_duration, sequence_duration=sequence_duration,
+                rng=rng, out=out[ii, jj])
+    return out
+
+
+class StimulusBank:
+    """Every cue and choice sound of a session, rendered before the first trial
+
+    Each trial gets its own random seed, so the incoherent tones differ between
+    trials but can be regenerated from `seed`. Sounds are held in one contiguous
+    (nTrials, 2, nSamples, 2) float32 array and the trial loop only indexes into it.
+
+    Args:
+        conditions: List of dicts with cue_frequency, cue_frequency_range,
+            choice_frequency and choice_frequency_range (one per row of soundslist.csv)
+        sampleRate: Sampling rate of the sounds
+        nReps: Number of repetitions of the conditions (as for the TrialHandler)
+        coherence: Fraction of tones at the target frequency
+        seed: Session seed. A new one is drawn if None
+        workers: Number of worker processes to render with. 0 renders in this process
+        tone_duration: Duration of each tone (s)
+        sequence_duration: Duration of each tone sequence (s)
+    """
+
+    def __init__(self, conditions, sampleRate, nReps=1, coherence=0.9, seed=None, workers=0,
+                 tone_duration=0.025, sequence_duration=0.5):
+        self.conditions = list(conditions) * nReps
+        self.sampleRate = sampleRate
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.trialSeeds = np.random.SeedSequence(self.seed).generate_state(len(self.conditions))
+        args = (sampleRate, coherence, tone_duration, sequence_duration)
+
+        nSamples = int(tone_duration * sampleRate) * int(sequence_duration / tone_duration)
+        self.sounds = np.empty((len(self.conditions), 2, nSamples, 2), dtype=np.float32)
+        if workers and len(self.conditions) > 1:
+            chunks = np.array_split(np.arange(len(self.conditions)), workers)
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [(idx, pool.submit(_render_trials, [self.conditions[i] for i in idx],
+                            self.trialSeeds[idx], *args)) for idx in chunks if len(idx)]
+                for idx, future in futures:
+                    self.sounds[idx] = future.result()
+        else:
+            _render_trials(self.conditions, self.trialSeeds, *args, out=self.sounds)
+
+    @classmethod
+    def from_csv(cls, filename, sampleRate, **kwargs):
+        """Build the bank straight from a conditions file"""
+        return cls(read_conditions(filename), sampleRate, **kwargs)
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def cue(self, trial):
+        """Cue sound of trial number `trial` (view into the bank)"""
+        return self.sounds[trial, 0]
+
+    def choice(self, trial):
+        """Choice sound of trial number `trial` (view into the bank)"""
+        return self.sounds[trial, 1]
+
+
+def read_wav(filename, new_fs=48000, dual=True, cache=None, method='auto'):
+    """Read a wav file and adjust its sampling rate to desired rate
+
+    Args:
+        filename: wav filename
+        new_fs: the desired sampling rate
+        dual: Make mono files stereo
+        cache: Optional WavCache to read through. Cached arrays are float32 and read-only
+        method: Resampling engine. 'poly' (polyphase filter, needs a rational ratio
+            between the rates), 'fft' (scipy.signal.resample on the whole file) or
+            'auto' (poly when the ratio is rational, fft otherwise)
+
+    Returns: numpy array of audio file resampled to new_fs
+
+    """
+    if cache is not None:
+        return cache.read(filename, new_fs=new_fs, dual=dual, method=method)
+    import soundfile as sf
+    soundArray, orig_fs = sf.read(filename, dtype='float32')
+    return _prepare_wav(soundArray, orig_fs, new_fs, dual, method)
+
+
+def _prepare_wav(soundArray, orig_fs, new_fs, dual, method='auto'):
+    """Stereo-expand and resample a decoded wav file. See read_wav"""
+    if soundArray.ndim == 1 and dual:
+        soundArray = np.vstack((soundArray, soundArray)).T
+
+    if new_fs not in [orig_fs, None]:
+        audTime = soundArray.shape[0] / orig_fs
+        newNumSamples = round(audTime * new_fs)
+        if resample_method(orig_fs, new_fs, method) == 'poly':
+            up, down = resample_ratio(orig_fs, new_fs)
+            return resample_poly_chunked(soundArray, up, down, nOut=newNumSamples)
+        from scipy.signal import resample
+        return resample(soundArray, newNumSamples)
+    else:
+        return soundArray
+
+
+def resample_ratio(orig_fs, new_fs, maxFactor=1000):
+    """(up, down) with new_fs/orig_fs == up/down, e.g. (160, 147) for 44.1k -> 48k
+
+    Returns None when the rates are not a ratio of integers up to maxFactor
+    """
+    ratio = Fraction(new_fs) / Fraction(orig_fs)
+    if ratio.numerator > maxFactor or ratio.denominator > maxFactor:
+        return None
+    return ratio.numerator, ratio.denominator
+
+
+def resample_method(orig_fs, new_fs, method='auto'):
+    """The engine ('poly' or 'fft') read_wav uses for a conversion"""
+    if method not in ['auto', 'poly', 'fft']:
+        raise ValueError("method must be 'auto', 'poly' or 'fft', not %r" % (method,))
+    if method == 'fft':
+        return 'fft'
+    if resample_ratio(orig_fs, new_fs) is None:
+        if method == 'poly':
+            raise ValueError('No rational ratio between %g Hz and %g Hz for polyphase resampling'
+                             % (orig_fs, new_fs))
+        return 'fft'
+    return 'poly'
+
+
+def resample_poly_chunked(x, up, down, nOut=None, chunkSamples=2**20):
+    """scipy.signal.resample_poly along axis 0, processed in chunks of the input
+
+    Each chunk is padded on both sides with enough input for the filter to
+    reach across the chunk edges, and starts at a multiple of `down` so its
+    output samples fall on the same grid as the whole file's. The result is
+    the same as resample_poly on the whole array, while the intermediate
+    arrays stay the size of one chunk.
+
+    Args:
+        x: Signal, (n,) or (n, nChannels)
+        up: Upsampling factor
+        down: Downsampling factor
+        nOut: Number of output samples to keep. Defaults to resample_poly's ceil(n*up/down)
+        chunkSamples: Approximate input samples per chunk
+
+    Returns: Resampled signal with the same dtype as resample_poly's output
+    """
+    from scipy.signal import firwin, resample_poly
+    g = np.gcd(up, down)
+    up, down = up // g, down // g
+    n = x.shape[0]
+    fullOut = -(-n * up // down)
+    nOut = fullOut if nOut is None else min(nOut, fullOut)
+
+    # resample_poly's default filter, designed once for all chunks
+    halfLen = 10 * max(up, down)
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+    h = firwin(2 * halfLen + 1, 1. / max(up, down), window=('kaiser', 5.0)).astype(dtype)
+
+    # Input samples the filter reaches past a chunk edge, and the chunk length, as multiples of down
+    pad = -(-(halfLen // up + 2) // down) * down
+    chunk = max(1, chunkSamples // down) * down
+    if n <= chunk + 2 * pad:
+        return resample_poly(x, up, down, axis=0, window=h)[:nOut]
+
+    out = None
+    for start in range(0, n, chunk):
+        outStart = start * up // down
+        if outStart >= nOut:
+            break
+        outStop = min((start + chunk) * up // down, nOut)
+        a = max(start - pad, 0)
+        y = resample_poly(x[a:start + chunk + pad], up, down, axis=0, window=h)
+        if out is None:
+            out = np.empty((nOut,) + x.shape[1:], dtype=y.dtype)
+        skip = (start - a) * up // down
+        out[outStart:outStop] = y[skip:skip + outStop - outStart]
+    return out
+
+
+class WavCache:
+    """Resampled wav files, cached on disk and in memory
+
+    Arrays are keyed by the file's content hash, its sampling rate, the target
+    rate, `dual` and the resampling engine, so renaming or touching a file does not invalidate it but
+    editing it does. Each resampled array is saved once as a .npy file in
+    cacheDir and later sessions memory-map it instead of decoding and
+    resampling again. Recently used arrays are also kept in an in-memory LRU
+    limited to maxBytes.
+
+    Returned arrays are float32 and read-only. Copy them before modifying.
+
+    Args:
+        cacheDir: Folder for the cached .npy files. None caches in memory only
+        maxBytes: Budget of the in-memory LRU in bytes
+        mmap: Memory-map cached files instead of reading them into memory
+        onError: Function called with a message when a cache file cannot be written. None to print it
+    """
+
+    def __init__(self, cacheDir=None, maxBytes=512*2**20, mmap=True, onError=None):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.mmap = mmap
+        self.onError = onError or print
+        self.nBytes = 0
+        self.hits = self.diskHits = self.misses = 0
+        self._lru = OrderedDict() # key -> array, least recently used first
+        self._files = {} # (path, size, mtime) -> (content hash, sampling rate)
+        self._lock = threading.Lock() # read() can be called from several loader threads
+
+    def file_info(self, filename):
+        """Content hash and sampling rate of a file. Only re-read when its size or mtime changes"""
+        st = os.stat(filename)
+        stamp = (op.abspath(filename), st.st_size, st.st_mtime_ns)
+        info = self._files.get(stamp)
+        if info is None:
+            import soundfile as sf
+            digest = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    digest.update(block)
+            info = self._files[stamp] = (digest.hexdigest(), sf.info(filename).samplerate)
+        return info
+
+    def key(self, filename, new_fs=48000, dual=True, method='auto'):
+        digest, orig_fs = self.file_info(filename)
+        new_fs = orig_fs if new_fs is None else new_fs
+        engine = 'none' if new_fs == orig_fs else resample_method(orig_fs, new_fs, method)
+        return '%s_%g_%g_%s_%s' % (digest, orig_fs, new_fs, 'dual' if dual else 'orig', engine)
+
+    def read(self, filename, new_fs=48000, dual=True, method='auto'):
+        """Same as read_wav(filename, new_fs, dual, method=method), through the cache"""
+        key = self.key(filename, new_fs=new_fs, dual=dual, method=method)
+        with self._lock:
+            arr = self._lru.get(key)
+            if arr is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return arr
+
+        path = None if self.cacheDir is None else op.join(self.cacheDir, key + '.npy')
+        if path is not None and op.exists(path):
+            arr = np.load(path, mmap_mode='r' if self.mmap else None)
+            self.diskHits += 1
+        else:
+            arr = np.ascontiguousarray(read_wav(filename, new_fs=new_fs, dual=dual, method=method),
+                                       dtype=np.float32)
+            self.misses += 1
+            if path is not None and self._save(path, arr) and self.mmap:
+                arr = np.load(path, mmap_mode='r')
+        arr.setflags(write=False)
+        self._remember(key, arr)
+        return arr
+
+    def _save(self, path, arr):
+        """Write arr to path atomically. Returns False (and caches in memory only) on failure"""
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+            return True
+        except OSError as e:
+            self.onError('Could not write wav cache file %s: %s' % (path, e))
+            if op.exists(tmp):
+                os.remove(tmp)
+            return False
+
+    def _remember(self, key, arr):
+        if arr.nbytes > self.maxBytes:
+            return
+        with self._lock:
+            old = self._lru.pop(key, None)
+            if old is not None:
+                self.nBytes -= old.nbytes
+            self._lru[key] = arr
+            self.nBytes += arr.nbytes
+            while self.nBytes > self.maxBytes:
+                _, old = self._lru.popitem(last=False)
+                self.nBytes -= old.nbytes
+
+    def clear(self):
+        """Empty the in-memory cache. Files on disk are kept"""
+        with self._lock:
+            self._lru.clear()
+            self.nBytes = 0
+
+
+SOUND_EXTENSIONS = ('.wav', '.flac', '.ogg', '.aif', '.aiff')
+
+
+def _load_stimulus(path, sampleRate, dual, method, cacheDir):
+    """Load one stimulus in a worker process. Returns (array, seconds taken)"""
+    t0 = time.perf_counter()
+    cache = None if cacheDir is None else WavCache(cacheDir, maxBytes=0)
+    arr = np.array(read_wav(path, new_fs=sampleRate, dual=dual, cache=cache, method=method), dtype=np.float32)
+    return arr, time.perf_counter() - t0
+
+
+class StimulusLibrary:
+    """Every wav stimulus of a session, decoded and resampled before the first trial
+
+    The sound files named in the conditions' cuesound/choicesound columns (and,
+    with scan=True, every sound file in stimDir) are loaded once each, however
+    many trials use them, in a pool of threads or processes. Condition values
+    that are not sound file names (e.g. note names like 'A') are ignored.
+
+    Args:
+        stimDir: Folder holding the sound files
+        conditions: List of dicts, one per row of the conditions file
+        sampleRate: Sampling rate to resample to
+        columns: Condition columns that name sound files
+        scan: Also load every sound file in stimDir
+        dual: Make mono files stereo
+        method: Resampling engine. See read_wav
+        cache: Optional WavCache. Its files on disk are shared with process workers
+        workers: Number of threads/processes to load with. 0 loads one file at a time
+        executor: 'thread' or 'process'
+
+    Attributes:
+        sounds: Dict of file name (relative to stimDir) -> float32 array
+        loadTimes: Dict of file name -> seconds it took to load
+        references: Dict of file name -> number of condition cells naming it
+    """
+
+    def __init__(self, stimDir, conditions=(), sampleRate=48000, columns=('cuesound', 'choicesound'),
+                 scan=False, dual=True, method='auto', cache=None, workers=0, executor='thread'):
+        self.stimDir = stimDir
+        self.sampleRate = sampleRate
+        self.references = OrderedDict()
+        for condition in conditions:
+            for column in columns:
+                name = condition.get(column)
+                if isinstance(name, str) and name.lower().endswith(SOUND_EXTENSIONS):
+                    self.references[name] = self.references.get(name, 0) + 1
+        if scan:
+            for name in sorted(os.listdir(stimDir)):
+                if name.lower().endswith(SOUND_EXTENSIONS):
+                    self.references.setdefault(name, 0)
+        missing = [name for name in self.references if not op.isfile(op.join(stimDir, name))]
+        if missing:
+            raise FileNotFoundError('Stimuli not found in %s: %s' % (stimDir, ', '.join(missing)))
+
+        self.sounds = {}
+        self.loadTimes = {}
+        t0 = time.perf_counter()
+        names = list(self.references)
+        if executor == 'process' and workers and len(names) > 1:
+            cacheDir = None if cache is None else cache.cacheDir
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(_load_stimulus, op.join(stimDir, name), sampleRate, dual, method,
+                           cacheDir) for name in names]
+                for name, future in zip(names, futures):
+                    self.sounds[name], self.loadTimes[name] = future.result()
+        else:
+            def load(name):
+                t = time.perf_counter()
+                arr = read_wav(op.join(stimDir, name), new_fs=sampleRate, dual=dual, cache=cache, method=method)
+                return arr, time.perf_counter() - t
+            if workers and len(names) > 1:
+                with ThreadPoolExecutor(workers) as pool:
+                    results = list(pool.map(load, names))
+            else:
+                results = [load(name) for name in names]
+            for name, (arr, seconds) in zip(names, results):
+                self.sounds[name] = arr
+                self.loadTimes[name] = seconds
+        self.totalTime = time.perf_counter() - t0
+
+    def __getitem__(self, name):
+        return self.sounds[name]
+
+    def __contains__(self, name):
+        return name in self.sounds
+
+    def __len__(self):
+        return len(self.sounds)
+
+    @property
+    def nBytes(self):
+        """Total size of the loaded sounds in bytes"""
+        return sum(arr.nbytes for arr in self.sounds.values())
+
+    def report(self):
+        """Per-file load time and size, and the totals, as printable text"""
+        lines = ['%-30s %6s %9s %9s %8s' % ('stimulus', 'refs', 'secs', 'load ms', 'MB')]
+        for name, arr in self.sounds.items():
+            lines.append('%-30s %6d %9.2f %9.1f %8.2f' % (name, self.references[name],
+                         arr.shape[0] / self.sampleRate, self.loadTimes[name] * 1e3, arr.nbytes / 1e6))
+        lines.append('%d unique stimuli (%d references) loaded in %.1f ms, %.2f MB in total'
+                     % (len(self.sounds), sum(self.references.values()), self.totalTime * 1e3, self.nBytes / 1e6))
+        return '\n'.join(lines)
+
+
+def pulse_train(arr, period, reps, blanks=[], stereo=False, out=None):
+    """Repeat arr every `period` samples, with silence in between
+
+    The output is allocated once and viewed as (reps, period) frames, so each
+    repetition is written in place with a single broadcast assignment.
+
+    Args:
+        arr: Sound to repeat. (n,) for mono or (n, nChannels)
+        period: Samples from the onset of one repetition to the next (>= n)
+        reps: Number of repetitions
+        blanks: Repetitions (counting from 1) that should be silent
+        stereo: Duplicate a mono arr onto two channels
+        out: Optional preallocated float32 array of the output's shape to write into
+
+    Returns: (reps*period,) or (reps*period, nChannels) float32 array
+    """
+    arr = np.asarray(arr, dtype=np.float32)
+    n = arr.shape[0]
+    if stereo and arr.ndim == 1:
+        arr = np.repeat(arr[:, None], 2, axis=1)
+    shape = (reps * period,) + arr.shape[1:]
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape:
+        raise ValueError('out has shape %s, expected %s' % (out.shape, shape))
+
+    blankReps = np.atleast_1d(np.asarray(blanks, dtype=int)) - 1
+    active = np.ones(reps, dtype=bool)
+    active[blankReps[(blankReps >= 0) & (blankReps < reps)]] = False
+
+    frames = out.reshape((reps, period) + arr.shape[1:])
+    frames[:, n:] = 0
+    frames[active, :n] = arr
+    frames[~active, :n] = 0
+    return out
+
+
+def render_loop(period, reps):
+    """What an audio backend plays when told to repeat `period` reps times
+
+    Used to check looped playback offline against a fully rendered stream.
+    """
+    return np.tile(period, (reps,) + (1,) * (period.ndim - 1))
+
+
+def detect_onsets(arr, sampleRate, threshold=0.5):
+    """Times (s) at which the signal's magnitude first rises above threshold after being below it"""
+    level = np.abs(arr) if arr.ndim == 1 else np.abs(arr).max(axis=1)
+    above = level > threshold
+    onsets = np.flatnonzero(above[1:] & ~above[:-1]) + 1
+    if above.size and above[0]:
+        onsets = np.concatenate(([0], onsets))
+    return onsets / sampleRate
+
+
+class TrialAudioComposer:
+    """Assembles a trial's audio segments end to end in one reusable buffer
+
+    The buffer is allocated once, sized for the longest trial, and each trial's
+    segments are copied into it in place. Read-only segments (e.g. a click train
+    marked with arr.setflags(write=False)) that are already sitting at the same
+    position from the previous trial are not copied again.
+
+    Args:
+        maxSamples: Length of the longest trial in samples
+        sampleRate: Sampling rate of the audio
+        nChannels: Number of audio channels
+    """
+
+    def __init__(self, maxSamples, sampleRate, nChannels=2):
+        self.sampleRate = sampleRate
+        self.buffer = np.zeros((int(maxSamples), nChannels), dtype=np.float32)
+        self._inPlace = {} # start sample -> (stop sample, read-only segment held there)
+
+    def compose(self, segments):
+        """Write segments one after another into the buffer
+
+        Args:
+            segments: List of (name, array) or (name, array, eventTimes) in playing
+                order. eventTimes are times (s) relative to the segment's onset, e.g.
+                click onsets within a click train
+
+        Returns:
+            audio: View of the buffer holding the whole trial. Valid until the next compose()
+            timing: Dict of name -> {'onset': s, 'offset': s, 'events': array of s or None},
+                all relative to the start of the trial audio
+        """
+        timing = {}
+        pos = 0
+        for segment in segments:
+            name, arr = segment[:2]
+            n = arr.shape[0]
+            stop = pos + n
+            if stop > self.buffer.shape[0]:
+                raise ValueError('Trial audio needs %d samples but the buffer holds %d'
+                                 % (stop, self.buffer.shape[0]))
+            placed = self._inPlace.get(pos)
+            if placed is None or placed[0] != stop or placed[1] is not arr:
+                self._write(pos, arr)
+            onset = pos / self.sampleRate
+            events = None if len(segment) < 3 else onset + np.asarray(segment[2])
+            timing[name] = {'onset': onset, 'offset': stop / self.sampleRate, 'events': events}
+            pos = stop
+        return self.buffer[:pos], timing
+
+    def _write(self, start, arr):
+        stop = start + arr.shape[0]
+        # Anything overlapping this range is no longer in place
+        for s in [s for s, (e, _) in self._inPlace.items() if s < stop and e > start]:
+            del self._inPlace[s]
+        self.buffer[start:stop] = arr
+        if not arr.flags.writeable:
+            self._inPlace[start] = (stop, arr)
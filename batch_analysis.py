@@ -0,0 +1,251 @@
+"""
+Summary of every run in logs/, computed in parallel and cached per run
+"""
+
+import csv
+import json
+import os
+import os.path as op
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import event_times, iter_gaze_chunks, read_gaze_columns, read_trials, run_files
+
+# Session details copied from the trial csv (expInfo columns) into the summary
+RUN_INFO = ['date', 'responseType', 'eyetracker', 'monitor', 'ttl']
+
+# Version of the summary rows. Raise it when what summarize_run computes changes,
+# so summaries cached by an older version are recomputed
+SUMMARY_VERSION = 1
+
+# Gaze columns the data loss is computed from, per eye
+_LOSS_COLUMNS = [('left', 'leftGazePointValidity', 'xLeftGazePositionOnDisplay'),
+                 ('right', 'rightGazePointValidity', 'xRightGazePositionOnDisplay')]
+
+
+def find_runs(logsDir):
+    """Run folders in logsDir, as made by utils.openingDlg (logs/<runid>/ holding <runid>.csv)"""
+    if not op.isdir(logsDir):
+        return []
+    runs = [op.join(logsDir, name) for name in sorted(os.listdir(logsDir))]
+    return [runDir for runDir in runs if op.isdir(runDir) and run_files(runDir)['trials'] is not None]
+
+
+def run_inputs(runDir):
+    """The files a run's summary is computed from"""
+    files = run_files(runDir)
+    paths = [files['trials'], files['gaze'], op.join(runDir, files['runid'] + '_etValidation.csv')]
+    return [path for path in paths if path is not None and op.isfile(path)]
+
+
+def run_stamp(runDir):
+    """Name, size and mtime of every input of a run. The cached summary is reused while this is unchanged"""
+    stamp = []
+    for path in run_inputs(runDir):
+        st = os.stat(path)
+        stamp.append([op.basename(path), st.st_size, st.st_mtime_ns])
+    return stamp
+
+
+def behavior_summary(trials):
+    """Accuracy, response times and timeouts of a run
+
+    A trial timed out when its response is 'NA' (response_time 0). Accuracy
+    is over the trials with a response, against correctResponse, and is NaN
+    for runs recorded before correctResponse was saved. Response times are
+    from when the response boxes were shown (response_allowed).
+
+    Args:
+        trials: Trial columns (see analysis.read_trials)
+
+    Returns: Dict of summary values
+    """
+    responses = trials.get('response', [])
+    nTrials = len(responses)
+    responded = np.array([value not in ('', 'NA', 'None') for value in responses], dtype=bool)
+    if 'correctResponse' in trials:
+        correct = np.array([r == c for r, c in zip(responses, trials['correctResponse'])], dtype=bool)
+        accuracy = correct[responded].mean() if responded.any() else np.nan
+    else:
+        accuracy = np.nan
+    rt = (event_times(trials, 'response_time') - event_times(trials, 'response_allowed'))[responded]
+    rt = rt[~np.isnan(rt)]
+    return {'trials': nTrials,
+            'responses': int(responded.sum()),
+            'timeouts': int(nTrials - responded.sum()),
+            'accuracy': accuracy,
+            'rt_mean': rt.mean() if rt.size else np.nan,
+            'rt_median': np.median(rt) if rt.size else np.nan,
+            'rt_sd': rt.std() if rt.size else np.nan}
+
+
+def gaze_quality(gazePath, chunkRows=200000):
+    """Length, sampling rate, gaps and data loss of a gaze recording, read in one pass
+
+    A sample is lost for an eye when its gaze point is not valid. A gap is a
+    step between samples of more than 2.5 median sample periods, and the
+    sampling rate is taken over the time outside the gaps.
+
+    Returns: Dict of summary values
+    """
+    columns = read_gaze_columns(gazePath)
+    timeColumn = 'correctedTime' if 'correctedTime' in columns else 'expTime'
+    names = [timeColumn] + [name for _, validity, x in _LOSS_COLUMNS for name in (validity, x)]
+    n = 0
+    lost = np.zeros(len(_LOSS_COLUMNS), dtype=np.int64)
+    gaps = 0
+    gapTime = 0.
+    tFirst = tLast = period = None
+    for chunk in iter_gaze_chunks(gazePath, [columns.index(name) for name in names], chunkRows):
+        t = chunk[:, 0]
+        for ii in range(len(_LOSS_COLUMNS)):
+            validity, x = chunk[:, 1 + 2*ii], chunk[:, 2 + 2*ii]
+            lost[ii] += np.count_nonzero((validity != 1) | np.isnan(x))
+        t = t[~np.isnan(t)]
+        if t.size:
+            if tLast is not None:
+                t = np.concatenate([[tLast], t])
+            step = np.diff(t)
+            if period is None and step.size:
+                period = np.median(step)
+            if period is not None:
+                gap = step > 2.5 * period
+                gaps += int(np.count_nonzero(gap))
+                gapTime += step[gap].sum()
+            tFirst = t[0] if tFirst is None else tFirst
+            tLast = t[-1]
+        n += chunk.shape[0]
+    duration = np.nan if tFirst is None else tLast - tFirst
+    quality = {'et_samples': n,
+               'et_minutes': duration / 60,
+               'et_rate': (n - 1 - gaps) / (duration - gapTime) if n > 1 and duration > gapTime else np.nan,
+               'et_gaps': gaps,
+               'et_gap_time': gapTime}
+    for ii, (eye, _, _) in enumerate(_LOSS_COLUMNS):
+        quality['et_loss_' + eye] = lost[ii] / n if n else np.nan
+    return quality
+
+
+def validation_summary(validationPath):
+    """Mean accuracy, precision (deg) and data loss over the points and eyes of an _etValidation.csv"""
+    with open(validationPath, newline='') as f:
+        rows = list(csv.DictReader(f))
+    summary = {}
+    for key in ['accuracy', 'precision', 'dataLoss']:
+        values = np.array([float(row[key]) for row in rows]) if rows else np.array([np.nan])
+        summary['validation_' + key] = np.nanmean(values) if np.any(~np.isnan(values)) else np.nan
+    return summary
+
+
+def summarize_run(runDir):
+    """One row of the summary table: behavior, gaze quality and eyetracker validation of a run"""
+    files = run_files(runDir)
+    trials = read_trials(files['trials'])
+    row = {'runid': files['runid']}
+    for key in RUN_INFO:
+        if trials.get(key):
+            row[key] = trials[key][0]
+    row.update(behavior_summary(trials))
+    if files['gaze'] is not None:
+        row.update(gaze_quality(files['gaze']))
+    validationPath = op.join(runDir, files['runid'] + '_etValidation.csv')
+    if op.isfile(validationPath):
+        row.update(validation_summary(validationPath))
+    return row
+
+
+def _load_cache(cachePath, onError=print):
+    if cachePath is None or not op.isfile(cachePath):
+        return {}
+    try:
+        with open(cachePath) as f:
+            return json.load(f)
+    except ValueError:
+        onError('Ignoring unreadable summary cache %s' % cachePath)
+        return {}
+
+
+def _save_cache(cachePath, cache):
+    tmpPath = cachePath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmpPath, cachePath)
+
+
+def summarize_runs(logsDir, workers=4, cachePath=None, onError=None):
+    """Summarise every run in logsDir, reusing cached summaries of runs whose files have not changed
+
+    Runs that are new or changed since the cache was written, or whose cached
+    summary is from another SUMMARY_VERSION, are summarised in a pool of
+    worker processes, each run in one process.
+
+    Args:
+        logsDir: The logs folder
+        workers: Worker processes (0 to summarise the runs one after another in this process)
+        cachePath: json file the summaries are cached in. None for no cache
+        onError: Function called with a message about runs that could not be summarised. None to print it
+
+    Returns:
+        rows: List of summary rows (dicts), one per run, in runid order
+        nComputed: Number of runs that were summarised (not taken from the cache)
+    """
+    onError = onError or print
+    runs = find_runs(logsDir)
+    stamps = {op.basename(runDir): run_stamp(runDir) for runDir in runs}
+    # Entries of runs that are gone, changed or from another version are dropped
+    cached = _load_cache(cachePath, onError)
+    cache = {runid: entry for runid, entry in cached.items()
+             if isinstance(entry, dict) and entry.get('version') == SUMMARY_VERSION
+             and entry.get('stamp') == stamps.get(runid)}
+    todo = [runDir for runDir in runs if op.basename(runDir) not in cache]
+
+    def store(runDir, row):
+        runid = op.basename(runDir)
+        cache[runid] = {'version': SUMMARY_VERSION, 'stamp': stamps[runid], 'row': row}
+
+    if workers and len(todo) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [(runDir, pool.submit(summarize_run, runDir)) for runDir in todo]
+            for runDir, future in futures:
+                try:
+                    store(runDir, future.result())
+                except Exception as error:
+                    onError('Could not summarise %s: %s' % (runDir, error))
+    else:
+        for runDir in todo:
+            try:
+                store(runDir, summarize_run(runDir))
+            except Exception as error:
+                onError('Could not summarise %s: %s' % (runDir, error))
+
+    if cachePath is not None and (todo or len(cache) != len(cached)):
+        _save_cache(cachePath, cache)
+    rows = [cache[op.basename(runDir)]['row'] for runDir in runs if op.basename(runDir) in cache]
+    return rows, len(todo)
+
+
+def write_summary(rows, csvPath):
+    """Write the summary rows as one csv, with the union of their columns"""
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    with open(csvPath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: '%.6g' % value if isinstance(value, float) else value for key, value in row.items()})
+
+
+if __name__ == '__main__':
+    # python batch_analysis.py [logs] [workers]
+    logsDir = sys.argv[1] if len(sys.argv) > 1 else op.join(op.dirname(op.abspath(__file__)), 'logs')
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rows, nComputed = summarize_runs(logsDir, workers, cachePath=op.join(logsDir, 'summary_cache.json'))
+    if not rows:
+        print('No runs in %s' % logsDir)
+        sys.exit(1)
+    csvPath = op.join(logsDir, 'summary.csv')
+    write_summary(rows, csvPath)
+    print('Summarised %d runs (%d new or changed) to %s' % (len(rows), nComputed, csvPath))
@@ -0,0 +1,126 @@
+"""
+Equivalence and scaling benchmark for the click/tone stream builders
+
+createAudioStream and createToneReps used to grow their output with
+np.concatenate/np.vstack inside the repetition loop. Both now call
+audio.pulse_train, which allocates once. This checks that the new output is
+sample-exact against the loop versions (blanks, mono/stereo, the out= buffer
+included) and times both as the number of repetitions grows. The loop
+versions are skipped above 1000 reps because they are quadratic.
+
+Usage: python benchmarks/bench_audio_builders.py
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import pulse_train, synthesize_tones, to_stereo
+
+
+def legacy_createAudioStream(arr, soa, samplingRate, reps, blanks=[],prepare=True):
+    dur = len(arr) / samplingRate
+    offset2onset_time = soa - dur
+    offset2onset_padding = np.zeros(round(samplingRate * offset2onset_time))
+    blankPeriod = np.zeros(arr.size)
+    if not isinstance(blanks,list):
+        blanks = [blanks]
+    blankReps = np.array(blanks) - 1
+    audioStream = np.array([])
+    for ii in range(reps):
+        if ii in blankReps:
+            audioStream = np.concatenate((audioStream, blankPeriod, offset2onset_padding))
+        else:
+            audioStream = np.concatenate((audioStream, arr, offset2onset_padding))
+    if prepare:
+        audioStream = np.vstack((audioStream,audioStream)).T.astype('float32')
+    return audioStream
+
+
+def legacy_createToneReps(tone, blank_dur=0.05, reps=2, sampleRate=44100):
+    blank = np.zeros(( round(blank_dur*sampleRate), 2))
+    for ii in range(reps):
+        if ii == 0:
+            arr = tone
+        else:
+            arr = np.vstack((arr, tone))
+        arr = np.vstack((arr, blank))
+    return arr
+
+
+def new_createAudioStream(arr, soa, samplingRate, reps, blanks=[], prepare=True, out=None):
+    """utils.createAudioStream without importing psychopy"""
+    period = len(arr) + round(samplingRate * (soa - len(arr) / samplingRate))
+    if not isinstance(blanks,list):
+        blanks = [blanks]
+    return pulse_train(arr, period, reps, blanks=blanks, stereo=prepare, out=out)
+
+
+def new_createToneReps(tone, blank_dur=0.05, reps=2, sampleRate=44100, out=None):
+    return pulse_train(tone, tone.shape[0] + round(blank_dur*sampleRate), reps, out=out)
+
+
+def check_equivalence(fs=48000):
+    click = np.ones(round(0.01*fs))
+    tone = to_stereo(synthesize_tones([440.], 0.05, fs))
+    cases = [
+        ('clicks stereo', lambda f: f(click, 0.624, fs, 96)),
+        ('clicks mono', lambda f: f(click, 0.624, fs, 7, prepare=False)),
+        ('clicks blanks list', lambda f: f(click, 0.1, fs, 10, blanks=[1, 4, 10])),
+        ('clicks blank int', lambda f: f(click, 0.1, fs, 10, blanks=3)),
+        ('clicks blank out of range', lambda f: f(click, 0.1, fs, 5, blanks=[0, 9])),
+        ('clicks 44.1k odd soa', lambda f: f(click[:441], 0.0137, 44100, 33)),
+    ]
+    ok = True
+    for name, case in cases:
+        old = case(legacy_createAudioStream)
+        new = case(new_createAudioStream)
+        same = old.shape == new.shape and np.array_equal(old, new)
+        ok &= same
+        print('%-28s %s' % (name, 'ok' if same else 'MISMATCH'))
+
+    old = legacy_createToneReps(tone, reps=15, sampleRate=fs)
+    new = new_createToneReps(tone, reps=15, sampleRate=fs)
+    same = old.shape == new.shape and np.array_equal(old, new)
+    ok &= same
+    print('%-28s %s' % ('tone reps', 'ok' if same else 'MISMATCH'))
+
+    out = np.full((96*29952, 2), np.nan, dtype=np.float32)
+    new = new_createAudioStream(click, 0.624, fs, 96, out=out)
+    same = new is out and np.array_equal(out, legacy_createAudioStream(click, 0.624, fs, 96))
+    ok &= same
+    print('%-28s %s' % ('out= buffer', 'ok' if same else 'MISMATCH'))
+    return ok
+
+
+def time_it(fn, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def scaling(fs=48000):
+    click = np.ones(round(0.01*fs))
+    tone = to_stereo(synthesize_tones([440.], 0.05, fs))
+    print('\n%6s %14s %14s %14s %14s' % ('reps', 'clicks old ms', 'clicks new ms', 'tones old ms', 'tones new ms'))
+    for reps in [10, 100, 1000, 5000]:
+        newClick = time_it(lambda: new_createAudioStream(click, 0.02, fs, reps))
+        newTone = time_it(lambda: new_createToneReps(tone, 0.05, reps, fs))
+        if reps <= 1000:
+            oldClick = '%14.2f' % (time_it(lambda: legacy_createAudioStream(click, 0.02, fs, reps), 1)*1e3)
+            oldTone = '%14.2f' % (time_it(lambda: legacy_createToneReps(tone, 0.05, reps, fs), 1)*1e3)
+        else:
+            oldClick = oldTone = '%14s' % '-'
+        print('%6d %s %14.2f %s %14.2f' % (reps, oldClick, newClick*1e3, oldTone, newTone*1e3))
+
+
+if __name__ == '__main__':
+    ok = check_equivalence()
+    scaling()
+    sys.exit(not ok)
@@ -0,0 +1,94 @@
+"""
+Batch summary of a logs folder with batch_analysis.summarize_runs
+
+Builds a logs folder of synthetic runs (a trial csv and a binary 600 Hz
+gaze file each) and times summarising it:
+  - one run after another in this process
+  - in a pool of worker processes
+  - again with the cache, when nothing changed
+  - again after one run's trial csv was rewritten
+  - again after SUMMARY_VERSION was raised
+The rows of the serial and the parallel pass must be identical, the cached
+passes must only recompute the changed run, and the new version must
+recompute every run.
+
+Usage: python benchmarks/bench_batch_analysis.py [nRuns] [minutes] [workers]
+"""
+
+import csv
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+import batch_analysis
+from batch_analysis import summarize_runs
+from eyetracking import ETcolumns
+from gazeio import write_gaze_header
+
+
+def make_run(logsDir, runid, minutes, seed):
+    rng = np.random.default_rng(seed)
+    runDir = op.join(logsDir, runid)
+    os.makedirs(runDir)
+    nTrials = int(minutes * 6)
+    onsets = 5.0 + 10.0 * np.arange(nTrials)
+    rt = rng.uniform(0.3, 2.0, nTrials)
+    timeout = rng.random(nTrials) < 0.1
+    correct = rng.choice(['same', 'diff'], nTrials)
+    response = np.where(rng.random(nTrials) < 0.8, correct, np.where(correct == 'same', 'diff', 'same'))
+    with open(op.join(runDir, runid + '.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['audio_onset', 'response_allowed', 'response_time', 'response', 'correctResponse',
+                         'responseType', 'eyetracker'])
+        for ii in range(nTrials):
+            writer.writerow([onsets[ii], onsets[ii] + 4, 0 if timeout[ii] else onsets[ii] + 4 + rt[ii],
+                             'NA' if timeout[ii] else response[ii], correct[ii], 'saccade', '600'])
+    n = int(minutes * 60 * 600)
+    data = rng.random((n, len(ETcolumns)))
+    data[:, ETcolumns.index('correctedTime')] = np.arange(n) / 600
+    for name in ['leftGazePointValidity', 'rightGazePointValidity']:
+        data[:, ETcolumns.index(name)] = rng.random(n) > 0.02
+    with open(op.join(runDir, runid + '_et.bin'), 'wb') as f:
+        write_gaze_header(f, ETcolumns)
+        data.tofile(f)
+
+
+def timed(label, *args, **kwargs):
+    t0 = time.perf_counter()
+    rows, nComputed = summarize_runs(*args, **kwargs)
+    print('%-28s %7.2f s   %d runs, %d summarised' % (label, time.perf_counter() - t0, len(rows), nComputed))
+    return rows, nComputed
+
+
+def main(nRuns=16, minutes=20, workers=4):
+    with tempfile.TemporaryDirectory() as logsDir:
+        for ii in range(nRuns):
+            make_run(logsDir, 'sub%02d' % ii, minutes, ii)
+        cachePath = op.join(logsDir, 'summary_cache.json')
+        serial, _ = timed('serial, no cache', logsDir, 0)
+        parallel, _ = timed('%d workers, no cache' % workers, logsDir, workers, cachePath)
+        _, nCached = timed('%d workers, cached' % workers, logsDir, workers, cachePath)
+        runDir = op.join(logsDir, 'sub00')
+        with open(op.join(runDir, 'sub00.csv'), 'a') as f:
+            f.write('1000,1004,0,NA,same,saccade,600\n')
+        changed, nChanged = timed('%d workers, one run changed' % workers, logsDir, workers, cachePath)
+        batch_analysis.SUMMARY_VERSION += 1
+        _, nVersion = timed('%d workers, new version' % workers, logsDir, workers, cachePath)
+        batch_analysis.SUMMARY_VERSION -= 1
+    same = serial == parallel
+    ok = same and nCached == 0 and nChanged == 1 and nVersion == nRuns and changed[0]['trials'] == serial[0]['trials'] + 1
+    print('serial and parallel rows identical: %s' % same)
+    print('first run: accuracy %.3f, timeouts %d, mean RT %.3f s, left eye loss %.3f'
+          % (serial[0]['accuracy'], serial[0]['timeouts'], serial[0]['rt_mean'], serial[0]['et_loss_left']))
+    print('ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(0 if main(*[int(a) for a in args[:1]], *[float(a) for a in args[1:2]], *[int(a) for a in args[2:3]]) else 1)
@@ -0,0 +1,102 @@
+"""
+Epoching of gaze recordings with analysis.epoch_gaze
+
+Writes a synthetic 1200 Hz recording (sample times with jitter, dropouts
+of invalid samples and a few gaps with no samples at all) as a binary gaze
+file, and a shorter one as an _et.csv, and epochs them around one event
+every 10 s. Reported are the time to epoch each file and the largest
+difference from a reference that interpolates every epoch and channel
+separately with np.interp on the whole recording in memory.
+
+Usage: python benchmarks/bench_epoching.py [minutes] [csvMinutes] [outdir]
+    minutes (binary file) defaults to 60, csvMinutes to 10. Writing the csv
+    takes a few minutes at that length.
+"""
+
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from analysis import EPOCH_CHANNELS, epoch_gaze
+from eyetracking import ETcolumns
+from gazeio import gaze_binary_to_csv, write_gaze_header
+
+RATE = 1200
+
+
+def make_recording(minutes, seed=0):
+    """(nSamples,ncols) gaze samples in ETcolumns layout"""
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * RATE)
+    data = rng.random((n, len(ETcolumns)))
+    t = 5.0 + np.arange(n) / RATE + rng.normal(0, 1e-5, n)
+    keep = np.ones(n, dtype=bool)
+    for start in rng.integers(0, n, max(1, int(minutes))):
+        keep[start:start + RATE // 10] = False # 100 ms with no samples
+    data[:, ETcolumns.index('correctedTime')] = t
+    data[:, ETcolumns.index('expTime')] = t + 0.002
+    for name in EPOCH_CHANNELS:
+        col = ETcolumns.index(name)
+        data[:, col] = np.sin(2 * np.pi * 0.7 * t + col)
+        data[rng.random(n) < 0.01, col] = np.nan # invalid samples
+    return data[keep]
+
+
+def reference(data, events, times, maxGap):
+    t = data[:, ETcolumns.index('correctedTime')]
+    out = np.full((events.size, times.size, len(EPOCH_CHANNELS)), np.nan)
+    for ii, event in enumerate(events):
+        q = event + times
+        idx = np.clip(np.searchsorted(t, q, 'right') - 1, 0, t.size - 2)
+        inside = (q >= t[0]) & (q <= t[-1]) & (t[idx + 1] - t[idx] <= maxGap)
+        for jj, name in enumerate(EPOCH_CHANNELS):
+            y = data[:, ETcolumns.index(name)]
+            values = np.interp(q, t, y)
+            # np.interp skips nothing: a NaN neighbour must give NaN
+            values[np.isnan(y[idx]) | np.isnan(y[idx + 1])] = np.nan
+            values[~inside] = np.nan
+            out[ii, :, jj] = values
+    return out
+
+
+def check(path, data, events, label):
+    t0 = time.perf_counter()
+    epochs, times, channels = epoch_gaze(path, events, -1.0, 3.0)
+    elapsed = time.perf_counter() - t0
+    expected = reference(data, events, times, 2.5 / RATE)
+    same = np.array_equal(np.isnan(epochs), np.isnan(expected))
+    diff = np.nanmax(np.abs(epochs - expected))
+    print('%-8s %7.1f min %9d samples %8.2f s   max diff %.2e   same NaNs %s   %.1f%% NaN'
+          % (label, data.shape[0] / RATE / 60, data.shape[0], elapsed, diff, same, 100 * np.isnan(epochs).mean()))
+    return same and diff < 1e-9
+
+
+def main(minutes=60, csvMinutes=10, outdir=None):
+    outdir = outdir or tempfile.mkdtemp(prefix='epoch_bench_')
+    ok = True
+    for label, length in [('binary', minutes), ('csv', csvMinutes)]:
+        data = make_recording(length)
+        binPath = op.join(outdir, 'bench_et.bin')
+        with open(binPath, 'wb') as f:
+            write_gaze_header(f, ETcolumns)
+            data.tofile(f)
+        path = binPath
+        if label == 'csv':
+            path = op.join(outdir, 'bench_et.csv')
+            gaze_binary_to_csv(binPath, path)
+        t = data[:, ETcolumns.index('correctedTime')]
+        events = np.arange(t[0] + 0.5, t[-1] + 1.0, 10.0) # the last epoch runs past the recording
+        events[3] = np.nan # a trial without the event
+        ok &= check(path, data, events, label)
+    print('Files left in %s' % outdir)
+    print('ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(0 if main(*[float(a) for a in args[:2]], *args[2:3]) else 1)
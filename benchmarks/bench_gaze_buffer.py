@@ -0,0 +1,74 @@
+"""
+Benchmark storing a simulated 1200 Hz gaze stream
+
+Compares the per-sample cost of GazeBuffer against the old np.append approach.
+The cost of GazeBuffer should stay flat as the recording grows while np.append
+grows linearly with the number of samples already stored.
+
+Usage: python benchmarks/bench_gaze_buffer.py [seconds]
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns, GazeBuffer
+
+
+def sample_generator(freq=1200, seed=0):
+    """Yield synthetic 33-column gaze samples at `freq` Hz"""
+    rng = np.random.default_rng(seed)
+    ncols = len(ETcolumns)
+    t = 0.
+    while True:
+        sample = rng.random(ncols)
+        sample[0] = t
+        t += 1/freq
+        yield sample
+
+
+def time_blocks(store, samples, nBlocks, blockSize):
+    """Time each block of blockSize appends. Returns seconds per sample per block"""
+    perSample = np.empty(nBlocks)
+    for b in range(nBlocks):
+        t0 = time.perf_counter()
+        for _ in range(blockSize):
+            store(next(samples))
+        perSample[b] = (time.perf_counter() - t0) / blockSize
+    return perSample
+
+
+def main(seconds=20, freq=1200):
+    blockSize = freq # one second of data per block
+    nBlocks = int(seconds)
+
+    # Ring buffer
+    buf = GazeBuffer(seconds*freq)
+    ringCost = time_blocks(buf.append, sample_generator(freq), nBlocks, blockSize)
+
+    # np.append (what gaze_callback used to do)
+    state = {'ETdata': np.empty((0, len(ETcolumns)))}
+    def np_append(sample):
+        state['ETdata'] = np.append(state['ETdata'], sample[None, :], axis=0)
+    appendCost = time_blocks(np_append, sample_generator(freq), nBlocks, blockSize)
+
+    print('Per-sample append cost (us) at %d Hz' % freq)
+    print('%8s %12s %12s' % ('second', 'GazeBuffer', 'np.append'))
+    for b in range(0, nBlocks, max(1, nBlocks//10)):
+        print('%8d %12.2f %12.2f' % (b+1, ringCost[b]*1e6, appendCost[b]*1e6))
+    print('%8s %12.2f %12.2f' % ('last', ringCost[-1]*1e6, appendCost[-1]*1e6))
+    print('Growth first->last second: GazeBuffer x%.2f, np.append x%.2f'
+          % (ringCost[-1]/ringCost[0], appendCost[-1]/appendCost[0]))
+
+    # Reading the saccade window must not depend on how much has been recorded
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        buf.last(int(0.5*freq))
+    print('last(%d) view: %.2f us' % (int(0.5*freq), (time.perf_counter()-t0)*1e3))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
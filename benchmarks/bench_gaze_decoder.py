@@ -0,0 +1,158 @@
+"""
+Microbenchmark decoding tobii gaze samples
+
+Uses stand-ins for tobii_research's GazeData classes. They are built with the
+same class and attribute names, so the name-mangled private attributes read by
+the old gaze_callback exist on them. No eyetracker is needed.
+
+Usage: python benchmarks/bench_gaze_decoder.py
+"""
+
+import os.path as op
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns, GAZE_FIELDS, GazeBuffer, GazeDecoder
+
+
+class GazeOrigin:
+    def __init__(self, d, eye):
+        self.__position_in_user_coordinates = d[eye + '_gaze_origin_in_user_coordinate_system']
+        self.__position_in_track_box_coordinates = d[eye + '_gaze_origin_in_trackbox_coordinate_system']
+        self.__validity = d[eye + '_gaze_origin_validity']
+
+
+class GazePoint:
+    def __init__(self, d, eye):
+        self.__position_on_display_area = d[eye + '_gaze_point_on_display_area']
+        self.__position_in_user_coordinates = d[eye + '_gaze_point_in_user_coordinate_system']
+        self.__validity = d[eye + '_gaze_point_validity']
+
+
+class PupilData:
+    def __init__(self, d, eye):
+        self.__diameter = d[eye + '_pupil_diameter']
+        self.__validity = d[eye + '_pupil_validity']
+
+
+class EyeData:
+    def __init__(self, d, eye):
+        self.__gaze_origin = GazeOrigin(d, eye)
+        self.__gaze_point = GazePoint(d, eye)
+        self.__pupil_data = PupilData(d, eye)
+
+
+class GazeData:
+    def __init__(self, d):
+        self.__device_time_stamp = d['device_time_stamp']
+        self.__system_time_stamp = d['system_time_stamp']
+        self.__left = EyeData(d, 'left')
+        self.__right = EyeData(d, 'right')
+
+
+def fake_gaze_dict(rng):
+    """A sample shaped like tobii's as_dictionary=True output"""
+    d = {}
+    for width, _, key in GAZE_FIELDS:
+        if key.endswith('validity'):
+            d[key] = 1
+        elif width == 1:
+            d[key] = float(rng.random())
+        else:
+            d[key] = tuple(rng.random(width).tolist())
+    d['device_time_stamp'] = int(rng.integers(1e9))
+    d['system_time_stamp'] = int(rng.integers(1e12))
+    return d
+
+
+def legacy_callback(gazedata, store):
+    """The per-sample work the old main.gaze_callback did, minus the np.append"""
+    cdata = np.zeros((1,len(ETcolumns)))
+    cdata[0,0] = 0.
+    cdata[0,1] = gazedata._GazeData__device_time_stamp
+    cdata[0,2] = gazedata._GazeData__system_time_stamp
+    cdata[0,3] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[0]
+    cdata[0,4] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[1]
+    cdata[0,5] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[2]
+    cdata[0,6] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[0]
+    cdata[0,7] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[1]
+    cdata[0,8] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[2]
+    cdata[0,9] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__validity
+    cdata[0,10] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[0]
+    cdata[0,11] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[1]
+    cdata[0,12] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[2]
+    cdata[0,13] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_on_display_area[0]
+    cdata[0,14] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_on_display_area[1]
+    cdata[0,15] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__validity
+    cdata[0,16] = gazedata._GazeData__left._EyeData__pupil_data._PupilData__diameter
+    cdata[0,17] = gazedata._GazeData__left._EyeData__pupil_data._PupilData__validity
+    cdata[0,18] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[0]
+    cdata[0,19] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[1]
+    cdata[0,20] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[2]
+    cdata[0,21] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[0]
+    cdata[0,22] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[1]
+    cdata[0,23] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[2]
+    cdata[0,24] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__validity
+    cdata[0,25] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[0]
+    cdata[0,26] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[1]
+    cdata[0,27] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[2]
+    cdata[0,28] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_on_display_area[0]
+    cdata[0,29] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_on_display_area[1]
+    cdata[0,30] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__validity
+    cdata[0,31] = gazedata._GazeData__right._EyeData__pupil_data._PupilData__diameter
+    cdata[0,32] = gazedata._GazeData__right._EyeData__pupil_data._PupilData__validity
+    store.append(cdata[0])
+
+
+def decoder_callback(decoder, gazedata, store):
+    row = store.next_row()
+    row[0] = 0.
+    decoder.decode(gazedata, row)
+    store.commit()
+
+
+def batch_callback(buffer, gazedata):
+    """What main.gaze_callback does: queue the sample, decoded by the buffer in batches"""
+    buffer.put(0., gazedata)
+
+
+def main(number=20000, batchSize=32):
+    rng = np.random.default_rng(0)
+    sampleDict = fake_gaze_dict(rng)
+    sampleObj = GazeData(sampleDict)
+
+    # All three paths must produce the same row
+    ref = GazeBuffer(1)
+    legacy_callback(sampleObj, ref)
+    for asDictionary, sample in [(True, sampleDict), (False, sampleObj)]:
+        row = np.zeros(len(ETcolumns))
+        GazeDecoder(asDictionary).decode(sample, row)
+        assert np.array_equal(row[1:-1], ref.data[0, 1:-1]), 'decoder output differs from legacy callback'
+        rows = np.zeros((3, len(ETcolumns)))
+        GazeDecoder(asDictionary).decode_batch([sample] * 3, rows)
+        assert np.array_equal(rows[:, 1:-1], np.tile(ref.data[0, 1:-1], (3, 1))), 'batch output differs from legacy callback'
+
+    store = GazeBuffer(number)
+    objDecoder = GazeDecoder(asDictionary=False)
+    dictDecoder = GazeDecoder(asDictionary=True)
+    objQueue = GazeBuffer(number, decode=objDecoder.decode_batch, batchSize=batchSize)
+    dictQueue = GazeBuffer(number, decode=dictDecoder.decode_batch, batchSize=batchSize)
+    cases = [
+        ('legacy (33 private lookups)', lambda: legacy_callback(sampleObj, store)),
+        ('decode, GazeData', lambda: decoder_callback(objDecoder, sampleObj, store)),
+        ('decode, as_dictionary', lambda: decoder_callback(dictDecoder, sampleDict, store)),
+        ('batches of %d, GazeData' % batchSize, lambda: batch_callback(objQueue, sampleObj)),
+        ('batches of %d, as_dictionary' % batchSize, lambda: batch_callback(dictQueue, sampleDict)),
+    ]
+    print('Per-sample cost of the gaze callback (us)')
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print('%-30s %8.2f' % (name, best*1e6))
+    assert dictQueue.pull() == dictQueue.count and np.array_equal(dictQueue.data[:, 1:-1], store.data[:, 1:-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark the csv and binary gaze file formats
+
+Simulates a session of 1200 Hz gaze data and compares write time, file size
+and reload time of the np.savetxt csv path against the binary format in gazeio.
+The csv reload reads the whole file with np.loadtxt, which is what analysis
+scripts had to do before.
+
+Usage: python benchmarks/bench_gaze_formats.py [minutes] [outdir]
+    minutes defaults to 60 (a 1 hour session). The csv path takes several
+    minutes to write and reload at that length.
+"""
+
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns
+from gazeio import GazeWriter, gaze_binary_to_csv, load_gaze_binary
+
+
+def simulate_session(minutes, freq=1200, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * freq)
+    data = rng.random((n, len(ETcolumns)))
+    data[:, 0] = np.arange(n) / freq
+    return data
+
+
+def write_with(data, csvPath=None, binPath=None, blockRows=90000):
+    """Write `data` one trial-sized block at a time. Returns seconds elapsed"""
+    t0 = time.perf_counter()
+    writer = GazeWriter(csvPath, ETcolumns, chunkRows=blockRows, binPath=binPath)
+    for start in range(0, data.shape[0], blockRows):
+        writer.put(data[start:start+blockRows])
+    writer.close()
+    return time.perf_counter() - t0
+
+
+def main(minutes=60, outdir=None):
+    outdir = outdir or tempfile.mkdtemp(prefix='gaze_bench_')
+    os.makedirs(outdir, exist_ok=True)
+    csvPath = op.join(outdir, 'bench_et.csv')
+    binPath = op.join(outdir, 'bench_et.bin')
+    for p in [csvPath, binPath]:
+        if op.exists(p):
+            os.remove(p)
+
+    data = simulate_session(minutes)
+    print('Simulated %g min at 1200 Hz: %d samples x %d columns' % (minutes, data.shape[0], data.shape[1]))
+
+    tBinWrite = write_with(data, binPath=binPath)
+    tCsvWrite = write_with(data, csvPath=csvPath)
+
+    t0 = time.perf_counter()
+    binData, _ = load_gaze_binary(binPath)
+    tBinOpen = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    binLoaded = np.array(binData)
+    tBinRead = time.perf_counter() - t0 + tBinOpen
+
+    t0 = time.perf_counter()
+    csvData = np.loadtxt(csvPath, delimiter=',')
+    tCsvRead = time.perf_counter() - t0
+
+    assert np.array_equal(binLoaded, data)
+    assert np.array_equal(csvData, data)
+
+    print('%-8s %12s %12s %14s' % ('format', 'write (s)', 'size (MB)', 'reload (s)'))
+    print('%-8s %12.2f %12.1f %14.2f' % ('csv', tCsvWrite, op.getsize(csvPath)/1e6, tCsvRead))
+    print('%-8s %12.2f %12.1f %14.2f' % ('binary', tBinWrite, op.getsize(binPath)/1e6, tBinRead))
+    print('binary memmap open: %.4f s' % tBinOpen)
+
+    t0 = time.perf_counter()
+    gaze_binary_to_csv(binPath, op.join(outdir, 'converted_et.csv'))
+    print('binary -> csv conversion: %.2f s' % (time.perf_counter() - t0))
+    print('Files left in %s' % outdir)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 60, args[1] if len(args) > 1 else None)
@@ -0,0 +1,73 @@
+"""
+Benchmark read_wav's resampling engines on 1 s, 60 s and 10 min signals
+
+Resamples a stereo 44.1 kHz float32 tone to 48 kHz with the FFT engine
+(scipy.signal.resample on the whole file) and the
+polyphase engine (audio.resample_poly_chunked), and reports the time, peak
+memory allocated by numpy (tracemalloc) and the error of each against the
+tone computed directly at 48 kHz, both in the middle of the signal and in
+the first/last 10 ms where FFT resampling rings.
+
+Usage: python benchmarks/bench_resample.py [seconds ...]
+"""
+
+import os.path as op
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import resample
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import resample_poly_chunked, resample_ratio
+
+ORIG_FS = 44100
+NEW_FS = 48000
+TONE = 1001 + 1/7 # Not a whole number of periods in any of the test lengths
+
+
+def tone(n, fs):
+    t = np.arange(n) / fs
+    return 0.5 * np.sin(2 * np.pi * TONE * t)
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    y = fn()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return y, elapsed, peak
+
+
+def main(durations=(1, 60, 600)):
+    up, down = resample_ratio(ORIG_FS, NEW_FS)
+    print('%g Hz -> %g Hz, up/down = %d/%d, stereo float32' % (ORIG_FS, NEW_FS, up, down))
+    print('%8s %6s %10s %10s %12s %12s' % ('length', 'engine', 'time s', 'peak MB', 'err middle', 'err edges'))
+    for seconds in durations:
+        n = int(seconds * ORIG_FS)
+        x = np.empty((n, 2), dtype=np.float32)
+        x[:, 0] = tone(n, ORIG_FS)
+        x[:, 1] = x[:, 0]
+        nOut = round(n / ORIG_FS * NEW_FS)
+        expected = tone(nOut, NEW_FS)
+        edge = NEW_FS // 100
+        engines = [('fft', lambda: resample(x, nOut)),
+                   ('poly', lambda: resample_poly_chunked(x, up, down, nOut=nOut))]
+        for name, fn in engines:
+            try:
+                y, elapsed, peak = measure(fn)
+            except MemoryError:
+                print('%7gs %6s %10s' % (seconds, name, 'out of memory'))
+                continue
+            err = np.abs(y[:, 0] - expected)
+            print('%7gs %6s %10.3f %10.1f %12.2e %12.2e' % (seconds, name, elapsed, peak / 1e6,
+                  err[edge:-edge].max(), max(err[:edge].max(), err[-edge:].max())))
+            del y, err
+        del x, expected
+
+
+if __name__ == '__main__':
+    main([float(a) for a in sys.argv[1:]] or (1, 60, 600))
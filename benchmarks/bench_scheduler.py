@@ -0,0 +1,112 @@
+"""
+Phase scheduler on a real-time stand-in window
+
+The window's flip() sleeps until the next refresh of a virtual monitor
+running on the wall clock, as a vsync-locked flip would. A trial's phases
+(ITI, pre-audio, response, feedback) are run through PhaseScheduler with
+idle tasks that each do a small piece of work (a slice of a trial's audio
+being rendered) plus one task that runs for the whole session (as main.py
+streams gaze samples), and reported are:
+  - how late each phase's last flip was against its deadline
+  - the CPU load while the phases ran
+  - how much idle work was done in the spare time before flips, and
+    whether any frame was missed because of it
+
+Usage: python benchmarks/bench_scheduler.py [refreshRate] [nTrials]
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from scheduler import Phase, PhaseScheduler
+from timing import FrameTimer
+
+
+class RealtimeWindow:
+    """flip() sleeps until the next refresh and returns its time"""
+
+    def __init__(self, refreshRate):
+        self.monitorFramePeriod = 1 / refreshRate
+        self.t0 = time.perf_counter()
+        self.lastFlip = 0.
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        now = time.perf_counter() - self.t0
+        period = self.monitorFramePeriod
+        return (np.floor(now / period) + 1) * period + targetTime
+
+    def flip(self):
+        t = self.getFutureFlipTime()
+        remaining = t - (time.perf_counter() - self.t0)
+        if remaining > 0:
+            time.sleep(remaining)
+        self.lastFlip = t
+        return t
+
+    def clock(self):
+        return time.perf_counter() - self.t0
+
+
+def render_slices(nSlices, sliceSamples=4800):
+    """An idle task rendering audio one slice per call"""
+    out = np.empty(nSlices * sliceSamples)
+    t = np.arange(sliceSamples) / 48000
+    state = {'done': 0}
+
+    def task():
+        ii = state['done']
+        out[ii*sliceSamples:(ii+1)*sliceSamples] = np.sin(2 * np.pi * 1000 * (t + ii * sliceSamples / 48000))
+        state['done'] += 1
+        return state['done'] < nSlices
+
+    return task, state
+
+
+def poll_task():
+    """An idle task that never finishes, counting its calls"""
+    state = {'calls': 0}
+
+    def task():
+        state['calls'] += 1
+        return True
+
+    return task, state
+
+
+def main(refreshRate=60, nTrials=3):
+    win = RealtimeWindow(refreshRate)
+    frameTimer = FrameTimer(win.monitorFramePeriod)
+    scheduler = PhaseScheduler(win, win.clock, frameTimer)
+    sliceCounts = []
+    dropped = 0
+    poll, pollState = poll_task()
+    scheduler.add_idle(poll)
+    nFrames = 0
+    for trial in range(nTrials):
+        frameTimer.start_trial()
+        task, state = render_slices(400)
+        scheduler.add_idle(task)
+        sliceCounts.append(state)
+        tNow = win.clock()
+        scheduler.run(Phase('iti', deadline=tNow + 0.5))
+        scheduler.run(Phase('pre_audio', deadline=tNow + 1.0))
+        tResponse = win.clock()
+        scheduler.run(Phase('response', frame=lambda t, tNextFlip: t >= tResponse + 1.0))
+        scheduler.run(Phase('feedback', deadline=win.clock() + 0.5))
+        summary = frameTimer.summary()
+        dropped += sum(summary[phase + '_dropped'] for phase in scheduler.phaseNames)
+        nFrames += sum(summary[phase + '_frames'] for phase in scheduler.phaseNames)
+        scheduler.end_trial()
+    print(scheduler.report())
+    print('Idle work: %s of 400 audio slices rendered per trial, %d idle tasks still pending, %d dropped frames'
+          % ([state['done'] for state in sliceCounts], scheduler.idle_pending() - 1, dropped))
+    print('Session task: called %d times in %d frames' % (pollState['calls'], nFrames))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*[float(a) for a in args[:1]], *[int(a) for a in args[1:2]])
@@ -0,0 +1,72 @@
+"""
+Startup time of main.py, with the import cost of each module
+
+Runs `python -X importtime` in a fresh interpreter for each stage:
+  dialog:   import main (everything needed before the opening dialog)
+  keyboard: + load_task_modules for a session without an eyetracker
+  tobii:    + load_task_modules for a session with an eyetracker
+and reports the wall time of each stage and the modules with the highest
+cumulative import time. An import that fails (e.g. tobii_research not
+installed) is reported instead of timed.
+
+Usage: python benchmarks/bench_startup.py [nTop]
+"""
+
+import os.path as op
+import subprocess
+import sys
+import time
+
+_repoDir = op.dirname(op.dirname(op.abspath(__file__)))
+
+STAGES = [
+    ('dialog', 'import main'),
+    ('keyboard', "import main; main.load_task_modules({'eyetracker': 'None'})"),
+    ('tobii', "import main; main.load_task_modules({'eyetracker': '600'})"),
+]
+
+
+def import_times(code):
+    """Run code with -X importtime
+
+    Returns:
+        wall: Seconds the interpreter ran for
+        modules: List of (cumulative us, self us, module name, nesting level)
+        error: Last line of stderr if the code failed, else None
+    """
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=_repoDir,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    modules = []
+    other = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            other.append(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue # header line
+        name = fields[2].rstrip()
+        level = (len(name) - len(name.lstrip())) // 2
+        modules.append((int(fields[1]), int(fields[0]), name.strip(), level))
+    error = other[-1] if proc.returncode and other else None
+    return wall, modules, error
+
+
+def main(nTop=15):
+    seen = set()
+    for stage, code in STAGES:
+        wall, modules, error = import_times(code)
+        print('== %s: %.2f s%s' % (stage, wall, ' (FAILED: %s)' % error if error else ''))
+        # Only modules this stage added, top-level imports first
+        new = [m for m in modules if m[2] not in seen]
+        seen.update(m[2] for m in modules)
+        total = sum(m[1] for m in new) / 1e6
+        print('   %d modules imported by this stage, %.2f s of import time' % (len(new), total))
+        for cumulative, self_, name, level in sorted(new, reverse=True)[:nTop]:
+            print('   %8.1f ms cumulative %8.1f ms self  %s%s' % (cumulative / 1e3, self_ / 1e3, '  ' * level, name))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,56 @@
+"""
+Benchmark StimulusLibrary loading a large stimulus set serially and in parallel
+
+Writes nFiles short 44.1 kHz wav files to a temporary folder and a conditions
+list that names each of them several times (as cuesound and choicesound).
+Then loads them at 48 kHz one file at a time, with threads and with processes,
+checks every mode gives the same arrays and that each file was loaded once.
+
+Usage: python benchmarks/bench_stimulus_library.py [nFiles] [workers]
+"""
+
+import os.path as op
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import StimulusLibrary, read_wav
+
+
+def main(nFiles=200, workers=4, seconds=2.0):
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        names = ['stim%03d.wav' % ii for ii in range(nFiles)]
+        for name in names:
+            sf.write(op.join(tmp, name), rng.uniform(-0.5, 0.5, int(seconds*44100)), 44100, subtype='PCM_16')
+        # Every file is used as a cue in two trials and as a choice in one
+        conditions = [{'cuesound': names[ii % nFiles], 'choicesound': names[(ii * 7) % nFiles]}
+                      for ii in range(2 * nFiles)]
+        read_wav(op.join(tmp, names[0])) # import soundfile/scipy outside the timings
+
+        libraries = {}
+        for label, kwargs in [('serial', dict(workers=0)),
+                              ('%d threads' % workers, dict(workers=workers)),
+                              ('%d processes' % workers, dict(workers=workers, executor='process'))]:
+            t0 = time.perf_counter()
+            libraries[label] = StimulusLibrary(tmp, conditions, 48000, **kwargs)
+            print('%-12s %8.1f ms' % (label, (time.perf_counter() - t0) * 1e3))
+
+        serial = libraries['serial']
+        same = all(np.array_equal(serial[name], lib[name]) for lib in libraries.values() for name in names)
+        print('%d references to %d unique files, %d loaded per mode, identical: %s'
+              % (sum(serial.references.values()), nFiles, len(serial), same))
+        print('\n'.join(serial.report().splitlines()[:4] + ['...', serial.report().splitlines()[-1]]))
+        return same and len(serial) == nFiles
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(not main(*[int(a) for a in sys.argv[1:3]]))
@@ -0,0 +1,104 @@
+"""
+Benchmark the batched tone-sequence synthesis against the per-tone version
+
+The legacy version built one psychopy Sound per 25 ms tone and stacked them
+with np.vstack. If psychopy is installed it is used as the reference. If not,
+the per-tone computation is reproduced from psychopy's source
+(_setSndFromFreq and its apodize, copied below rather than taken from
+audio.py, which is what is being checked) so the stacking cost and the
+output can still be compared. The reference used is printed.
+
+Usage: python benchmarks/bench_tone_synthesis.py
+"""
+
+import os.path as op
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import tone_sequence
+
+try:
+    from psychopy import sound
+except Exception:
+    sound = None
+
+
+def _psychopy_apodize(soundArray, sampleRate):
+    """psychopy.sound._base.apodize (2023.1), the Hanning ramp of hamming=True"""
+    hwSize = int(min(sampleRate // 200, len(soundArray) // 15))
+    hanningWindow = np.hanning(2 * hwSize + 1)
+    soundArray = soundArray.copy()
+    if soundArray.ndim == 1:
+        soundArray[:hwSize] *= hanningWindow[:hwSize]
+        soundArray[-hwSize:] *= hanningWindow[hwSize + 1:]
+    else:
+        for chan in range(soundArray.ndim):
+            soundArray[:hwSize, chan] *= hanningWindow[:hwSize]
+            soundArray[-hwSize:, chan] *= hanningWindow[hwSize + 1:]
+    return soundArray
+
+
+def _per_tone(frequency, secs, sampleRate):
+    """One tone the way psychopy's Sound(..., hamming=True, stereo=True).sndArr makes it"""
+    if sound is not None:
+        return sound.Sound(value=frequency, secs=secs, sampleRate=sampleRate, stereo=True, hamming=True).sndArr
+    nSamples = int(secs * sampleRate)
+    outArr = np.arange(0.0, 1.0, 1.0 / nSamples)
+    outArr *= 2 * np.pi * frequency * secs
+    outArr = np.sin(outArr)
+    if nSamples > 30:
+        outArr = _psychopy_apodize(outArr, sampleRate)
+    outArr = outArr.astype('float32')
+    return np.vstack((outArr, outArr)).T
+
+
+def legacy_generate_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5):
+    """utils.generate_tone_sequence before synthesis was batched"""
+    num_tones = int(sequence_duration / tone_duration)
+    num_coherent_tones = int(num_tones * coherence)
+    coherent_tones = [_per_tone(frequency, tone_duration, sampleRate) for _ in range(num_coherent_tones)]
+    incoherent_tones = []
+    for ii in range(num_tones - num_coherent_tones):
+        random_octave_shift = np.random.uniform(-1, 1)
+        random_frequency = frequency * 2 ** (random_octave_shift * frequency_range)
+        incoherent_tones.append(_per_tone(random_frequency, tone_duration, sampleRate))
+    tone_sequence = coherent_tones + incoherent_tones
+    np.random.shuffle(tone_sequence)
+    for ii in range( len(tone_sequence) ):
+        if ii == 0:
+            arr = tone_sequence[0]
+        else:
+            arr = np.vstack((arr, tone_sequence[ii]))
+    return arr
+
+
+def main():
+    print('Reference: %s' % ('psychopy.sound.Sound' if sound is not None else
+                             'copy of psychopy 2023.1 _setSndFromFreq and apodize (psychopy is not installed)'))
+    params = dict(coherence=0.9, frequency=400, frequency_range=1, sampleRate=48000)
+
+    # Same global random state -> same output
+    worst = 0.
+    for seed in range(20):
+        np.random.seed(seed)
+        old = legacy_generate_tone_sequence(**params)
+        np.random.seed(seed)
+        new = tone_sequence(**params)
+        assert old.shape == new.shape and old.dtype == new.dtype
+        worst = max(worst, float(np.max(np.abs(old.astype(float) - new))))
+    print('Max abs difference over 20 seeds: %g %s' % (worst, '(bit-identical)' if worst == 0 else ''))
+
+    for duration in [0.5, 5.0]:
+        p = dict(params, sequence_duration=duration)
+        n = 50 if duration < 1 else 5
+        tOld = min(timeit.repeat(lambda: legacy_generate_tone_sequence(**p), number=n, repeat=3)) / n
+        tNew = min(timeit.repeat(lambda: tone_sequence(**p), number=n, repeat=3)) / n
+        print('%4.1f s sequence (%3d tones): per-tone %8.2f ms, batched %6.2f ms (x%.0f)'
+              % (duration, int(duration/0.025), tOld*1e3, tNew*1e3, tOld/tNew))
+
+
+if __name__ == '__main__':
+    main()
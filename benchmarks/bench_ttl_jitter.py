@@ -0,0 +1,98 @@
+"""
+Measure TTL timing of TTLSender's modes against the old inline pulse
+
+Sends codes through a FakePort from a loop that mimics the trial loop: each
+frame waits for the next 60 Hz refresh and then does some Python work
+(holding the GIL, like drawing and polling). Codes are sent right after the
+refresh, as win.callOnFlip(send_ttl, code) does. For each method it reports
+how long the send call held up the loop, the delay between the request and
+the write, and the width of the pulse on the port, and checks that the
+default TTLSender's pulses are within 0.5 ms of pulseWidth.
+
+Usage: python benchmarks/bench_ttl_jitter.py [nPulses] [busy ms per frame]
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from ttl import FakePort, TTLSender, wait_until
+
+FRAME = 1 / 60
+
+
+def inline_sender(port, pulseWidth):
+    """What utils.set_ttl's ParallelPort send_ttl used to do"""
+    def send_ttl(code):
+        port.setData(code)
+        wait_until(time.perf_counter() + pulseWidth)
+        port.setData(0)
+    return send_ttl
+
+
+def frame_loop(send, nPulses, busy):
+    """Flip-paced loop sending one code every few frames. Returns requested times and send durations"""
+    requested, blocked = [], []
+    nextFlip = time.perf_counter() + FRAME
+    for ii in range(nPulses * 3):
+        time.sleep(max(nextFlip - time.perf_counter(), 0)) # waiting for the refresh
+        nextFlip += FRAME
+        if ii % 3 == 0:
+            t0 = time.perf_counter()
+            send(1 + ii % 200)
+            requested.append(t0)
+            blocked.append(time.perf_counter() - t0)
+        # Work done for the rest of the frame while holding the GIL
+        stop = time.perf_counter() + busy
+        x = 0
+        while time.perf_counter() < stop:
+            x += 1
+    return np.array(requested), np.array(blocked)
+
+
+def pulse_stats(port, requested):
+    writes = np.array(port.writes)
+    onsets = writes[writes[:, 1] != 0, 0]
+    offsets = writes[writes[:, 1] == 0, 0]
+    return onsets - requested, offsets - onsets
+
+
+def describe(values):
+    values = np.asarray(values) * 1e3
+    return '%7.3f %7.3f %7.3f' % (values.mean(), np.percentile(values, 95), values.max())
+
+
+# Largest difference (s) allowed between the default TTLSender's pulse width and pulseWidth
+WIDTH_TOLERANCE = 0.0005
+
+
+def main(nPulses=300, busyMs=8.0, pulseWidth=0.001):
+    busy = busyMs / 1e3
+    print('%d pulses, %.1f ms of Python work per frame, %.1f ms pulses' % (nPulses, busyMs, pulseWidth * 1e3))
+    print('%-24s %-23s %-23s %-23s' % ('', 'send blocks (ms)', 'request->write (ms)', 'pulse width (ms)'))
+    print('%-24s %s' % ('', '   mean     p95     max  ' * 3))
+    modes = [('old inline pulse', None), ('TTLSender (default)', dict()),
+             ('thread', dict(inline=False)), ('thread, 2 ms handoff', dict(inline=False, handoffTimeout=0.002))]
+    ok = True
+    for label, kwargs in modes:
+        port = FakePort()
+        if kwargs is None:
+            requested, blocked = frame_loop(inline_sender(port, pulseWidth), nPulses, busy)
+        else:
+            sender = TTLSender(port.setData, pulseWidth=pulseWidth, **kwargs)
+            requested, blocked = frame_loop(sender.send, nPulses, busy)
+            sender.close()
+        delay, width = pulse_stats(port, requested)
+        print('%-24s %s  %s  %s' % (label, describe(blocked), describe(delay), describe(width)))
+        if kwargs == dict():
+            ok = len(width) == nPulses and np.abs(width - pulseWidth).max() <= WIDTH_TOLERANCE
+    print('default pulse width within %.1f ms of %.1f ms: %s' % (WIDTH_TOLERANCE * 1e3, pulseWidth * 1e3, ok))
+    return ok
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(0 if main(*[int(a) for a in args[:1]], *[float(a) for a in args[1:2]]) else 1)
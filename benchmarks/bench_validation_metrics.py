@@ -0,0 +1,134 @@
+"""
+Eyetracker validation metrics: vectorized vs per-point loops
+
+Builds a synthetic validation (4 points, 1.5 s of samples each, gaussian
+gaze noise, some samples invalid) and compares:
+  - validation_metrics against a per-point, per-sample loop computing the same
+    accuracy, precision (RMS-S2S) and data loss
+  - the data loss of points that got fewer than the expected 1.5 s of
+    samples (the last point gets two thirds of them, and in a second run
+    the first point gets none), which must count the missing samples as lost
+  - chunk_means against the np.append loop ETvalidation used to average the
+    samples in 50-sample chunks
+and reports the time of each.
+
+Usage: python benchmarks/bench_validation_metrics.py [etFrequency] [repeats]
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns, chunk_means, display_to_cm, validation_metrics, visual_angle
+
+SCREEN_RES = (1920, 1080)
+SCREEN_WIDTH = 53.0
+VIEW_DISTANCE = 60.0
+
+
+def make_validation(etFrequency, noise=0.01, pLost=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    targets = np.array([[-.25, -.25], [.25, -.25], [-.25, .25], [.25, .25]]) * SCREEN_RES
+    nSamples = int(1.5 * etFrequency)
+    samples = np.full((len(targets), nSamples, len(ETcolumns)), np.nan)
+    counts = np.full(len(targets), nSamples)
+    counts[-1] -= nSamples // 3 # the buffer did not have all samples yet
+    for i, (x, y) in enumerate(targets):
+        display = (x / SCREEN_RES[0] + 0.5, -y / SCREEN_RES[1] + 0.5)
+        for xy, validity in ([13, 14], 15), ([28, 29], 30):
+            samples[i, :, xy] = (np.array(display)[:, None] + rng.normal(0, noise, (2, nSamples)))
+            samples[i, :, validity] = rng.random(nSamples) > pLost
+    samples[0, 10:20, 13] = np.nan # invalid but flagged valid
+    return samples, counts, targets
+
+
+def loop_metrics(samples, counts, targets, expected):
+    """Per point and eye (accuracy, precision, dataLoss), one sample at a time"""
+    rows = []
+    cmPerPix = SCREEN_WIDTH / SCREEN_RES[0]
+    for i in range(samples.shape[0]):
+        target = np.asarray(targets[i]) * cmPerPix
+        for xy, validity in ([13, 14], 15), ([28, 29], 30):
+            offsets, steps, prev, nValid = [], [], None, 0
+            for j in range(counts[i]):
+                s = samples[i, j]
+                if s[validity] > 0 and np.isfinite(s[xy]).all():
+                    g = display_to_cm(s[xy], SCREEN_RES, SCREEN_WIDTH)
+                    offsets.append(visual_angle(g, target, VIEW_DISTANCE))
+                    if prev is not None:
+                        steps.append(visual_angle(g, prev, VIEW_DISTANCE))
+                    prev = g
+                    nValid += 1
+                else:
+                    prev = None
+            rows.append((np.mean(offsets), np.sqrt(np.mean(np.square(steps))), 1 - nValid / expected))
+    return np.array(rows)
+
+
+def append_chunk_means(samples, counts):
+    """The np.append loops ETvalidation used before"""
+    eyedotsLeft = np.empty((0, 2))
+    eyedotsRight = np.empty((0, 2))
+    for i in range(samples.shape[0]):
+        eyedotsLeft = np.append(eyedotsLeft, samples[i, :counts[i], 13:15], axis=0)
+        eyedotsRight = np.append(eyedotsRight, samples[i, :counts[i], 28:30], axis=0)
+    avgLeft = np.empty((0, 2))
+    avgRight = np.empty((0, 2))
+    for i in range(int(eyedotsLeft.shape[0] / 50)):
+        sample = eyedotsLeft[i * 50:(i + 1) * 50]
+        avgLeft = np.append(avgLeft, np.reshape(np.nanmean(sample, axis=0), (1, 2)), axis=0)
+        sample = eyedotsRight[i * 50:(i + 1) * 50]
+        avgRight = np.append(avgRight, np.reshape(np.nanmean(sample, axis=0), (1, 2)), axis=0)
+    return avgLeft, avgRight
+
+
+def vector_chunk_means(samples, counts):
+    recorded = samples[np.arange(samples.shape[1]) < counts[:, None]]
+    return chunk_means(recorded, [13, 14]), chunk_means(recorded, [28, 29])
+
+
+def timed(function, repeats, *args):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        result = function(*args)
+    return result, (time.perf_counter() - t0) / repeats
+
+
+def main(etFrequency=600, repeats=20):
+    samples, counts, targets = make_validation(etFrequency)
+    expected = samples.shape[1]
+    metrics, tVector = timed(validation_metrics, repeats, samples, counts, targets, SCREEN_RES, SCREEN_WIDTH,
+                             VIEW_DISTANCE, expected)
+    reference, tLoop = timed(loop_metrics, 1, samples, counts, targets, expected)
+    vector = np.stack((metrics['accuracy'], metrics['precision'], metrics['dataLoss']), axis=1)
+    same = np.allclose(vector, reference, rtol=1e-9, atol=1e-12)
+    print('validation_metrics  %8.2f ms   per-sample loop %8.1f ms   match: %s' % (tVector*1e3, tLoop*1e3, same))
+
+    # Samples that never arrived are lost: a short point loses at least the missing third, an empty one all
+    shortLoss = metrics['dataLoss'][metrics['point'] == len(targets) - 1]
+    noSamples = counts.copy()
+    noSamples[0] = 0
+    emptyLoss = validation_metrics(samples, noSamples, targets, SCREEN_RES, SCREEN_WIDTH, VIEW_DISTANCE,
+                                   expected)['dataLoss'][:2]
+    sameLoss = (shortLoss >= 1 - counts[-1] / expected).all() and (emptyLoss == 1).all()
+    print('missing samples     short point loss %s, empty point loss %s   match: %s'
+          % (np.round(shortLoss, 3), emptyLoss, sameLoss))
+
+    (left, right), tChunks = timed(vector_chunk_means, repeats, samples, counts)
+    (refLeft, refRight), tAppend = timed(append_chunk_means, repeats, samples, counts)
+    sameChunks = np.allclose(left, refLeft, equal_nan=True) and np.allclose(right, refRight, equal_nan=True)
+    print('chunk_means         %8.2f ms   np.append loop  %8.1f ms   match: %s' % (tChunks*1e3, tAppend*1e3, sameChunks))
+
+    print()
+    print('%5s %5s %8s %9s %9s %8s' % ('point', 'eye', 'n', 'accuracy', 'precision', 'loss'))
+    for row in metrics:
+        print('%5d %5s %8d %9.3f %9.3f %7.1f%%' % (row['point'], row['eye'], row['nSamples'], row['accuracy'],
+                                                  row['precision'], 100 * row['dataLoss']))
+    return same and sameLoss and sameChunks
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(*[int(a) for a in sys.argv[1:3]]) else 1)
@@ -0,0 +1,68 @@
+"""
+Benchmark reading stimuli through WavCache against plain read_wav
+
+Writes a few 44.1 kHz wav files to a temporary folder and loads them at 48 kHz
+four ways: with read_wav (decode + FFT resample every time), through a new
+cache (miss: resample and save the .npy), through a second cache on the same
+folder (as a new session would: memory-map the .npy) and through the
+in-memory LRU. Cached arrays are checked against read_wav's output.
+
+Usage: python benchmarks/bench_wav_cache.py [seconds per file]
+"""
+
+import os.path as op
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import WavCache, read_wav
+
+
+def load_all(files, **kwargs):
+    t0 = time.perf_counter()
+    arrays = [read_wav(f, new_fs=48000, **kwargs) for f in files]
+    # Touch every sample so memory-mapped arrays are paged in
+    total = sum(float(a[::256].sum()) for a in arrays)
+    return time.perf_counter() - t0, arrays, total
+
+
+def main(seconds=3.0, nFiles=4):
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        files = []
+        for ii in range(nFiles):
+            fname = op.join(tmp, 'stim%d.wav' % ii)
+            sf.write(fname, rng.uniform(-0.5, 0.5, int(seconds*44100)), 44100, subtype='PCM_16')
+            files.append(fname)
+        cacheDir = op.join(tmp, 'wavcache')
+
+        read_wav(files[0], new_fs=48000) # import scipy outside the timings
+        tPlain, reference, _ = load_all(files)
+        cache = WavCache(cacheDir)
+        tMiss, _, _ = load_all(files, cache=cache)
+        tMemory, _, _ = load_all(files, cache=cache)
+        session2 = WavCache(cacheDir)
+        tDisk, cached, _ = load_all(files, cache=session2)
+
+        worst = max(float(np.max(np.abs(ref.astype(np.float32) - c))) for ref, c in zip(reference, cached))
+        print('%d files of %g s, 44.1 kHz -> 48 kHz stereo' % (nFiles, seconds))
+        print('read_wav            %8.2f ms' % (tPlain*1e3))
+        print('cache miss (save)   %8.2f ms' % (tMiss*1e3))
+        print('new session (mmap)  %8.2f ms' % (tDisk*1e3))
+        print('in-memory hit       %8.2f ms' % (tMemory*1e3))
+        print('hits %d, disk hits %d, misses %d; max abs difference from read_wav %g'
+              % (cache.hits + session2.hits, cache.diskHits + session2.diskHits,
+                 cache.misses + session2.misses, worst))
+        return worst == 0
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(not main(*[float(a) for a in sys.argv[1:2]]))
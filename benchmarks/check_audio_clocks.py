@@ -0,0 +1,54 @@
+"""
+Check that trial audio is scheduled on the PTB clock
+
+PTB sounds take the time in play(when=...) on the PTB clock (GetSecs),
+which counts from an absolute origin, while the task's times come from
+core.getTime, which counts from when psychopy was loaded. Runs a simulated
+session whose PTB clock is ahead of the session clock by ptbOffset seconds
+and checks, per trial, that:
+  - the looped response-window click train started at response_allowed
+    rather than as soon as it was scheduled
+  - the audio device start saved by AudioLatencyAudit is on the session
+    clock, so audio_device_offset is only the simulated device jitter and
+    no trial is flagged
+
+Usage: python benchmarks/check_audio_clocks.py [ptbOffset] [responseType]
+"""
+
+import os.path as op
+import sys
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from analysis import event_times, read_trials
+from settings import SETTINGS
+from simulation import run_simulation
+
+
+def main(ptbOffset=86400.0, responseType='keyboard', audioJitter=0.0002):
+    session = run_simulation(response_type=responseType, ptbOffset=ptbOffset, audioJitter=audioJitter)
+    trials = read_trials(op.join(session.outputDir, 'sim', 'sim.csv'))
+    print('PTB clock ahead of the session clock by %g s, %d trials' % (ptbOffset, len(trials['audio_onset'])))
+    ok = True
+
+    if SETTINGS['click_playback'] == 'loop':
+        allowed = event_times(trials, 'response_allowed')
+        starts = np.array(session.sounds['click_loop'].starts)
+        clickError = (starts - allowed) * 1e3
+        print('click loop start - response_allowed (ms): %s' % np.array2string(clickError, precision=3))
+        ok &= bool(starts.size == allowed.size and np.all(np.abs(clickError) < 1e-3))
+    else:
+        print("SETTINGS['click_playback'] is %r, there is no click loop to check" % SETTINGS['click_playback'])
+
+    deviceOffset = np.array([float(v) for v in trials['audio_device_offset']]) * 1e3
+    flagged = [v == 'True' for v in trials['audio_latency_flag']]
+    print('audio_device_offset (ms): %s, %d trials flagged' % (np.array2string(deviceOffset, precision=3), sum(flagged)))
+    ok &= bool(np.all(np.abs(deviceOffset) < 5 * audioJitter * 1e3) and not any(flagged))
+    print('ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(0 if main(*[float(a) for a in args[:1]], *args[1:2]) else 1)
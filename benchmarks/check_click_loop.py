@@ -0,0 +1,58 @@
+"""
+Check looped click-train playback against the fully rendered click stream
+
+main.py can play the response window click train as one SOA of audio repeated
+by the audio backend (SETTINGS['click_playback'] = 'loop'). This renders what
+the backend plays (the period tiled clickReps times) and compares it sample by
+sample with the stream createAudioStream used to build. It also compares the
+detected click onsets with the scheduled ones, and reports the buffer sizes
+for several wait_time values.
+
+Usage: python benchmarks/check_click_loop.py [sampleRate]
+"""
+
+import os.path as op
+import sys
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from audio import detect_onsets, render_loop
+from settings import SETTINGS
+
+
+def rendered_click_stream(arr, soa, samplingRate, reps):
+    """The click stream as utils.createAudioStream renders it (stereo float32)"""
+    dur = len(arr) / samplingRate
+    offset2onset_padding = np.zeros(round(samplingRate * (soa - dur)))
+    audioStream = np.array([])
+    for ii in range(reps):
+        audioStream = np.concatenate((audioStream, arr, offset2onset_padding))
+    return np.vstack((audioStream,audioStream)).T.astype('float32')
+
+
+def main(sampleRate=48000):
+    clickSOA = SETTINGS['click_soa']
+    singleClick = np.ones(round(SETTINGS['click_dur']*sampleRate))
+    ok = True
+    print('%10s %6s %12s %12s %16s' % ('wait_time', 'reps', 'rendered MB', 'loop MB', 'max onset err'))
+    for waitTime in [10, SETTINGS['wait_time'], 300]:
+        clickReps = int(np.floor(waitTime/clickSOA))
+        rendered = rendered_click_stream(singleClick, clickSOA, sampleRate, clickReps)
+        period = rendered_click_stream(singleClick, clickSOA, sampleRate, 1)
+        looped = render_loop(period, clickReps)
+
+        identical = looped.shape == rendered.shape and np.array_equal(looped, rendered)
+        # Onsets as main.py schedules them: the loop starts at response_allowed
+        scheduled = np.arange(clickReps) * period.shape[0] / sampleRate
+        detected = detect_onsets(looped, sampleRate)
+        err = np.max(np.abs(detected - scheduled)) if detected.size == scheduled.size else np.inf
+        ok &= identical and err < 1 / sampleRate
+        print('%10g %6d %12.2f %12.3f %13.3g s %s' % (waitTime, clickReps, rendered.nbytes/1e6,
+              period.nbytes/1e6, err, '' if identical else 'MISMATCH'))
+    print('Looped playback matches the rendered stream' if ok else 'Looped playback DIFFERS from the rendered stream')
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(not main(*[int(a) for a in sys.argv[1:2]]))
@@ -0,0 +1,70 @@
+"""
+Check ClockSync against a synthetic gaze stream with known clocks
+
+Samples are taken at `frequency` Hz on the tracker's system clock, which
+runs `driftPpm` fast against PsychoPy time with an offset. Each callback
+arrives after a delivery delay of 1 ms plus an exponential jitter, and now and
+then a burst of callbacks is held up by 20 ms (e.g. by a busy interpreter).
+The corrected times from ClockSync.update are compared with the true times
+of the samples, next to the raw callback times (expTime), and the cost of an
+update is measured.
+
+Usage: python benchmarks/check_clock_sync.py [minutes] [frequency] [driftPpm]
+"""
+
+import os.path as op
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ClockSync
+
+
+def make_stream(minutes, frequency, driftPpm, seed=0):
+    """(system_time_stamp in us, callback core time, true core time) of every sample"""
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * frequency)
+    trueTime = 12.0 + np.arange(n) / frequency # PsychoPy time the samples were taken
+    system = (trueTime * (1 + driftPpm * 1e-6) + 5123.456789) * 1e6
+    delay = 0.001 + rng.exponential(0.0005, n)
+    burst = rng.random(n) < 0.002
+    for start in np.flatnonzero(burst):
+        delay[start:start + int(0.02 * frequency)] += np.linspace(0.02, 0, int(0.02 * frequency))[:n - start]
+    callback = np.maximum.accumulate(trueTime + delay) # callbacks are delivered in order
+    return system, callback, trueTime
+
+
+def main(minutes=30, frequency=600, driftPpm=20):
+    system, callback, trueTime = make_stream(minutes, frequency, driftPpm)
+    sync = ClockSync()
+    corrected = np.empty_like(trueTime)
+    update = sync.update
+    t0 = time.perf_counter()
+    for ii, (s, c) in enumerate(zip(system.tolist(), callback.tolist())):
+        corrected[ii] = update(s, c)
+    cost = (time.perf_counter() - t0) / trueTime.size
+
+    settled = slice(int(10 * frequency), None) # after the first 10 s
+    rawError = (callback - trueTime)[settled] * 1e3
+    error = (corrected - trueTime)[settled] * 1e3
+    print('%d samples (%g min at %g Hz, clock drift %g ppm)' % (trueTime.size, minutes, frequency, driftPpm))
+    print('%-22s %9s %9s %9s' % ('error vs true time (ms)', 'mean', 'SD', 'max |.|'))
+    print('%-22s %9.4f %9.4f %9.4f' % ('expTime (callback)', rawError.mean(), rawError.std(), np.abs(rawError).max()))
+    print('%-22s %9.4f %9.4f %9.4f' % ('correctedTime', error.mean(), error.std(), np.abs(error).max()))
+    # The minimum delivery delay (1 ms here) is the same for every sample and cannot be seen by any fit
+    print('correctedTime is %.4f ms late throughout: the minimum delivery delay. Spread around it: max %.4f ms'
+          % (error.mean(), np.abs(error - error.mean()).max()))
+    print('fitted drift %.3f ppm (true %g)' % (sync.summary()['drift_ppm'], driftPpm))
+    print('update(): %.2f us per sample' % (cost * 1e6))
+    print(sync.report())
+    ok = (np.abs(error - error.mean()).max() < 0.1 and error.std() < 0.2 * rawError.std() and
+          abs(sync.summary()['drift_ppm'] - driftPpm) < 0.5)
+    print('ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(0 if main(*[float(a) for a in args[:3]]) else 1)
@@ -0,0 +1,106 @@
+"""
+Validate DwellDetector against the nanmean box check main.py used to run
+
+Replays a gaze recording in frame-sized blocks. After every block it compares
+DwellDetector's answer with the original nanmean logic, which is run on the
+same window of the last n samples. It also reports the time spent per frame by
+each method.
+
+Usage: python benchmarks/check_dwell_detector.py [path/to/run_et.csv] [freq]
+    Without a file a synthetic 1200 Hz recording with dropouts is used.
+"""
+
+import os.path as op
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns, DwellDetector
+
+# Box limits in tobii coordinates as computed in main.run() for the default boxes
+SAME_BOX = (0.175, 0.325, 0.425, 0.575)
+DIFF_BOX = (0.675, 0.825, 0.425, 0.575)
+
+
+def synthetic_recording(seconds=120, freq=1200, seed=0):
+    """Gaze that jumps between the centre and both boxes, with NaN dropouts"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * freq)
+    data = np.full((n, len(ETcolumns)), np.nan)
+    data[:, 0] = np.arange(n) / freq
+    targets = np.array([[0.5, 0.5], [0.25, 0.5], [0.75, 0.5], [0.32, 0.44]])
+    fixation = rng.choice(len(targets), size=n // (freq // 2) + 1)
+    gaze = targets[np.repeat(fixation, freq // 2)[:n]]
+    for cols in [(13, 14), (28, 29)]:
+        data[:, cols] = gaze + rng.normal(0, 0.02, (n, 2))
+        dropped = rng.random(n) < 0.05
+        data[dropped, cols[0]] = np.nan
+        data[dropped, cols[1]] = np.nan
+    # A long blink
+    data[n // 3:n // 3 + freq // 4, 13:30] = np.nan
+    return data
+
+
+def nanmean_roi(window, lims):
+    """The check main.py performed on each frame"""
+    xleft, yleft = window[:, 13], window[:, 14]
+    xright, yright = window[:, 28], window[:, 29]
+    return np.nanmean(xleft)>=lims[0]\
+        and np.nanmean(xleft)<=lims[1]\
+        and np.nanmean(xright)>=lims[0]\
+        and np.nanmean(xright)<=lims[1]\
+        and np.nanmean(yleft)>=lims[2]\
+        and np.nanmean(yleft)<=lims[3]\
+        and np.nanmean(yright)>=lims[2]\
+        and np.nanmean(yright)<=lims[3]
+
+
+def main(path=None, freq=1200, fixationTime=0.5, frameRate=60):
+    if path is None:
+        data = synthetic_recording(freq=freq)
+    else:
+        data = np.loadtxt(path, delimiter=',', ndmin=2)
+    n = int(fixationTime * freq)
+    perFrame = int(round(freq / frameRate))
+
+    detector = DwellDetector(n)
+    detector.add_roi('same', SAME_BOX)
+    detector.add_roi('diff', DIFF_BOX)
+
+    nFrames = mismatches = 0
+    hits = {'same': 0, 'diff': 0, None: 0}
+    tDetector = tNanmean = 0.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # nanmean of all-NaN windows
+        for stop in range(perFrame, data.shape[0] + 1, perFrame):
+            t0 = time.perf_counter()
+            detector.extend(data[stop - perFrame:stop])
+            found = detector.current_roi()
+            t1 = time.perf_counter()
+            expected = None
+            if stop >= n:
+                window = data[stop - n:stop]
+                if nanmean_roi(window, SAME_BOX):
+                    expected = 'same'
+                elif nanmean_roi(window, DIFF_BOX):
+                    expected = 'diff'
+            t2 = time.perf_counter()
+            tDetector += t1 - t0
+            tNanmean += t2 - t1
+            nFrames += 1
+            hits[found] += 1
+            mismatches += found != expected
+
+    print('%d frames checked, %d mismatches' % (nFrames, mismatches))
+    print('Frames fixating: same %d, diff %d, neither %d' % (hits['same'], hits['diff'], hits[None]))
+    print('Per-frame cost (us): DwellDetector %.1f, nanmean %.1f'
+          % (tDetector / nFrames * 1e6, tNanmean / nFrames * 1e6))
+    return mismatches
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(main(args[0] if args else None, int(args[1]) if len(args) > 1 else 1200) > 0)
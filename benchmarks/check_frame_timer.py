@@ -0,0 +1,110 @@
+"""
+Check FrameTimer's dropped-frame counts and measure its cost per flip
+
+A stand-in window returns flip times on a virtual 60 Hz clock with jitter,
+and skips a known number of refreshes on chosen frames. The dropped frames
+FrameTimer reports per phase are compared with the injected ones, flips
+under a phase name the timer was not given are checked to count as
+'other', and the time spent recording a flip is measured.
+
+Usage: python benchmarks/check_frame_timer.py
+"""
+
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from timing import PHASES, FrameTimer
+
+
+class VirtualWindow:
+    """flip() advances a virtual clock by one refresh, plus any refreshes to skip"""
+
+    def __init__(self, framePeriod, jitter=0.0003, seed=0):
+        self.monitorFramePeriod = framePeriod
+        self.rng = np.random.default_rng(seed)
+        self.jitter = jitter
+        self.skip = 0
+        self.refresh = 0
+
+    def flip(self):
+        self.refresh += 1 + self.skip
+        self.skip = 0
+        return self.refresh * self.monitorFramePeriod + self.rng.normal(0, self.jitter)
+
+
+class Recorder:
+    """Collects addData calls the way ExperimentHandler would"""
+
+    def __init__(self):
+        self.rows = [{}]
+
+    def addData(self, name, value):
+        self.rows[-1][name] = value
+
+
+def main(nTrials=20, framesPerPhase=(120, 600, 180), seed=1):
+    rng = np.random.default_rng(seed)
+    win = VirtualWindow(1/60)
+    framesPath = op.join(tempfile.mkdtemp(), 'run_frames.csv')
+    timer = FrameTimer(win.monitorFramePeriod, maxFrames=512, framesPath=framesPath)
+    thisExp = Recorder()
+    ok = True
+    for trial in range(nTrials):
+        timer.start_trial()
+        injected = dict.fromkeys(PHASES, 0)
+        for phase, nFrames in zip(PHASES, framesPerPhase):
+            for ii in range(nFrames):
+                # The first flip of a trial has no interval to count drops in
+                if (ii or phase != PHASES[0]) and rng.random() < 0.01:
+                    win.skip = int(rng.integers(1, 4))
+                    injected[phase] += win.skip
+                timer.flip(win, phase)
+        timer.end_trial(thisExp)
+        for phase in PHASES:
+            reported = thisExp.rows[-1][phase + '_dropped']
+            if reported != injected[phase]:
+                ok = False
+                print('trial %d %s: injected %d dropped frames, reported %d' % (trial, phase, injected[phase], reported))
+        thisExp.rows.append({})
+    timer.close()
+
+    with open(framesPath) as f:
+        nLines = sum(1 for _ in f) - 1
+    print('%d trials, %d frames written to %s (%d expected)' % (nTrials, nLines, op.basename(framesPath),
+          nTrials * sum(framesPerPhase)))
+    ok &= nLines == nTrials * sum(framesPerPhase)
+    print('Last trial summary: %s' % ', '.join('%s=%.3g' % kv for kv in thisExp.rows[-2].items()))
+    os.remove(framesPath)
+
+    # A phase the timer was not given is recorded as 'other' instead of failing mid-trial
+    timer = FrameTimer(1/60, maxFrames=16)
+    timer.start_trial()
+    for ii in range(10):
+        timer.record(ii / 60, 'iti' if ii < 4 else 'calibration')
+    other = timer.summary()['other_frames']
+    print('Unknown phase: %d of 6 frames recorded as other' % other)
+    ok &= other == 6
+
+    # Cost of recording (no window)
+    timer = FrameTimer(1/60, maxFrames=100000)
+    timer.start_trial()
+    n = 100000
+    t0 = time.perf_counter()
+    for ii in range(n):
+        timer.record(ii / 60, 'response')
+    perFlip = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    timer.summary()
+    print('record(): %.2f us per flip, summary of %d frames: %.2f ms' % (perFlip * 1e6, n, (time.perf_counter() - t0) * 1e3))
+    print('Dropped frames match' if ok else 'Dropped frames DIFFER')
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(not main())
@@ -0,0 +1,51 @@
+"""
+Check that GazeWriter keeps the samples of a failed write and writes them later
+
+Starts a GazeWriter whose output folder does not exist yet, so opening the
+files fails, queues samples, then creates the folder and queues the rest.
+Every sample must end up in the csv and the binary file, in order, and the
+errors must be reported through onError as they happen.
+
+Usage: python benchmarks/check_gaze_writer_errors.py
+"""
+
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from eyetracking import ETcolumns
+from gazeio import GazeWriter, load_gaze_binary
+
+
+def main(nRows=1000):
+    data = np.random.default_rng(0).random((nRows, len(ETcolumns)))
+    messages = []
+    with tempfile.TemporaryDirectory() as tmpDir:
+        runDir = op.join(tmpDir, 'run')
+        writer = GazeWriter(op.join(runDir, 'run_et.csv'), ETcolumns, chunkRows=100, maxLatency=0.05,
+                            binPath=op.join(runDir, 'run_et.bin'), onError=messages.append)
+        writer.put(data[:nRows//2])
+        time.sleep(0.3)
+        failedWhileMissing = writer.nFailed
+        os.makedirs(runDir)
+        writer.put(data[nRows//2:])
+        writer.close()
+        binData, _ = load_gaze_binary(op.join(runDir, 'run_et.bin'), mmap=False)
+        csvData = np.loadtxt(op.join(runDir, 'run_et.csv'), delimiter=',')
+    print('\n'.join(messages))
+    print('%d samples held back while the folder was missing, %d written, %d still failed'
+          % (failedWhileMissing, writer.nWritten, writer.nFailed))
+    ok = (failedWhileMissing == nRows//2 and writer.nWritten == nRows and writer.error is None
+          and np.array_equal(binData, data) and np.allclose(csvData, data, rtol=0, atol=1e-15)
+          and len(messages) == 4)
+    print('ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,155 @@
+"""
+Check SerialTriggerPort and batched TTLSender writes against a pseudo-terminal
+
+The trigger box is stood in for by the master end of a pty, read by a thread
+that records every chunk it receives. The port is opened on the slave end
+(needs pyserial and a POSIX system). Checks that:
+  pool:       get_serial_port returns the same open port for the next run
+  batch:      a burst of codes arrives in order, in fewer writes than codes
+  multi-byte: a sequence of codes is one write
+  reconnect:  codes sent after the port was closed behind its back arrive
+  stall:      writes to a box that stops reading time out, are logged as lost,
+              and writing works again once the box reads again
+  no block:   send() from the caller (as set_ttl's send_ttl for a serial box,
+              opened with writeTimeout=0 and reconnectInBackground) returns at
+              once while the box is stalled, and codes arrive again after it
+
+Usage: python benchmarks/check_serial_trigger.py [nCodes]
+"""
+
+import os
+import os.path as op
+import select
+import sys
+import threading
+import time
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from ttl import TTLSender, get_serial_port, close_serial_ports
+
+
+class PtyBox:
+    """The master end of a pty, read by a thread while reading is True"""
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        self.name = os.ttyname(self.slave)
+        self.chunks = [] # (time, bytes)
+        self.reading = True
+        self._stop = False
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        while not self._stop:
+            if not self.reading:
+                time.sleep(0.001)
+                continue
+            ready, _, _ = select.select([self.master], [], [], 0.01)
+            if ready:
+                self.chunks.append((time.perf_counter(), os.read(self.master, 65536)))
+
+    def received(self):
+        return b''.join(chunk for _, chunk in self.chunks)
+
+    def wait(self, nBytes, timeout=2.0):
+        end = time.perf_counter() + timeout
+        while len(self.received()) < nBytes and time.perf_counter() < end:
+            time.sleep(0.001)
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def check(name, ok, detail=''):
+    print('%-11s %s  %s' % (name, 'ok  ' if ok else 'FAIL', detail))
+    return ok
+
+
+def main(nCodes=200):
+    box = PtyBox()
+    results = []
+    try:
+        port = get_serial_port(box.name, baudrate=9600, writeTimeout=0.05)
+        results.append(check('pool', get_serial_port(box.name, baudrate=9600) is port,
+                             'port %s' % box.name))
+
+        # A burst of codes while the output thread is still busy with the first
+        codes = [ii % 255 + 1 for ii in range(nCodes)]
+        sender = TTLSender(port.write, pulseWidth=None, handoffTimeout=0, batch=True, inline=False)
+        for code in codes:
+            sender.send(code)
+        sender.close()
+        box.wait(nCodes)
+        results.append(check('batch', box.received() == bytes(codes) and port.writes < nCodes,
+                             '%d codes in %d writes' % (nCodes, port.writes)))
+
+        box.chunks.clear()
+        writes = port.writes
+        sender = TTLSender(port.write, pulseWidth=None, batch=True, inline=False)
+        sender.send([10, 20, 30])
+        sender.close()
+        box.wait(3)
+        results.append(check('multi-byte', box.received() == bytes([10, 20, 30]) and port.writes == writes + 1,
+                             'logged %s' % [row[2] for row in sender.log]))
+
+        box.chunks.clear()
+        port.ser.close()
+        ok = port.write(42)
+        box.wait(1)
+        results.append(check('reconnect', ok and box.received() == bytes([42]) and not port.lost,
+                             '%d reconnects' % port.reconnects))
+
+        # Stop reading until the pty's buffer is full and writes time out
+        box.reading = False
+        time.sleep(0.02)
+        block = bytes(4096)
+        t0 = time.perf_counter()
+        while not port.lost and time.perf_counter() - t0 < 5:
+            port.write(block)
+        stalled = time.perf_counter() - t0
+        box.reading = True
+        time.sleep(0.05)
+        box.chunks.clear()
+        ok = port.write(7)
+        box.wait(1)
+        results.append(check('stall', bool(port.lost) and ok and box.received().endswith(bytes([7])),
+                             'lost %d bytes after %.2f s, %s' % (len(port.lost[0][1]) if port.lost else 0, stalled,
+                                                                 port.lost[0][2] if port.lost else '')))
+
+        # A non-blocking inline write to a stalled box fails at once and reconnects in the background
+        box2 = PtyBox()
+        try:
+            port2 = get_serial_port(box2.name, baudrate=9600, writeTimeout=0, reconnectInBackground=True)
+            box2.reading = False
+            time.sleep(0.02)
+            sender = TTLSender(port2.write, pulseWidth=None, batch=True)
+            blocked = 0.0
+            for ii in range(20):
+                t0 = time.perf_counter()
+                sender.send(list(block))
+                blocked = max(blocked, time.perf_counter() - t0)
+                time.sleep(0.005)
+            box2.reading = True
+            time.sleep(0.1)
+            box2.chunks.clear()
+            sender.send(9)
+            sender.close()
+            box2.wait(1)
+            results.append(check('no block', blocked < 0.005 and port2.lost and box2.received() == bytes([9]),
+                                 'longest send() %.3f ms, %d writes lost' % (blocked * 1e3, len(port2.lost))))
+        finally:
+            close_serial_ports()
+            box2.close()
+    finally:
+        close_serial_ports()
+        box.close()
+    print('all ok' if all(results) else 'FAILED')
+    return all(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(*[int(a) for a in sys.argv[1:2]]) else 1)
@@ -0,0 +1,110 @@
+"""
+Crash recovery and cost of the per-trial log (triallog.py)
+
+A child process writes trials of a synthetic session to a TrialLog, starts
+one more row by hand and is killed with SIGKILL half way through it. The
+wide csv is then rebuilt from the partial log with triallog.recover, and
+checked to hold exactly the trials written before the crash.
+
+A log closed before its first trial (Escape during trial 1) is finalized
+too, and checked to give a wide csv with the header and no trials.
+
+Also reports the cost of TrialLog.write per trial and of finalize (the
+final save, a copy of the log to the wide csv) for a long session.
+
+Usage: python benchmarks/check_trial_log.py [nTrials] [crashAfter]
+"""
+
+import csv
+import os.path as op
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+_repoDir = op.dirname(op.dirname(op.abspath(__file__)))
+sys.path.insert(0, _repoDir)
+from triallog import TrialLog, recover
+
+CHILD = r'''
+import os, signal, sys
+sys.path.insert(0, %(repo)r)
+sys.path.insert(0, %(here)r)
+from check_trial_log import make_entry
+from triallog import TrialLog
+log = TrialLog(%(path)r, fsyncRows=10)
+for ii in range(%(n)d):
+    log.write(make_entry(ii))
+log._file.write('%(n)d,0.1234')  # the crash hits in the middle of the next row
+log._file.flush()
+os.kill(os.getpid(), signal.SIGKILL)
+'''
+
+
+def make_entry(ii):
+    """One trial's entry, shaped like thisExp.entries[-1]"""
+    entry = {'trial': ii, 'audio_onset': 10.0 * ii + 0.0123456789, 'audio_offset': 10.0 * ii + 4.5,
+             'response_time': 10.0 * ii + 3.2, 'response': 'same' if ii % 2 else 'diff',
+             'correctResponse': 'same', 'stim_seed': 1000 + ii}
+    entry.update(('audio_%d' % jj, jj * 0.001) for jj in range(8))
+    entry.update({'runid': 'sub01', 'monitor': 'razer_laptop', 'eyetracker': '600', 'comment': 'a, "quoted" note'})
+    return entry
+
+
+def check_crash(tmpDir, nTrials):
+    path = op.join(tmpDir, 'crash_trials.csv')
+    code = CHILD % {'repo': _repoDir, 'here': op.dirname(op.abspath(__file__)), 'path': path, 'n': nTrials}
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    killed = proc.returncode == -signal.SIGKILL
+    csvPath = op.join(tmpDir, 'crash.csv')
+    nRecovered = recover(path, csvPath)
+    with open(csvPath, newline='') as f:
+        rows = list(csv.DictReader(f))
+    expected = [make_entry(ii) for ii in range(nTrials)]
+    same = (len(rows) == nTrials and
+            all(row[key] == str(value) for row, entry in zip(rows, expected) for key, value in entry.items()))
+    print('crash:    child killed %s, %d of %d trials recovered, values identical: %s'
+          % (killed, nRecovered, nTrials, same))
+    return killed and same
+
+
+def check_empty(tmpDir):
+    log = TrialLog(op.join(tmpDir, 'empty_trials.csv'))
+    csvPath = op.join(tmpDir, 'empty.csv')
+    nTrials = log.finalize(csvPath, list(make_entry(0)))
+    with open(csvPath, newline='') as f:
+        rows = list(csv.reader(f))
+    ok = nTrials == 0 and rows == [list(make_entry(0))]
+    print('empty:    %d trials, header only: %s' % (nTrials, ok))
+    return ok
+
+
+def check_cost(tmpDir, nTrials):
+    entries = [make_entry(ii) for ii in range(nTrials)]
+    log = TrialLog(op.join(tmpDir, 'cost_trials.csv'))
+    perTrial = []
+    for entry in entries:
+        t0 = time.perf_counter()
+        log.write(entry)
+        perTrial.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    log.finalize(op.join(tmpDir, 'cost.csv'))
+    tFinalize = time.perf_counter() - t0
+    perTrial.sort()
+    print('cost:     write per trial median %.3f ms, max %.3f ms (includes an fsync every 10 trials)'
+          % (perTrial[len(perTrial) // 2] * 1e3, perTrial[-1] * 1e3))
+    print('          finalize after %d trials %.2f ms' % (nTrials, tFinalize * 1e3))
+
+
+def main(nTrials=400, crashAfter=180):
+    with tempfile.TemporaryDirectory() as tmpDir:
+        ok = check_crash(tmpDir, crashAfter)
+        ok = check_empty(tmpDir) and ok
+        check_cost(tmpDir, nTrials)
+    print('all ok' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(*[int(a) for a in sys.argv[1:3]]) else 1)
@@ -0,0 +1,32 @@
+"""
+Profile a whole session run headless with simulation.py
+
+Runs main.run() on the virtual clock with the simulated devices, prints the
+session report (speed-up over real time, CPU per trial and per flip) and the
+functions with the most cumulative time under cProfile.
+
+Usage: python benchmarks/profile_simulated_session.py [responseType] [eyetracker] [refreshRate] [nTop]
+"""
+
+import cProfile
+import os.path as op
+import pstats
+import sys
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+from simulation import run_simulation
+
+
+def main(responseType='saccade', eyetracker='600', refreshRate=60, nTop=25):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    session = run_simulation(response_type=responseType, eyetracker=eyetracker, refresh_rate=refreshRate)
+    profiler.disable()
+    print(session.report())
+    print()
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(nTop)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*args[:2], *[float(a) for a in args[2:3]], *[int(a) for a in args[3:4]])
@@ -0,0 +1,544 @@
+"""
+Eyetracker data handling for the Tobii gaze stream
+"""
+
+import struct
+import threading
+from collections import deque
+from itertools import chain
+from operator import attrgetter, itemgetter
+
+import numpy as np
+
+# Layout of one gaze sample. Column order matches the _et.csv output
+ETcolumns = ['expTime', 'deviceTimeStamp', 'systemTimeStamp',
+    'xLeftGazeOriginInTrackboxCoords', 'yLeftGazeOriginInTrackboxCoords', 'zLeftGazeOriginInTrackboxCoords',
+    'xLeftGazeOriginInUserCoords', 'yLeftGazeOriginInUserCoords', 'zLeftGazeOriginInUserCoords',
+    'leftGazeOriginValidity',
+    'xLeftGazePositionInUserCoords', 'yLeftGazePositionInUserCoords', 'zLeftGazePositionInUserCoords',
+    'xLeftGazePositionOnDisplay', 'yLeftGazePositionOnDisplay',
+    'leftGazePointValidity', 'leftPupilDiameter', 'leftPupilValidity',
+    'xRightGazeOriginInTrackboxCoords', 'yRightGazeOriginInTrackboxCoords', 'zRightGazeOriginInTrackboxCoords',
+    'xRightGazeOriginInUserCoords', 'yRightGazeOriginInUserCoords', 'zRightGazeOriginInUserCoords',
+    'rightGazeOriginValidity',
+    'xRightGazePositionInUserCoords', 'yRightGazePositionInUserCoords', 'zRightGazePositionInUserCoords',
+    'xRightGazePositionOnDisplay', 'yRightGazePositionOnDisplay',
+    'rightGazePointValidity', 'rightPupilDiameter', 'rightPupilValidity',
+    'correctedTime']
+
+# Per-eye fields of a tobii gaze sample in ETcolumns order
+# (number of values, private attribute path below the eye, as_dictionary key suffix)
+_EYE_FIELDS = [
+    (3, '_EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates', 'gaze_origin_in_trackbox_coordinate_system'),
+    (3, '_EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates', 'gaze_origin_in_user_coordinate_system'),
+    (1, '_EyeData__gaze_origin._GazeOrigin__validity', 'gaze_origin_validity'),
+    (3, '_EyeData__gaze_point._GazePoint__position_in_user_coordinates', 'gaze_point_in_user_coordinate_system'),
+    (2, '_EyeData__gaze_point._GazePoint__position_on_display_area', 'gaze_point_on_display_area'),
+    (1, '_EyeData__gaze_point._GazePoint__validity', 'gaze_point_validity'),
+    (1, '_EyeData__pupil_data._PupilData__diameter', 'pupil_diameter'),
+    (1, '_EyeData__pupil_data._PupilData__validity', 'pupil_validity')]
+
+# Every field written by GazeDecoder, filling ETcolumns[1:-1] in order
+GAZE_FIELDS = [(1, '_GazeData__device_time_stamp', 'device_time_stamp'),
+               (1, '_GazeData__system_time_stamp', 'system_time_stamp')]
+for _eye in ['left', 'right']:
+    GAZE_FIELDS += [(width, '_GazeData__%s.%s' % (_eye, path), '%s_%s' % (_eye, key))
+                    for width, path, key in _EYE_FIELDS]
+
+
+class GazeDecoder:
+    """Copies the fields of a tobii gaze sample into a row of ETcolumns
+
+    The decoding plan is built once: one getter fetches the single-value
+    fields and another the coordinate tuples. decode_batch() runs the getters
+    over a batch of samples and reads the values of the whole batch into two
+    arrays with np.fromiter, which are copied into the caller's rows, so the
+    work done per sample is all in C. decode() does one sample, packing its
+    values with a precompiled struct into a reusable block, so it must only be
+    called from one thread. Per sample it still builds the getters' tuples
+    and costs about as much as the old attribute lookups (see
+    benchmarks/bench_gaze_decoder.py). Column 0 (expTime) and the last column
+    (correctedTime) are left for the caller.
+
+    Args:
+        asDictionary: True if samples come from subscribe_to(..., as_dictionary=True),
+            False for GazeData objects
+    """
+
+    def __init__(self, asDictionary=True):
+        self.asDictionary = asDictionary
+        scalars = [field for field in GAZE_FIELDS if field[0] == 1]
+        tuples = [field for field in GAZE_FIELDS if field[0] > 1]
+        if asDictionary:
+            self._getScalars = itemgetter(*[key for _, _, key in scalars])
+            self._getTuples = itemgetter(*[key for _, _, key in tuples])
+        else:
+            self._getScalars = attrgetter(*[path for _, path, _ in scalars])
+            self._getTuples = attrgetter(*[path for _, path, _ in tuples])
+        # Column of each field's first value. Column 0 is expTime
+        first = dict(zip([key for _, _, key in GAZE_FIELDS],
+                         1 + np.cumsum([0] + [width for width, _, _ in GAZE_FIELDS[:-1]])))
+        # Columns of the packed values: the single values, then the values of the tuples in turn
+        self._columns = np.array([first[key] + ii for width, _, key in scalars + tuples for ii in range(width)])
+        self._nScalars = len(scalars)
+        self._values = np.empty(len(self._columns))
+        self._pack = struct.Struct('%dd' % len(self._columns)).pack_into
+
+    def decode(self, gazedata, row):
+        """Write gazedata into row[1:-1]
+
+        row is a float64 array of len(ETcolumns) values, such as GazeBuffer.next_row().
+        """
+        self._pack(self._values, 0, *self._getScalars(gazedata), *chain.from_iterable(self._getTuples(gazedata)))
+        row[self._columns] = self._values
+
+    def decode_batch(self, samples, rows):
+        """Write each of a list of samples into rows[:,1:-1]
+
+        rows is a float64 array of (len(samples),len(ETcolumns)), such as a
+        slice of GazeBuffer.data.
+        """
+        n = len(samples)
+        nScalars = self._nScalars
+        nValues = len(self._columns) - nScalars
+        scalars = np.fromiter(chain.from_iterable(map(self._getScalars, samples)), float, n * nScalars)
+        values = np.fromiter(chain.from_iterable(chain.from_iterable(map(self._getTuples, samples))), float,
+                             n * nValues)
+        rows[:, self._columns[:nScalars]] = scalars.reshape(n, nScalars)
+        rows[:, self._columns[nScalars:]] = values.reshape(n, nValues)
+
+
+class GazeBuffer:
+    """Fixed-capacity ring buffer holding the most recent gaze samples
+
+    Samples are written in place by a single producer (the tobii callback thread)
+    and read by the frame loop. The producer fills the row returned by next_row()
+    and only then calls commit(), so a reader that looks at `count` never sees a
+    half-written sample. No locks are taken on either side.
+
+    Raw samples can instead be queued with put() and decoded into the buffer
+    in batches by decode(samples, rows), which fills rows[:,1:]. put() decodes
+    once batchSize samples are waiting, and readers call pull() first to
+    decode the rest. Only one batch is decoded at a time.
+
+    Readers must keep up: samples older than `capacity` have been overwritten.
+    since() then returns what is left, and counts the samples that were lost
+    (see `dropped`) and passes a message about them to onError.
+
+    Args:
+        capacity: Number of samples the buffer can hold before wrapping
+        ncols: Number of values per sample
+        decode: Function decoding a list of raw samples into rows, for put(). Column 0 already holds their times
+        batchSize: Queued samples put() waits for before decoding them
+        onError: Function called with a message about overwritten samples. None to print it
+    """
+
+    def __init__(self, capacity, ncols=len(ETcolumns), decode=None, batchSize=32, onError=None):
+        self.capacity = int(capacity)
+        self.ncols = ncols
+        self.data = np.full((self.capacity, ncols), np.nan)
+        self.count = 0 # Total number of samples ever committed
+        self.dropped = 0 # Samples overwritten before since() was asked for them
+        self.decode = decode
+        self.batchSize = batchSize
+        self.onError = onError or print
+        self._samples = deque()
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def next_row(self):
+        """View of the row the next sample should be written into"""
+        return self.data[self.count % self.capacity]
+
+    def commit(self):
+        """Publish the row returned by next_row()"""
+        self.count += 1
+
+    def append(self, sample):
+        """Copy one sample into the buffer"""
+        self.data[self.count % self.capacity] = sample
+        self.count += 1
+
+    def put(self, time, sample):
+        """Queue a raw sample and the time it arrived, to be decoded into the buffer in a batch"""
+        self._samples.append(sample)
+        self._times.append(time) # after the sample, so a queued time always has its sample
+        if len(self._times) >= self.batchSize and self._lock.acquire(blocking=False):
+            try:
+                self._decode_queued()
+            finally:
+                self._lock.release()
+
+    def pull(self):
+        """Decode the samples queued by put(). Returns the new count"""
+        if self._times:
+            with self._lock:
+                self._decode_queued()
+        return self.count
+
+    def _decode_queued(self):
+        n = len(self._times)
+        while n:
+            i0 = self.count % self.capacity
+            m = min(n, self.capacity - i0)
+            rows = self.data[i0:i0 + m]
+            rows[:, 0] = [self._times.popleft() for _ in range(m)]
+            self.decode([self._samples.popleft() for _ in range(m)], rows)
+            self.count += m
+            n -= m
+
+    def last(self, n):
+        """The last n samples, oldest first
+
+        Returns a view when the samples are contiguous in memory and a copy when
+        they wrap around the end of the buffer.
+        """
+        return self.since(self.count - n)
+
+    def since(self, start, stop=None):
+        """All samples committed since the sample counter was equal to start
+
+        Args:
+            start: Value of `count` to read from (e.g. the count at trial start)
+            stop: Value of `count` to read up to. Defaults to the current count
+
+        Returns: (n,ncols) array of samples, oldest first
+        """
+        stop = self.count if stop is None else stop
+        oldest = max(stop - self.capacity, 0)
+        lost = oldest - max(start, 0)
+        if lost > 0:
+            self.dropped += lost
+            self.onError('GazeBuffer: %d gaze samples were overwritten before they were read (capacity %d). '
+                         'Read the buffer more often or make it larger' % (lost, self.capacity))
+        start = max(start, oldest)
+        i0 = start % self.capacity
+        i1 = i0 + (stop - start)
+        if i1 <= self.capacity:
+            return self.data[i0:i1]
+        return np.concatenate((self.data[i0:], self.data[:i1 - self.capacity]))
+
+
+class ClockSync:
+    """Online mapping from the eyetracker's system_time_stamp to PsychoPy time
+
+    Each gaze sample arrives with the system_time_stamp the tracker gave it
+    and the core.getTime() of the callback, which is later by a varying
+    delivery delay. The offset and drift between the clocks are fitted to
+    these pairs by recursive least squares with exponential forgetting, so
+    the fit follows slow drift. Residuals beyond huber times the typical
+    residual are down-weighted, so bursts of late callbacks do not pull the fit.
+
+    The fit includes the mean delivery delay. The delay is never negative, so
+    the smallest residual of the last floorWindow samples is added to the fit
+    to move it to the earliest delivery. The corrected time of a sample is
+    then its system_time_stamp mapped to PsychoPy time this way. Every update
+    costs O(1).
+
+    Args:
+        forgetting: Weight kept by older samples at each new sample, e.g. 1 - 1/(5 min of samples)
+        huber: Residuals above this many typical residuals are down-weighted
+        floorWindow: Samples over which the smallest residual is taken
+        warmup: Samples fitted without down-weighting, while the fit settles
+        historySize: Number of recent residuals kept for report()
+        timeScale: Units of system_time_stamp per second (1e6 for tobii's microseconds)
+    """
+
+    def __init__(self, forgetting=1 - 1/180000, huber=3.0, floorWindow=1200, warmup=100, historySize=60000,
+                 timeScale=1e6):
+        self.forgetting = forgetting
+        self.huber = huber
+        self.floorWindow = int(floorWindow)
+        self.warmup = warmup
+        self.timeScale = timeScale
+        self.history = np.full(int(historySize), np.nan)
+        self.count = 0
+        self.downweighted = 0
+        self.x0 = None
+        self.offset = self.drift = 0.
+        self.scale = 1e-3 # mean absolute residual (s)
+        self._p = [1e-2, 0., 1e-6] # covariance of (offset, drift): [p00, p01, p11]
+        self._floor = deque() # (sample number, residual), increasing residuals
+
+    def update(self, systemTimeStamp, coreTime):
+        """Add one sample and return its corrected PsychoPy time"""
+        x = systemTimeStamp / self.timeScale
+        if self.x0 is None:
+            self.x0 = x
+            self.offset = coreTime
+            self.drift = 1.
+        dx = x - self.x0
+        r = coreTime - (self.offset + self.drift * dx)
+
+        # Weighted RLS update of (offset, drift) with phi = (1, dx)
+        w = 1.
+        if self.count >= self.warmup and abs(r) > self.huber * self.scale:
+            w = self.huber * self.scale / abs(r)
+            self.downweighted += 1
+        lam = self.forgetting
+        p00, p01, p11 = self._p
+        pphi0 = p00 + p01 * dx
+        pphi1 = p01 + p11 * dx
+        gain = w / (lam + w * (pphi0 + pphi1 * dx))
+        k0, k1 = pphi0 * gain, pphi1 * gain
+        self.offset += k0 * r
+        self.drift += k1 * r
+        self._p = [(p00 - k0 * pphi0) / lam, (p01 - k0 * pphi1) / lam, (p11 - k1 * pphi1) / lam]
+        self.scale += 0.01 * (abs(r) - self.scale)
+
+        # Residual against the updated fit, and the smallest over the window
+        fitted = self.offset + self.drift * dx
+        r = coreTime - fitted
+        floor = self._floor
+        while floor and floor[-1][1] >= r:
+            floor.pop()
+        floor.append((self.count, r))
+        if floor[0][0] <= self.count - self.floorWindow:
+            floor.popleft()
+        self.history[self.count % self.history.shape[0]] = r
+        self.count += 1
+        return fitted + floor[0][1]
+
+    def update_many(self, systemTimeStamps, coreTimes):
+        """update() with each sample in turn. Returns the list of corrected times"""
+        update = self.update
+        return [update(x, t) for x, t in zip(systemTimeStamps.tolist(), coreTimes.tolist())]
+
+    def correct(self, systemTimeStamp):
+        """PsychoPy time of a system_time_stamp under the current fit, without updating it"""
+        dx = systemTimeStamp / self.timeScale - self.x0
+        return self.offset + self.drift * dx + (self._floor[0][1] if self._floor else 0.)
+
+    def residuals(self):
+        """The most recent residuals (s), oldest first"""
+        n = min(self.count, self.history.shape[0])
+        return np.roll(self.history, -self.count)[-n:] if self.count > n else self.history[:n]
+
+    def summary(self):
+        """Offset (s), drift of the system clock against PsychoPy time (ppm) and the jitter of the callback times around the fit (ms)"""
+        r = self.residuals()
+        floor = self._floor[0][1] if self._floor else np.nan
+        return {'samples': self.count,
+                'offset': self.offset + (floor if self._floor else 0.) - self.drift * (self.x0 or 0.),
+                'drift_ppm': (1 / self.drift - 1) * 1e6,
+                'jitter_sd': r.std() * 1e3 if r.size else np.nan,
+                'jitter_p95': np.percentile(np.abs(r), 95) * 1e3 if r.size else np.nan,
+                'delay_mean': (r.mean() - floor) * 1e3 if r.size else np.nan,
+                'downweighted': self.downweighted}
+
+    def report(self):
+        """The summary as printable text"""
+        s = self.summary()
+        return ('Eyetracker clock sync over %d samples: PsychoPy time = system time %+.6f s, system clock drift %.2f ppm. '
+                'Callback jitter SD %.3f ms, 95%% within %.3f ms, mean delay %.3f ms, %d samples down-weighted'
+                % (s['samples'], s['offset'], s['drift_ppm'], s['jitter_sd'], s['jitter_p95'], s['delay_mean'],
+                   s['downweighted']))
+
+
+class DwellDetector:
+    """Sliding-window check of where both eyes have been looking
+
+    Keeps the last `windowSamples` gaze positions (x/y of each eye on the display)
+    along with running NaN-aware sums and counts, so the mean position over the
+    window is available in O(1) after each new sample. A region of interest (ROI)
+    is fixated when the mean x and y of both eyes lie inside its limits, the same
+    criterion the saccade response has always used.
+
+    Args:
+        windowSamples: Number of samples in the window (fixation time * eyetracker frequency)
+        columns: Columns of a gaze sample holding left x, left y, right x, right y
+    """
+
+    def __init__(self, windowSamples, columns=(13, 14, 28, 29)):
+        self.windowSamples = int(windowSamples)
+        self.columns = list(columns)
+        self.rois = {}
+        self.window = np.empty((self.windowSamples, len(self.columns)))
+        self.reset()
+
+    def reset(self):
+        """Forget all samples. ROIs are kept"""
+        self.window[:] = np.nan
+        self.sums = np.zeros(len(self.columns))
+        self.counts = np.zeros(len(self.columns))
+        self.pos = 0
+        self.nSamples = 0
+        self._sinceExact = 0
+
+    def add_roi(self, name, lims):
+        """Add a rectangular ROI
+
+        Args:
+            name: Name returned by current_roi()
+            lims: (xmin, xmax, ymin, ymax) in tobii display coordinates
+        """
+        self.rois[name] = tuple(float(x) for x in np.ravel(lims))
+
+    @property
+    def ready(self):
+        """True once the window is full"""
+        return self.nSamples >= self.windowSamples
+
+    def push(self, sample):
+        """Add one gaze sample (a full row of ETcolumns)"""
+        self.extend(np.asarray(sample)[None, :])
+
+    def extend(self, block):
+        """Add a (n,ncols) block of gaze samples, oldest first"""
+        n = self.windowSamples
+        values = block[-n:, self.columns]
+        k = values.shape[0]
+        if k == 0:
+            return
+        self.nSamples += block.shape[0]
+
+        # The incoming samples overwrite the oldest ones, possibly wrapping around
+        stop = self.pos + k
+        if stop <= n:
+            self._replace(slice(self.pos, stop), values)
+        else:
+            self._replace(slice(self.pos, n), values[:n - self.pos])
+            self._replace(slice(0, stop - n), values[n - self.pos:])
+        self.pos = stop % n
+
+        # Stop floating point error from accumulating in the running sums
+        self._sinceExact += k
+        if self._sinceExact >= n:
+            valid = ~np.isnan(self.window)
+            self.sums = np.where(valid, self.window, 0.).sum(axis=0)
+            self.counts = valid.sum(axis=0).astype(float)
+            self._sinceExact = 0
+
+    def _replace(self, rows, values):
+        old = self.window[rows]
+        oldValid = old == old
+        newValid = values == values
+        self.sums += values.sum(axis=0, where=newValid) - old.sum(axis=0, where=oldValid)
+        self.counts += newValid.sum(axis=0) - oldValid.sum(axis=0)
+        self.window[rows] = values
+
+    def means(self):
+        """Mean left x, left y, right x, right y over the window (NaN if no valid samples)"""
+        return [s / c if c > 0 else np.nan for s, c in zip(self.sums.tolist(), self.counts.tolist())]
+
+    def in_roi(self, name, means=None):
+        """True if the window is full and both eyes' mean position is inside ROI `name`"""
+        if not self.ready:
+            return False
+        xmin, xmax, ymin, ymax = self.rois[name]
+        xl, yl, xr, yr = self.means() if means is None else means
+        # NaN compares False, so a window without valid samples is never inside
+        return (xmin <= xl <= xmax and xmin <= xr <= xmax and
+                ymin <= yl <= ymax and ymin <= yr <= ymax)
+
+    def current_roi(self):
+        """Name of the first ROI currently fixated, or None"""
+        if not self.ready:
+            return None
+        means = self.means()
+        for name in self.rois:
+            if self.in_roi(name, means):
+                return name
+        return None
+
+
+# Per point and eye results of the eyetracker validation. Positions are in
+# degrees from the screen centre (y up), dataLoss is the fraction of samples lost
+VALIDATION_DTYPE = np.dtype([
+    ('point', 'i4'), ('eye', 'U5'),
+    ('targetX', 'f8'), ('targetY', 'f8'), ('gazeX', 'f8'), ('gazeY', 'f8'),
+    ('nSamples', 'i4'), ('accuracy', 'f8'), ('precision', 'f8'), ('dataLoss', 'f8')])
+
+# Gaze point on display (x, y) and its validity for each eye
+_VALIDATION_EYES = ('left', 'right')
+_VALIDATION_XY = [[13, 14], [28, 29]]
+_VALIDATION_VALIDITY = [15, 30]
+
+
+def display_to_cm(xy, screenRes, screenWidth):
+    """Tobii display-area coordinates (0-1, origin top left) to cm from the screen centre, y up
+
+    Args:
+        xy: (...,2) array of display-area positions
+        screenRes: (width, height) of the screen in pixels
+        screenWidth: Width of the screen in cm. Pixels are taken to be square
+    """
+    cmPerPix = screenWidth / screenRes[0]
+    return np.stack(((xy[..., 0] - 0.5) * screenRes[0] * cmPerPix,
+                     (0.5 - xy[..., 1]) * screenRes[1] * cmPerPix), axis=-1)
+
+
+def visual_angle(a, b, viewDistance):
+    """Angle (deg) at the eye between screen positions a and b
+
+    The eye is viewDistance cm in front of the screen centre. a and b are
+    (...,2) arrays in cm from the screen centre and broadcast against each other.
+    """
+    a, b = np.broadcast_arrays(a, b)
+    va = np.concatenate((a, np.full(a.shape[:-1] + (1,), viewDistance)), axis=-1)
+    vb = np.concatenate((b, np.full(b.shape[:-1] + (1,), viewDistance)), axis=-1)
+    # atan2(|a x b|, a.b) stays accurate for the small angles between neighbouring samples
+    return np.degrees(np.arctan2(np.linalg.norm(np.cross(va, vb), axis=-1), (va * vb).sum(axis=-1)))
+
+
+def validation_metrics(samples, counts, targets, screenRes, screenWidth, viewDistance, expected=None):
+    """Accuracy, precision and data loss of each validation point and eye
+
+    Accuracy is the mean angle between each valid gaze sample and the target,
+    precision the RMS of the angles between consecutive valid samples
+    (RMS-S2S) and data loss the fraction of the expected samples without a
+    valid gaze point, so samples the tracker never delivered count as lost.
+    Everything is computed at once over the sample block.
+
+    Args:
+        samples: (nPoints,nSamples,ncols) block of gaze samples (ETcolumns) recorded at each point
+        counts: Number of samples recorded at each point. Later rows of the block are ignored
+        targets: (nPoints,2) positions of the points in pixels from the screen centre, y up
+        screenRes: (width, height) of the screen in pixels
+        screenWidth: Width of the screen in cm
+        viewDistance: Distance from the eyes to the screen in cm
+        expected: Number of samples each point should have had (e.g. 1.5 s worth), one or one per point.
+            None to take counts
+
+    Returns: Structured array of VALIDATION_DTYPE, one row per point and eye
+    """
+    nPoints, nSamples = samples.shape[:2]
+    recorded = np.arange(nSamples) < np.asarray(counts)[:, None]
+    gaze = display_to_cm(samples[:, :, _VALIDATION_XY], screenRes, screenWidth) # (point, sample, eye, xy)
+    valid = (recorded[:, :, None] & (samples[:, :, _VALIDATION_VALIDITY] > 0) &
+             np.isfinite(gaze).all(axis=-1))
+    targetsCm = np.asarray(targets, dtype=float) * screenWidth / screenRes[0]
+
+    nValid = valid.sum(axis=1)
+    offsets = visual_angle(gaze, targetsCm[:, None, None, :], viewDistance)
+    steps = visual_angle(gaze[:, 1:], gaze[:, :-1], viewDistance)
+    pairs = valid[:, 1:] & valid[:, :-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accuracy = np.where(valid, offsets, 0).sum(axis=1) / nValid
+        precision = np.sqrt(np.where(pairs, steps ** 2, 0).sum(axis=1) / pairs.sum(axis=1))
+        meanGaze = np.where(valid[..., None], gaze, 0).sum(axis=1) / nValid[..., None]
+        dataLoss = 1 - nValid / np.broadcast_to(counts if expected is None else expected, (nPoints,))[:, None]
+
+    metrics = np.zeros((nPoints, len(_VALIDATION_EYES)), dtype=VALIDATION_DTYPE)
+    metrics['point'] = np.arange(nPoints)[:, None]
+    metrics['eye'] = _VALIDATION_EYES
+    metrics['targetX'], metrics['targetY'] = np.degrees(np.arctan(targetsCm / viewDistance)).T[:, :, None]
+    metrics['gazeX'] = np.degrees(np.arctan(meanGaze[..., 0] / viewDistance))
+    metrics['gazeY'] = np.degrees(np.arctan(meanGaze[..., 1] / viewDistance))
+    metrics['nSamples'] = nValid
+    metrics['accuracy'] = accuracy
+    metrics['precision'] = precision
+    metrics['dataLoss'] = dataLoss
+    return metrics.ravel()
+
+
+def chunk_means(samples, columns, size=50):
+    """Means of consecutive `size`-sample chunks of the given columns, ignoring NaNs
+
+    A last chunk shorter than `size` is dropped.
+    """
+    n = samples.shape[0] // size * size
+    return np.nanmean(samples[:n, columns].reshape(-1, size, len(columns)), axis=1)
@@ -0,0 +1,231 @@
+"""
+Writing and reading eyetracker recordings
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from eyetracking import ETcolumns
+
+# Binary gaze files start with this tag, a little-endian uint32 giving the length
+# of a JSON header, then the header. Raw float64 samples follow, row by row
+GAZE_MAGIC = b'TAMYGAZE'
+GAZE_DTYPE = '<f8'
+_HEADER_ALIGN = 64
+
+
+def write_gaze_header(f, columns):
+    """Write the header of a binary gaze file
+
+    The header is padded so the samples start on a 64 byte boundary.
+    """
+    meta = json.dumps({'format': 'tamy-gaze', 'version': 1, 'dtype': GAZE_DTYPE,
+                       'columns': list(columns)}).encode('utf-8')
+    prefix = len(GAZE_MAGIC) + 4
+    padded = -(-(prefix + len(meta)) // _HEADER_ALIGN) * _HEADER_ALIGN
+    meta += b' ' * (padded - prefix - len(meta))
+    f.write(GAZE_MAGIC + struct.pack('<I', len(meta)) + meta)
+
+
+def read_gaze_header(binPath):
+    """Read the header of a binary gaze file
+
+    Returns:
+        columns: List of column names
+        offset: Byte offset where the samples start
+    """
+    with open(binPath, 'rb') as f:
+        magic = f.read(len(GAZE_MAGIC))
+        if magic != GAZE_MAGIC:
+            raise ValueError('%s is not a binary gaze file' % binPath)
+        nbytes = struct.unpack('<I', f.read(4))[0]
+        meta = json.loads(f.read(nbytes).decode('utf-8'))
+    return meta['columns'], len(GAZE_MAGIC) + 4 + nbytes
+
+
+def load_gaze_binary(binPath, mmap=True):
+    """Load a binary gaze file
+
+    Args:
+        binPath: Path to the file
+        mmap: Memory-map the samples instead of reading them into memory
+
+    Returns:
+        data: (nSamples,ncols) float64 array (read only np.memmap when mmap is True)
+        columns: List of column names
+    """
+    columns, offset = read_gaze_header(binPath)
+    rowBytes = len(columns) * np.dtype(GAZE_DTYPE).itemsize
+    # A row that was cut short by a crash is ignored
+    nRows = (os.path.getsize(binPath) - offset) // rowBytes
+    if nRows == 0:
+        return np.empty((0, len(columns))), columns
+    if mmap:
+        data = np.memmap(binPath, dtype=GAZE_DTYPE, mode='r', offset=offset, shape=(nRows, len(columns)))
+    else:
+        with open(binPath, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype=GAZE_DTYPE, count=nRows*len(columns)).reshape(nRows, len(columns))
+    return data, columns
+
+
+def gaze_binary_to_csv(binPath, csvPath, chunkRows=100000):
+    """Convert a binary gaze file into the _et.csv layout written by np.savetxt"""
+    data, columns = load_gaze_binary(binPath)
+    with open(csvPath, 'wb') as f:
+        np.savetxt(f, np.empty((0, len(columns))), delimiter=',', header=','.join(columns))
+        for start in range(0, data.shape[0], chunkRows):
+            np.savetxt(f, data[start:start+chunkRows], delimiter=',')
+
+
+class GazeWriter:
+    """Streams blocks of gaze samples to file from a worker thread
+
+    Blocks handed to put() are queued and written by the worker, so the caller
+    never waits on text formatting or disk. Queued samples are written once
+    `chunkRows` samples have accumulated or the oldest of them has waited
+    `maxLatency` seconds, whichever comes first. close() writes whatever is left
+    and waits for the worker to finish.
+
+    Samples can go to a csv file, a binary gaze file (see load_gaze_binary) or both.
+
+    If a file cannot be opened or written, its samples are kept in memory and
+    written, in order, at the next write that succeeds, so a passing error
+    (e.g. a full disk that is cleared) loses nothing. onError is called from
+    the worker thread when a file starts failing, when it recovers, and at
+    close() if samples could still not be written.
+
+    Args:
+        csvPath: csv file to append samples to. None to skip the csv
+        columns: Column names for the header
+        chunkRows: Number of samples to accumulate before writing
+        maxLatency: Longest time (in seconds) a sample may wait before being written
+        binPath: Binary file to append samples to. None to skip the binary file
+        onError: Function called with a message about write errors. None to print it
+    """
+
+    def __init__(self, csvPath, columns=ETcolumns, chunkRows=12000, maxLatency=5.0, binPath=None, onError=None):
+        self.csvPath = csvPath
+        self.binPath = binPath
+        self.columns = list(columns)
+        self.chunkRows = chunkRows
+        self.maxLatency = maxLatency
+        self.onError = onError or print
+        self.nWritten = 0 # samples written to every file
+        self.nFailed = 0 # samples waiting to be written again after an error
+        self.error = None # the last error, None once every file has caught up
+        self._targets = [{'path': path, 'binary': binary, 'file': None, 'failed': [], 'written': 0,
+                          'error': None}
+                         for path, binary in [(csvPath, False), (binPath, True)] if path is not None]
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='GazeWriter', daemon=True)
+        self._thread.start()
+
+    def put(self, block):
+        """Queue a (n,ncols) block of samples for writing. Returns immediately"""
+        if len(block):
+            # Copy so the caller can keep reusing its buffer
+            self._queue.put(np.array(block, dtype=float))
+
+    def close(self, timeout=None):
+        """Write all queued samples and stop the worker thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _open(self, target):
+        f = open(target['path'], 'ab')
+        if f.tell() == 0:
+            if target['binary']:
+                write_gaze_header(f, self.columns)
+            else:
+                np.savetxt(f, np.empty((0, len(self.columns))), delimiter=',', header=','.join(self.columns))
+        target['file'] = f
+
+    def _run(self):
+        pending = []
+        nPending = 0
+        tOldest = None
+        finished = False
+        try:
+            while not finished:
+                timeout = None if tOldest is None else max(0., tOldest + self.maxLatency - time.monotonic())
+                try:
+                    block = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    block = []
+                if block is None:
+                    finished = True
+                elif len(block):
+                    pending.append(block)
+                    nPending += len(block)
+                    if tOldest is None:
+                        tOldest = time.monotonic()
+
+                if pending and (finished or nPending >= self.chunkRows or
+                                time.monotonic() - tOldest >= self.maxLatency):
+                    self._write(pending)
+                    pending = []
+                    nPending = 0
+                    tOldest = None
+            # One more try at samples an earlier error held back
+            if self.nFailed:
+                self._write([])
+            for target in self._targets:
+                if target['failed']:
+                    self.onError('GazeWriter: %d gaze samples could not be written to %s: %s'
+                                 % (sum(map(len, target['failed'])), target['path'], target['error']))
+        finally:
+            for target in self._targets:
+                if target['file'] is not None:
+                    target['file'].close()
+
+    def _write(self, blocks):
+        if blocks:
+            data = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        for target in self._targets:
+            if blocks:
+                target['failed'].append(data)
+            if not target['failed']:
+                continue
+            failing = target['error'] is not None
+            try:
+                if target['file'] is None:
+                    self._open(target)
+                f = target['file']
+                todo = target['failed'][0] if len(target['failed']) == 1 else np.concatenate(target['failed'])
+                position = f.tell()
+                try:
+                    if target['binary']:
+                        f.write(todo.astype(GAZE_DTYPE, copy=False).tobytes())
+                    else:
+                        np.savetxt(f, todo, delimiter=',')
+                    f.flush()
+                except Exception:
+                    # Drop what was partly written, so the samples are written whole next time
+                    try:
+                        f.seek(position)
+                        f.truncate()
+                    except Exception:
+                        pass
+                    raise
+                target['failed'] = []
+                target['written'] += len(todo)
+                target['error'] = None
+                if failing:
+                    self.onError('GazeWriter: %s is being written again, no gaze samples were lost' % target['path'])
+            except Exception as error:
+                target['error'] = error
+                if not failing:
+                    self.onError('GazeWriter: could not write %s, keeping the gaze samples to try again: %s'
+                                 % (target['path'], error))
+        self.nWritten = min(target['written'] for target in self._targets) if self._targets else 0
+        self.nFailed = max([sum(map(len, target['failed'])) for target in self._targets] + [0])
+        errors = [target['error'] for target in self._targets if target['error'] is not None]
+        self.error = errors[-1] if errors else None
@@ -16,69 +16,74 @@ import numpy as np
 from numpy.random import randint
 import os
 import os.path as op
-import pandas as pd
 import sys
-from psychtoolbox import GetSecs, WaitSecs
-from psychopy import core, event, visual, sound, logging, gui
-from psychopy.hardware import keyboard
+from psychopy import core, logging
 #from psychopy.tools import environmenttools
-from psychopy.data import ExperimentHandler, TrialHandler2
 from psychopy.constants import NOT_STARTED, STARTED, FINISHED
-import tobii_research as tobii
+
+# Imported by load_task_modules() once the opening dialog says what the session needs
+visual = sound = event = keyboard = None
+ExperimentHandler = TrialHandler2 = None
+GetSecs = None # psychtoolbox's clock, see ptb_offset in run()
+tobii = None
 
 
 # Ensure that relative paths start from the same directory as this script
 _thisDir = op.dirname(op.abspath(__file__))
 logDir = op.join(_thisDir, 'logs')
 stimDir = op.join(_thisDir, 'stimuli')
-from utils import openingDlg, set_ttl, createAudioStream, setScreen, read_wav, createToneReps, pauseAndReadText, generate_tone_sequence
+from utils import openingDlg, set_ttl, createAudioStream, setScreen, pauseAndReadText
 from settings import SETTINGS
-
-# Callback function for tobii eyetracker
+from eyetracking import ETcolumns, ClockSync, DwellDetector, GazeBuffer, GazeDecoder, VALIDATION_DTYPE, chunk_means, validation_metrics
+from gazeio import GazeWriter
+from timing import AudioLatencyAudit, FrameTimer, ptb_start_time
+from audio import StimulusBank, StimulusLibrary, TrialAudioComposer, WavCache
+from triallog import TrialLog, wide_text_columns
+from scheduler import Phase, PhaseScheduler
+
+def load_task_modules(expInfo):
+    """Import the psychopy stimulus, audio and data modules, and tobii_research if an eyetracker is used
+
+    Kept out of the module imports so the opening dialog appears quickly. Names
+    that are already set (e.g. by simulation.py) are left as they are.
+    """
+    global visual, sound, event, keyboard, ExperimentHandler, TrialHandler2, GetSecs, tobii
+    if visual is None:
+        from psychopy import visual
+    if sound is None:
+        from psychopy import sound
+    if event is None:
+        from psychopy import event
+    if keyboard is None:
+        from psychopy.hardware import keyboard
+    if ExperimentHandler is None:
+        from psychopy.data import ExperimentHandler
+    if TrialHandler2 is None:
+        from psychopy.data import TrialHandler2
+    if GetSecs is None:
+        from psychtoolbox import GetSecs
+    if tobii is None and expInfo['eyetracker'] != 'None':
+        import tobii_research as tobii
+
+# Callback function for tobii eyetracker. Samples are delivered as dictionaries
+# (subscribe_to(..., as_dictionary=True)) and queued in gazeBuffer with their arrival time,
+# which decodes them in batches with decode_gaze. Call gazeBuffer.pull() before reading it.
+# correctedTime is the sample's system_time_stamp (column 2) mapped to PsychoPy time by clockSync
+gazeDecoder = GazeDecoder(asDictionary=True)
 def gaze_callback(gazedata):
-    cdata = np.empty((1,33))
-    #cdata[0,0] = gazedata._GazeData__device_time_stamp / 1000000
-    #cdata[0,1] = gazedata._GazeData__system_time_stamp / 1000000
-    cdata[0,0] = core.getTime()
-    cdata[0,1] = gazedata._GazeData__device_time_stamp
-    cdata[0,2] = gazedata._GazeData__system_time_stamp
-    cdata[0,3] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[0]
-    cdata[0,4] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[1]
-    cdata[0,5] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[2]
-    cdata[0,6] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[0]
-    cdata[0,7] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[1]
-    cdata[0,8] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[2]
-    cdata[0,9] = gazedata._GazeData__left._EyeData__gaze_origin._GazeOrigin__validity
-    cdata[0,10] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[0]
-    cdata[0,11] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[1]
-    cdata[0,12] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_in_user_coordinates[2]
-    cdata[0,13] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_on_display_area[0]
-    cdata[0,14] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__position_on_display_area[1]
-    cdata[0,15] = gazedata._GazeData__left._EyeData__gaze_point._GazePoint__validity
-    cdata[0,16] = gazedata._GazeData__left._EyeData__pupil_data._PupilData__diameter
-    cdata[0,17] = gazedata._GazeData__left._EyeData__pupil_data._PupilData__validity
-    cdata[0,18] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[0]
-    cdata[0,19] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[1]
-    cdata[0,20] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_track_box_coordinates[2]
-    cdata[0,21] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[0]
-    cdata[0,22] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[1]
-    cdata[0,23] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__position_in_user_coordinates[2]
-    cdata[0,24] = gazedata._GazeData__right._EyeData__gaze_origin._GazeOrigin__validity
-    cdata[0,25] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[0]
-    cdata[0,26] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[1]
-    cdata[0,27] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_in_user_coordinates[2]
-    cdata[0,28] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_on_display_area[0]
-    cdata[0,29] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__position_on_display_area[1]
-    cdata[0,30] = gazedata._GazeData__right._EyeData__gaze_point._GazePoint__validity
-    cdata[0,31] = gazedata._GazeData__right._EyeData__pupil_data._PupilData__diameter
-    cdata[0,32] = gazedata._GazeData__right._EyeData__pupil_data._PupilData__validity
-    global ETdata
-    ETdata = np.append(ETdata,cdata, axis=0)
-
-def ETvalidation(win,eyetracker,etFrequency):
-    # just give it the window and eyetracker objects created in the main script as well as the frequency that the eyetracker is set to
-    # get an output variable from this which will tell you if you should continue the experiment after validation
-    # TO DO: still needs to capture the time stamps of the validation points first being shown and return them
+    gazeBuffer.put(core.getTime(), gazedata)
+
+def decode_gaze(samples, rows):
+    gazeDecoder.decode_batch(samples, rows)
+    rows[:, -1] = clockSync.update_many(rows[:, 2], rows[:, 0])
+
+# Length (s) of ETvalidation's recording: the instructions, then 2 s and a 0.4 s pause at each of the 4 points
+ETVALIDATION_TIME = 2 + 4*(2 + 0.4)
+
+def ETvalidation(win,eyetracker,etFrequency,mon):
+    # just give it the window, monitor and eyetracker objects created in the main script as well as the frequency that the eyetracker is set to
+    # get an output variable from this which will tell you if you should continue the experiment after validation,
+    # the times each point was shown and the accuracy, precision and data loss of each point and eye (see eyetracking.validation_metrics)
     
     continueValidation = True
     continueExp = True
@@ -94,10 +99,12 @@ def ETvalidation(win,eyetracker,etFrequency):
         size=(0, 0), pos=(0, 0), lineWidth=5.0, colorSpace='rgb', lineColor='white', fillColor=None,
         opacity=None, depth=0.0, interpolate=True, units='pix')
     
-    eyedotsLeft = np.empty((0,2))
-    eyedotsRight = np.empty((0,2))
+    # The last 1.5 s of samples at each point, copied into one preallocated block
+    pointSamples = int(1.5*etFrequency)
+    samples = np.full((validationPoints.shape[0], pointSamples, len(ETcolumns)), np.nan)
+    counts = np.zeros(validationPoints.shape[0], dtype=int)
     times = np.empty((4,2))
-    eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA,gaze_callback)
+    eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA,gaze_callback,as_dictionary=True)
     
     Inst = visual.TextStim(win = win, units = 'norm', height = 0.1,
                 pos = (0,0), text = 'Look at the dots!', alignHoriz = 'center',
@@ -110,7 +117,7 @@ def ETvalidation(win,eyetracker,etFrequency):
         point.setPos(validationPoints[i,:])
         circle.setPos(validationPoints[i,:])
         tStart = core.getTime()
-        tStartET = ETdata[-1,0]
+        tStartET = gazeBuffer.last(1)[0,0] if gazeBuffer.pull() else np.nan
         tNow = core.getTime()
         point.setAutoDraw(True)
         circle.setAutoDraw(True)
@@ -121,8 +128,8 @@ def ETvalidation(win,eyetracker,etFrequency):
             circle.setSize([size,size])
             win.flip()
             tNow = core.getTime()
-        eyedotsLeft = np.append(eyedotsLeft,ETdata[ETdata.shape[0]-int(1.5*etFrequency):ETdata.shape[0],13:15],axis=0)
-        eyedotsRight = np.append(eyedotsRight,ETdata[ETdata.shape[0]-int(1.5*etFrequency):ETdata.shape[0],28:30],axis=0)
+        counts[i] = min(pointSamples, gazeBuffer.pull())
+        samples[i,:counts[i]] = gazeBuffer.last(counts[i])
         times[i,0] = tStart
         times[i,1] = tStartET
         core.wait(0.4)
@@ -130,14 +137,13 @@ def ETvalidation(win,eyetracker,etFrequency):
     circle.setAutoDraw(False)
     eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
     
+    metrics = validation_metrics(samples, counts, validationPoints, win.size, mon.getWidth(), mon.getDistance(),
+                                 expected=pointSamples)
+    
     # average samples
-    avgLeft = np.empty((0,2))
-    avgRight = np.empty((0,2))
-    for i in range(int(eyedotsLeft.shape[0]/50)):
-        sample = eyedotsLeft[i*50:(i+1)*50]
-        avgLeft = np.append(avgLeft,np.reshape(np.nanmean(sample,axis=0),(1,2)),axis=0)
-        sample = eyedotsRight[i*50:(i+1)*50]
-        avgRight = np.append(avgRight,np.reshape(np.nanmean(sample,axis=0),(1,2)),axis=0)
+    recorded = samples[np.arange(pointSamples) < counts[:,None]]
+    avgLeft = chunk_means(recorded, [13,14])
+    avgRight = chunk_means(recorded, [28,29])
     
     # show validation results
     dotsRight = visual.ElementArrayStim(win=win,
@@ -168,8 +174,12 @@ def ETvalidation(win,eyetracker,etFrequency):
                         elementTex=None,
                         units='pix')
 
+    summary = '\n'.join('%s eye: accuracy %.2f deg, precision %.2f deg, data loss %.0f%%' % (eye,
+        np.nanmean(metrics['accuracy'][metrics['eye']==eye]), np.nanmean(metrics['precision'][metrics['eye']==eye]),
+        100*np.nanmean(metrics['dataLoss'][metrics['eye']==eye])) for eye in ['left','right'])
+    logging.exp('Eyetracker validation\n' + summary)
     validationText = visual.TextStim(win = win, units = 'norm', height = 0.05,
-                    pos = (0,0), text = 'press spacebar to accept or esc to abort', alignHoriz = 'center',
+                    pos = (0,0), text = summary + '\n\npress spacebar to accept or esc to abort', alignHoriz = 'center',
                     alignVert = 'center', color = 'white', wrapWidth=1.5, autoLog=False)
     validationText.setAutoDraw(True)
     keepwaiting = True
@@ -188,8 +198,14 @@ def ETvalidation(win,eyetracker,etFrequency):
                 continueExp=False
         win.flip()
     win.flip()
-    return continueExp, times
+    return continueExp, times, metrics
     
+def run_tracker_manager(mode):
+    """Open Tobii Pro Eye Tracker Manager in the given mode (e.g. 'usercalibration')"""
+    tracker_manager_path = 'C:/Users/HBML/AppData/Local/Programs/TobiiProEyeTrackerManager/'
+    serial_number = 'TPSP1-010202818635'
+    os.system('{}TobiiProEyeTrackerManager.exe --device-sn={} --mode={}'.format(tracker_manager_path, serial_number, mode))
+
 # Main function to run experiment
 def run():
 
@@ -197,6 +213,7 @@ def run():
     # Setup
     ###############################################################
     expInfo = openingDlg()
+    load_task_modules(expInfo)
     run_dir = expInfo['outputDir']
     globalFs = expInfo['sound_fs']
     ttl_code = expInfo['ttl_code']
@@ -210,16 +227,14 @@ def run():
         address = 'NaN'
 
     # Set how to send and then close the TTL port
-    send_ttl, close_ttl = set_ttl(expInfo['ttl'], address)
+    send_ttl, close_ttl = set_ttl(expInfo['ttl'], address, pulseWidth=SETTINGS['ttl_pulse_width'],
+        logFile=op.join(run_dir, expInfo['runid'] + '_ttl.csv') if SETTINGS['ttl_log'] else None)
     
     # Calibrate eyetracker
     if expInfo['eyetracker'] != 'None':
         eyetracker = tobii.find_all_eyetrackers()[0]
         eyetracker.set_gaze_output_frequency(expInfo['eyetracker'])
-        tracker_manager_path = 'C:/Users/HBML/AppData/Local/Programs/TobiiProEyeTrackerManager/'
-        serial_number = 'TPSP1-010202818635'
-        mode = 'usercalibration'
-        os.system('{}TobiiProEyeTrackerManager.exe --device-sn={} --mode={}'.format(tracker_manager_path, serial_number, mode))
+        run_tracker_manager('usercalibration')
         
     # Setup the Window, Keyboard, Mouse
     win, mon = setScreen(
@@ -246,6 +261,10 @@ def run():
         extraInfo=expInfo, dataFileName=filename, autoLog=True,
         saveWideText=True, savePickle=True)
 
+    # Every trial is appended to <run>_trials.csv when it ends, so a crash loses at most the current trial
+    trialLog = TrialLog(filename + '_trials.csv', fsyncRows=SETTINGS['trial_log_fsync'],
+        onError=logging.warning) if SETTINGS['trial_log'] else None
+
     # TrialHandler
     trials = TrialHandler2(
         op.join(_thisDir,'soundslist.csv'),
@@ -255,6 +274,21 @@ def run():
         extraInfo=expInfo)
     thisExp.addLoop(trials)
 
+    # Render the cue and choice tone sequences of every trial up front. Each trial has its own seed
+    stimBank = StimulusBank(trials.trialList, globalFs, nReps=trials.nReps, coherence=0.9,
+        workers=SETTINGS['stim_workers'])
+
+    # Resampled wav stimuli are cached on disk, so later sessions skip resampling
+    wavCacheDir = SETTINGS['wav_cache_dir']
+    wavCache = WavCache(wavCacheDir and op.join(_thisDir, wavCacheDir), maxBytes=SETTINGS['wav_cache_mb']*2**20,
+        onError=logging.warning)
+
+    # Decode and resample every wav stimulus the conditions name (once each) before the first trial
+    stimLibrary = StimulusLibrary(stimDir, trials.trialList, globalFs, scan=SETTINGS['stim_scan_dir'],
+        method=SETTINGS['wav_resample'], cache=wavCache, workers=SETTINGS['stim_load_workers'])
+    if len(stimLibrary):
+        logging.exp(stimLibrary.report())
+
     # Trial feedback text
     correctResponseText = visual.TextStim(
         win=win, text='Correct', font='Arial', units='norm', pos=(0, 0),
@@ -325,6 +359,12 @@ def run():
     diffBoxLims[2] = ((diffBox.pos[1]+diffBox.height/2)/-2)+0.5
     diffBoxLims[3] = ((diffBox.pos[1]-diffBox.height/2)/-2)+0.5
 
+    # Tracks whether the eyes have settled on one of the boxes (saccade responses)
+    if expInfo['eyetracker'] != 'None':
+        dwellDetector = DwellDetector(SETTINGS['response_fixation_time']*int(expInfo['eyetracker']))
+        dwellDetector.add_roi('same', sameBoxLims)
+        dwellDetector.add_roi('diff', diffBoxLims)
+
 
     # Initiate audio
     stream = sound.Sound(name='trial_audio', sampleRate=globalFs, stereo=True, syncToWin=win)
@@ -334,31 +374,118 @@ def run():
     # Create audio clicks
     clickDur = SETTINGS["click_dur"]
     clickSOA = SETTINGS["click_soa"]
-    trlDur = 60
+    trlDur = SETTINGS['wait_time']
     clickReps = np.floor(trlDur/clickSOA).astype(int)
     singleClick = np.ones( ( round(clickDur*globalFs),) )
-    clickStream = createAudioStream(singleClick,clickSOA,globalFs,clickReps)
+    clickPeriod = createAudioStream(singleClick,clickSOA,globalFs,1)
     choice2cue_clickStream = createAudioStream(singleClick,clickSOA,globalFs,5)
+    choice2cue_clickOnsets = np.arange(5) * clickPeriod.shape[0] / globalFs
+    if SETTINGS['click_playback'] == 'loop':
+        # The response window click train is one SOA of audio that the audio backend repeats.
+        # It is uploaded once, so its cost does not depend on wait_time
+        clickLoop = sound.Sound(value=clickPeriod, name='click_loop', sampleRate=globalFs, stereo=True,
+            loops=clickReps-1, hamming=False)
+        clickStream = np.empty((0,2), dtype='float32')
+    else:
+        clickLoop = None
+        clickStream = createAudioStream(singleClick,clickSOA,globalFs,clickReps)
+    clickOnsets = np.arange(clickReps) * clickPeriod.shape[0] / globalFs
+
+    # Every trial's audio is assembled in one reusable buffer. The click trains never change,
+    # so they are marked read-only and only copied when their position in the buffer moves
+    clickStream.setflags(write=False)
+    choice2cue_clickStream.setflags(write=False)
+    maxTrialSamples = 2*stimBank.sounds.shape[2] + choice2cue_clickStream.shape[0] + clickStream.shape[0]
+    composer = TrialAudioComposer(maxTrialSamples, globalFs)
+
+    # Records the time of every flip, tagged by the part of the trial it was in (opt-in)
+    longestTrial = SETTINGS['iti'][1] + maxTrialSamples/globalFs + SETTINGS['wait_time'] + 3
+    frameTimer = FrameTimer(win.monitorFramePeriod, maxFrames=1.2*longestTrial/win.monitorFramePeriod,
+        framesPath=filename + '_frames.csv', enabled=SETTINGS['frame_timing'])
+
+    # Runs each part of a trial in one frame loop, with spare frame time for idle tasks (see scheduler.py)
+    scheduler = PhaseScheduler(win, core.getTime, frameTimer)
+
+    # Compares when each trial's audio was scheduled, the flip it was tied to and when the device started it
+    audioAudit = AudioLatencyAudit(SETTINGS['frameTolerance'], maxTrials=len(stimBank))
+
+    # With the trial log, <run>.csv is copied from it instead of being written from thisExp
+    def save_data():
+        if trialLog is not None:
+            trialLog.finalize(filename + '.csv', wide_text_columns(thisExp))
+        else:
+            thisExp.saveAsWideText(filename+'.csv', delim='auto')
+        if SETTINGS['save_pickle']:
+            thisExp.saveAsPickle(filename)
+
+    def report_timing():
+        reports = [audioAudit.report(), scheduler.report()]
+        if expInfo['eyetracker'] != 'None':
+            reports.append(clockSync.report())
+        for report in reports:
+            logging.exp(report)
+
+    # core.getTime() counts from when psychopy was loaded, PTB's GetSecs() (the clock PTB sounds are
+    # scheduled on and report their start on) from an absolute origin. Add this to a PsychoPy time to get PTB time
+    def ptb_offset():
+        return GetSecs() - core.getTime()
+
+    # Stops everything that might be playing
+    def stop_audio():
+        stream.stop()
+        if clickLoop is not None:
+            clickLoop.stop()
     
     # Initiate Eyetracker
     if expInfo['eyetracker'] != 'None':
         ETdataFilePath = filename + '_et.csv'
         # initiate data frame for eyetracker data
         # ETcolumns = 'deviceTimeStampInSec,systemTimeStampInSec,xLeftGazeOriginInTrackboxCoords,yLeftGazeOriginInTrackboxCoords,zLeftGazeOriginInTrackboxCoords,xLeftGazeOriginInUserCoords,yLeftGazeOriginInUserCoords,zLeftGazeOriginInUserCoords,leftGazeOriginValidity,xLeftGazePositionInUserCoords,yLeftGazePositionInUserCoords,zLeftGazePositionInUserCoords,xLeftGazePositionOnDisplay,yLeftGazePositionOnDisplay,leftGazePointValidity,leftPupilDiameter,leftPupilValidity,xRightGazeOriginInTrackboxCoords,yRightGazeOriginInTrackboxCoords,zRightGazeOriginInTrackboxCoords,xRightGazeOriginInUserCoords,yRightGazeOriginInUserCoords,zRightGazeOriginInUserCoords,rightGazeOriginValidity,xRightGazePositionInUserCoords,yRightGazePositionInUserCoords,zRightGazePositionInUserCoords,xRightGazePositionOnDisplay,yRightGazePositionOnDisplay,rightGazePointValidity,rightPupilDiameter,rightPupilValidity'
-        ETcolumns = 'expTime,deviceTimeStamp,systemTimeStamp,xLeftGazeOriginInTrackboxCoords,yLeftGazeOriginInTrackboxCoords,zLeftGazeOriginInTrackboxCoords,xLeftGazeOriginInUserCoords,yLeftGazeOriginInUserCoords,zLeftGazeOriginInUserCoords,leftGazeOriginValidity,xLeftGazePositionInUserCoords,yLeftGazePositionInUserCoords,zLeftGazePositionInUserCoords,xLeftGazePositionOnDisplay,yLeftGazePositionOnDisplay,leftGazePointValidity,leftPupilDiameter,leftPupilValidity,xRightGazeOriginInTrackboxCoords,yRightGazeOriginInTrackboxCoords,zRightGazeOriginInTrackboxCoords,xRightGazeOriginInUserCoords,yRightGazeOriginInUserCoords,zRightGazeOriginInUserCoords,rightGazeOriginValidity,xRightGazePositionInUserCoords,yRightGazePositionInUserCoords,zRightGazePositionInUserCoords,xRightGazePositionOnDisplay,yRightGazePositionOnDisplay,rightGazePointValidity,rightPupilDiameter,rightPupilValidity'        
-        global ETdata
-        ETdata = np.empty((0,33))
-        with open(ETdataFilePath, 'ab') as csvfile:
-            np.savetxt(csvfile,ETdata,delimiter=',',header=ETcolumns)
+        # preallocated store for incoming gaze samples. etSaved counts the samples already sent to file
+        global gazeBuffer, clockSync
+        # Big enough for the validation and the longest possible trial, so nothing is overwritten before it is saved
+        etBufferTime = max(SETTINGS['et_buffer_time'], ETVALIDATION_TIME + longestTrial)
+        gazeBuffer = GazeBuffer(etBufferTime*int(expInfo['eyetracker']), decode=decode_gaze, onError=logging.warning)
+        # Fit of the tracker's clock against PsychoPy time, following drift over about 5 minutes
+        clockSync = ClockSync(forgetting=1 - 1/(300*int(expInfo['eyetracker'])),
+                              floorWindow=SETTINGS['et_sync_window']*int(expInfo['eyetracker']))
+        etSaved = 0
+        etFed = 0 # samples already fed to the dwell detector
+        etFormat = SETTINGS['et_file_format']
+        gazeSink = GazeWriter(
+            ETdataFilePath if etFormat in ['csv','both'] else None, ETcolumns,
+            chunkRows=SETTINGS['et_write_chunk'], maxLatency=SETTINGS['et_write_latency'],
+            binPath=filename + '_et.bin' if etFormat in ['binary','both'] else None,
+            onError=logging.error)
+
+        # Hands the samples recorded since the last call (at least minRows of them) to the writer thread
+        def save_gaze(minRows=1):
+            nonlocal etSaved
+            etCount = gazeBuffer.pull()
+            if etCount - etSaved >= max(minRows, 1):
+                gazeSink.put(gazeBuffer.since(etSaved, etCount))
+                etSaved = etCount
+
+        # While the trial phases run, new samples are handed over about once a second in spare frame
+        # time, so the writer streams them to file during the trial (see et_write_latency)
+        etStreamRows = int(expInfo['eyetracker'])
+        def stream_gaze():
+            save_gaze(etStreamRows)
+            return True
+        scheduler.add_idle(stream_gaze)
 
     win.flip()
     
     # Do eyetracker validation
     if expInfo['eyetracker'] != 'None':
-        continueExperiment, validationTimes = ETvalidation(win,eyetracker,int(expInfo['eyetracker']))
+        continueExperiment, validationTimes, validationMetrics = ETvalidation(win,eyetracker,int(expInfo['eyetracker']),mon)
         ETvalidationFilePath = filename + '_etValidationTimes.csv'
         with open(ETvalidationFilePath, 'w') as csvfile:
             np.savetxt(csvfile,validationTimes,delimiter=',',header='PsychoPyTime,ETtime')
+        with open(filename + '_etValidation.csv', 'w') as csvfile:
+            np.savetxt(csvfile,validationMetrics,delimiter=',',header=','.join(VALIDATION_DTYPE.names),comments='',
+                       fmt=['%d','%s','%.4f','%.4f','%.4f','%.4f','%d','%.4f','%.4f','%.4f'])
+        save_gaze()
         if not continueExperiment:
             thisExp.abort()
     
@@ -378,27 +505,145 @@ def run():
     if key == 'escape':
         close_ttl()
         win.close()
+        frameTimer.close()
+        if trialLog is not None:
+            trialLog.close()
         if expInfo['eyetracker']!='None':
             eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
+            save_gaze()
+            gazeSink.close()
         thisExp.abort()
         core.quit()
     
+    # Work done by the trial phases (see scheduler.py). They share the trial's variables with the loop below
+    def subscribe_eyetracker():
+        nonlocal etFed
+        etFed = gazeBuffer.pull()
+        dwellDetector.reset()
+        eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA,gaze_callback,as_dictionary=True)
+
+    # When audio starts to play send a TTL
+    def start_audio():
+        stream.play(when=win)
+        win.callOnFlip(send_ttl, ttl_code)
+        win.timeOnFlip(stream, 'tStartRefresh')
+
+    # One frame of the response window. Returns True when the trial is over
+    def response_frame(t, tNextFlip):
+        nonlocal tNow, response, responseTime, responseStarted, prevButtonState, etFed
+        tNow = t
+        continueTrial = True
+        
+        # Present two images/shape representing the choices when time is right
+        if tNextFlip >= tAllowResponse and not responseStarted:
+            sameBox.setAutoDraw(True)
+            sameText.setAutoDraw(True)
+            diffBox.setAutoDraw(True)
+            diffText.setAutoDraw(True)
+            responseStarted = True
+            win.timeOnFlip(sameBox, 'tStartRefresh')
+
+        # If too much time has passed then end the trial
+        if trialSound.status == FINISHED:
+            response = "NA"
+            responseTime = 0
+            continueTrial = False
+            trialSound.tStopRefresh = tNow
+            
+        # Check for pressed keys on keyboard
+        keysPressed = kb.getKeys(keyList=["escape","c","m"])
+        
+        if expInfo['responseType'] == 'saccade':
+            # check for target fixation
+            fix = SETTINGS['response_fixation_time']
+            if expInfo['eyetracker'] != 'None':
+                # feed the gaze samples that arrived since the last frame
+                etCount = gazeBuffer.pull()
+                dwellDetector.extend(gazeBuffer.since(etFed, etCount))
+                etFed = etCount
+
+                # Check if eyes are in the box indicating "same" or "different"
+                if sameBox.status == STARTED:
+                    fixatedBox = dwellDetector.current_roi()
+                    if fixatedBox is not None:
+                        responseTime = tNow - fix
+                        response = fixatedBox
+                        continueTrial = False
+                        win.callOnFlip(stop_audio)
+                        win.timeOnFlip(trialSound, 'tStopRefresh')
+        
+        # Look for mouse button press
+        if expInfo['responseType'] == 'mouse' and sameBox.status == STARTED:
+            # Keep checking for if a button is pressed
+            buttons = mouse.getPressed()
+            if buttons != prevButtonState:  # button state changed?
+                prevButtonState = buttons
+                if sum(buttons) > 0:  # state changed to a new click
+                    # check if the mouse was inside our 'clickable' objects
+                    gotValidClick = False
+                    #clickableList = environmenttools.getFromNames([sameBox, diffBox, sameText, diffText], namespace=locals
+                    clickableList = [sameBox, diffBox, sameText, diffText]
+                    for obj in clickableList:
+                        # is this object clicked on?
+                        if obj.contains(mouse):
+                            gotValidClick = True
+                            objPressed = obj.name
+                            response = objPressed[0:4]
+                            responseTime = tNow
+                    if gotValidClick:
+                        continueTrial = False
+                        win.callOnFlip(stop_audio)
+                        win.timeOnFlip(trialSound, 'tStopRefresh')
+        
+        # If keyboard if used for response
+        elif expInfo['responseType'] == 'keyboard' and sameBox.status == STARTED:
+            if keysPressed == ["c"]:
+                response = "same"
+                responseTime = tNow
+                continueTrial = False
+                win.callOnFlip(stop_audio)
+                win.timeOnFlip(trialSound, 'tStopRefresh')
+            elif keysPressed == ["m"]:
+                response = "diff"
+                responseTime = tNow
+                continueTrial = False
+                win.callOnFlip(stop_audio)
+                win.timeOnFlip(trialSound, 'tStopRefresh')
+                
+        # If <esc> pressed then exit task. If click train ends then end the trial
+        if keysPressed == ["escape"]:
+            close_ttl()
+            win.close()
+            frameTimer.close()
+            if expInfo['eyetracker']!='None':
+                eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
+                save_gaze()
+                gazeSink.close()
+            save_data()
+            report_timing()
+            logging.flush()
+            thisExp.abort()
+            core.quit()
+
+        return not continueTrial
+
 # Start trials
     for thisTrial in trials:
 
         crossFixation.setAutoDraw(True)
+        frameTimer.start_trial()
         
         # Trial variables
         response = 'NA'
-        continueTrial = True
+        responseTime = 0
         responseStarted = False
         prevButtonState = mouse.getPressed()
     
         # Load sound files (when they're wav files)
         #cuesoundFile = thisTrial['cuesound']
-        #cueSound = read_wav(op.join(stimDir, cuesoundFile), new_fs=globalFs)
+        #cueSound = stimLibrary[cuesoundFile]
         #choicesoundFile = thisTrial['choicesound']
-        #choiceSound = read_wav(op.join(stimDir, choicesoundFile), new_fs=globalFs)
+        #choiceSound = stimLibrary[choicesoundFile]
         
         # Create sounds (tones)
         #cuesound = thisTrial["cuesound"]
@@ -407,18 +652,14 @@ def run():
         #choiceSound = createToneReps(value=choicesound, tone_dur=SETTINGS['tone_dur'], blank_dur=SETTINGS['tone_blank_dur'], reps=SETTINGS['tone_reps'], sampleRate=globalFs)
         
         # Create sounds (frequencies)
+        # These were rendered before the first trial (see stimBank), one per condition and repetition.
+        # Each repetition runs every condition once, so the repetition is thisN // len(trialList)
+        # (thisRepN is not used: psychopy versions disagree on whether it counts from 0 or 1)
+        bankIdx = (trials.thisN // len(trials.trialList))*len(trials.trialList) + trials.thisIndex
         cuesound_id = str(thisTrial["cue_frequency"]) + "_" + str(thisTrial["cue_frequency_range"])
-        cueSound = generate_tone_sequence(
-            coherence=0.9, 
-            frequency=thisTrial["cue_frequency"],
-            frequency_range=thisTrial["cue_frequency_range"],
-            sampleRate=globalFs)
+        cueSound = stimBank.cue(bankIdx)
         choicesound_id = str(thisTrial["choice_frequency"]) + "_" + str(thisTrial["choice_frequency_range"])
-        choiceSound = generate_tone_sequence(
-            coherence=0.9, 
-            frequency=thisTrial["choice_frequency"],
-            frequency_range=thisTrial["choice_frequency_range"],
-            sampleRate=globalFs)
+        choiceSound = stimBank.choice(bankIdx)
         #arr = generate_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, sampleRate=44100)
         
         # Check what the correct response to this trial should be
@@ -428,16 +669,22 @@ def run():
             correctResponse = "diff"
         
         # Create audio stream. Embed choiceSound within the click train
-        audStream = np.concatenate((cueSound, choice2cue_clickStream, choiceSound, clickStream))
+        audStream, audTiming = composer.compose([
+            ('cue', cueSound),
+            ('cue2choice_clicks', choice2cue_clickStream, choice2cue_clickOnsets),
+            ('choice', choiceSound),
+            ('clicks', clickStream, clickOnsets)])
 
         # When response can start to be made
-        responseStartTime = np.concatenate((cueSound, choice2cue_clickStream, choiceSound)).shape[0]/globalFs
+        responseStartTime = audTiming['choice']['offset']
 
         # Intertrial interval wait time
         thisTrialITI = randint(SETTINGS['iti'][0]*1000, high=SETTINGS['iti'][1]*1000)/1000
 
         # Set auditory stimulus
+        tUpload = core.getTime()
         stream.setSound(audStream)
+        tUpload = core.getTime() - tUpload
 
         # keep track of which components have finished
         trialComponents = [sameBox, diffBox, sameText, diffText, stream]
@@ -449,34 +696,15 @@ def run():
             if hasattr(thisComponent, 'status'):
                 thisComponent.status = NOT_STARTED
 
-        # Start eyetracker
-        if expInfo['eyetracker']!='None':
-            WaitSecs(1)
-            thisTrialITI -= 1
-            eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA,gaze_callback)
-            
-        # Start playing auditory stimulus
-        #stream.play(when=GetSecs()+thisTrialITI)
+        # Start eyetracker one second into the ITI. The cross stays up meanwhile
         tNow = core.getTime()
-        #tStartAudio = GetSecs()+thisTrialITI
         tStartAudio = tNow+thisTrialITI
-        
-        # When audio starts to play send a TTL
-        keep_going = True
-        while keep_going:
-            tNow = core.getTime()
-            tNextFlip = win.getFutureFlipTime(clock=None)
-            
-            if stream.status == STARTED:
-                keep_going = False
+        if expInfo['eyetracker']!='None':
+            scheduler.run(Phase('iti', deadline=tNow+1, end=subscribe_eyetracker))
             
-            if tNextFlip >= tStartAudio and stream.status == NOT_STARTED:
-                stream.play(when=win)
-                win.callOnFlip(send_ttl, ttl_code)
-                win.timeOnFlip(stream, 'tStartRefresh')
-                
-            if keep_going:
-                win.flip()
+        # Start playing auditory stimulus. It and its TTL are tied to the first flip at or after tStartAudio
+        #stream.play(when=GetSecs()+thisTrialITI)
+        scheduler.run(Phase('pre_audio', deadline=tStartAudio, end=start_audio))
             
 #        while stream.status == NOT_STARTED:
 #            #win.flip()
@@ -487,138 +715,16 @@ def run():
         # When to allow responses to start to appear
         soundOnset = stream.tStartRefresh
         tAllowResponse = soundOnset + responseStartTime
-        
-        while continueTrial:
-
-            # Current time
-            tNow = core.getTime()
-            tNextFlip = win.getFutureFlipTime(clock=None)
-            
-            # Check if it's time to start audio
-            if tNextFlip >= tStartAudio and stream.status == NOT_STARTED:
-                stream.play(when=win)
-                win.callOnFlip(send_ttl, ttl_code)
-                win.timeOnFlip(stream, 'tStartRefresh')
-            
-            # Present two images/shape representing the choices when time is right
-            if tNextFlip >= tAllowResponse and not responseStarted:
-                sameBox.setAutoDraw(True)
-                sameText.setAutoDraw(True)
-                diffBox.setAutoDraw(True)
-                diffText.setAutoDraw(True)
-                responseStarted = True
-                win.timeOnFlip(sameBox, 'tStartRefresh')
-
-            # If too much time has passed then end the trial
-            if stream.status == FINISHED:
-                response = "NA"
-                responseTime = 0
-                continueTrial = False
-                stream.tStopRefresh = tNow
-                
-            # Check for pressed keys on keyboard
-            keysPressed = kb.getKeys(keyList=["escape","c","m"])
-            
-            if expInfo['responseType'] == 'saccade':
-                # check for target fixation
-                fix = SETTINGS['response_fixation_time']
-                if expInfo['eyetracker'] != 'None' and sameBox.status == STARTED:
-                    if ETdata.shape[0]>(fix*int(expInfo['eyetracker'])):
-                        # get the last gaze positions
-                        index = ETdata.shape[0]-1
-                        xleft = ETdata[(index-int(fix*int(expInfo['eyetracker']))):index,13]
-                        yleft = ETdata[index-int(fix*int(expInfo['eyetracker'])):index,14]
-                        xright = ETdata[index-int(fix*int(expInfo['eyetracker'])):index,28]
-                        yright = ETdata[index-int(fix*int(expInfo['eyetracker'])):index,29]
-
-                        # Check if eyes are in the box indicating "same"
-                        isInSameBox = np.nanmean(xleft)>=sameBoxLims[0]\
-                        and np.nanmean(xleft)<=sameBoxLims[1]\
-                        and np.nanmean(xright)>=sameBoxLims[0]\
-                        and np.nanmean(xright)<=sameBoxLims[1]\
-                        and np.nanmean(yleft)>=sameBoxLims[2]\
-                        and np.nanmean(yleft)<=sameBoxLims[3]\
-                        and np.nanmean(yright)>=sameBoxLims[2]\
-                        and np.nanmean(yright)<=sameBoxLims[3]
-                        
-                        # Check if eyes are in the box indicating "different"
-                        isInDiffBox = np.nanmean(xleft)>=diffBoxLims[0]\
-                        and np.nanmean(xleft)<=diffBoxLims[1]\
-                        and np.nanmean(xright)>=diffBoxLims[0]\
-                        and np.nanmean(xright)<=diffBoxLims[1]\
-                        and np.nanmean(yleft)>=diffBoxLims[2]\
-                        and np.nanmean(yleft)<=diffBoxLims[3]\
-                        and np.nanmean(yright)>=diffBoxLims[2]\
-                        and np.nanmean(yright)<=diffBoxLims[3]
-                        
-                        if isInSameBox:
-                            responseTime = tNow - fix
-                            response = 'same'
-                            continueTrial = False
-                            win.callOnFlip(stream.stop)
-                            win.timeOnFlip(stream, 'tStopRefresh')
-                        elif isInDiffBox:
-                            responseTime = tNow - fix
-                            response = 'diff'
-                            continueTrial = False
-                            win.callOnFlip(stream.stop)
-                            win.timeOnFlip(stream, 'tStopRefresh')
-            
-            # Look for mouse button press
-            if expInfo['responseType'] == 'mouse' and sameBox.status == STARTED:
-                # Keep checking for if a button is pressed
-                buttons = mouse.getPressed()
-                if buttons != prevButtonState:  # button state changed?
-                    prevButtonState = buttons
-                    if sum(buttons) > 0:  # state changed to a new click
-                        # check if the mouse was inside our 'clickable' objects
-                        gotValidClick = False
-                        #clickableList = environmenttools.getFromNames([sameBox, diffBox, sameText, diffText], namespace=locals
-                        clickableList = [sameBox, diffBox, sameText, diffText]
-                        for obj in clickableList:
-                            # is this object clicked on?
-                            if obj.contains(mouse):
-                                gotValidClick = True
-                                objPressed = obj.name
-                                response = objPressed[0:4]
-                                responseTime = tNow
-                        if gotValidClick:
-                            continueTrial = False
-                            win.callOnFlip(stream.stop)
-                            win.timeOnFlip(stream, 'tStopRefresh')
-            
-            # If keyboard if used for response
-            elif expInfo['responseType'] == 'keyboard' and sameBox.status == STARTED:
-                if keysPressed == ["c"]:
-                    response = "same"
-                    responseTime = tNow
-                    continueTrial = False
-                    win.callOnFlip(stream.stop)
-                    win.timeOnFlip(stream, 'tStopRefresh')
-                elif keysPressed == ["m"]:
-                    response = "diff"
-                    responseTime = tNow
-                    continueTrial = False
-                    win.callOnFlip(stream.stop)
-                    win.timeOnFlip(stream, 'tStopRefresh')
-                    
-            # If <esc> pressed then exit task. If click train ends then end the trial
-            if keysPressed == ["escape"]:
-                close_ttl()
-                win.close()
-                thisExp.saveAsWideText(filename+'.csv', delim='auto')
-                thisExp.saveAsPickle(filename)
-                logging.flush()
-                if expInfo['eyetracker']!='None':
-                    with open(ETdataFilePath, 'ab') as csvfile:
-                        np.savetxt(csvfile,ETdata,delimiter=',')
-                    eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
-                thisExp.abort()
-                core.quit()
-                        
-            if continueTrial:
-                win.flip()
 
+        # The looped click train picks up where the rendered one would have started
+        if clickLoop is not None:
+            clickLoop.play(when=tAllowResponse + ptb_offset())
+        # The sound that ends the trial. audio_offset is when it stopped
+        trialSound = stream if clickLoop is None else clickLoop
+        trialSound.tStopRefresh = None
+        
+        # Until a response is made or the click train ends
+        scheduler.run(Phase('response', frame=response_frame))
 
         #stream.stop()
         
@@ -638,23 +744,13 @@ def run():
         sameText.setAutoDraw(False)
         diffBox.setAutoDraw(False)
         diffText.setAutoDraw(False)
-        tEnd = tNow + 3
-        continueFeedback = True
         win.timeOnFlip(txtObj, 'tStartRefresh')
-        while continueFeedback:
-            tNow = core.getTime()
-            if tEnd <= tNow:
-                continueFeedback = False
-            else:
-                win.flip()
-            
+        scheduler.run(Phase('feedback', deadline=tNow + 3))
+
         # unsubscribe from eyetracker
         if expInfo['eyetracker']!='None':
             eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
-            with open(ETdataFilePath, 'ab') as csvfile:
-                np.savetxt(csvfile,ETdata,delimiter=',')
-            # re-initiate data frame for eyetracker data
-            ETdata = np.empty((0,33))
+            save_gaze()
         
         # Stop showing feedbadk and bring back the cross
         txtObj.setAutoDraw(False)
@@ -662,25 +758,45 @@ def run():
 
         # Append trial info
         thisExp.addData('audio_onset', stream.tStartRefresh)
-        thisExp.addData('audio_offset', stream.tStopRefresh)
+        thisExp.addData('audio_offset', trialSound.tStopRefresh)
+        thisExp.addData('choice_onset', soundOnset + audTiming['choice']['onset'])
+        thisExp.addData('response_allowed', tAllowResponse)
         thisExp.addData('display_feedback', txtObj.tStartRefresh)
         thisExp.addData('response_time', responseTime)
         thisExp.addData('response', response)
+        thisExp.addData('correctResponse', correctResponse)
+        thisExp.addData('stim_seed', stimBank.trialSeeds[bankIdx])
+        deviceStart, deviceLatency = ptb_start_time(stream, ptb_offset())
+        audioLatency = audioAudit.record(tStartAudio, stream.tStartRefresh, deviceStart, tUpload, deviceLatency)
+        for column, value in audioLatency.items():
+            thisExp.addData(column, value)
+        frameTimer.end_trial(thisExp)
+        scheduler.end_trial(thisExp)
         thisExp.nextEntry()
+        if trialLog is not None:
+            if trialLog.columns is None:
+                trialLog.set_columns(wide_text_columns(thisExp))
+            trialLog.write(thisExp.entries[-1])
     
-    # Task over. Close everything
+    # Task over. Close everything. The gaze data is saved first so a failed save_data() cannot lose it
     close_ttl()
     win.close()
-    thisExp.saveAsWideText(filename+'.csv', delim='auto')
-    thisExp.saveAsPickle(filename)
-    logging.flush()
+    frameTimer.close()
     if expInfo['eyetracker']!='None':
-        with open(ETdataFilePath, 'ab') as csvfile:
-            np.savetxt(csvfile,ETdata,delimiter=',')
         eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA)
+        save_gaze()
+        gazeSink.close()
+    save_data()
+    report_timing()
+    logging.flush()
     thisExp.abort()
     core.quit()
 
 if __name__ == '__main__':
-    run()
+    if SETTINGS['simulation']:
+        # Headless run with stand-ins for the window, audio, TTL and eyetracker (see simulation.py)
+        from simulation import run_simulation
+        print(run_simulation(module=sys.modules[__name__], **SETTINGS['simulation']).report())
+    else:
+        run()
     
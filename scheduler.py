@@ -0,0 +1,169 @@
+"""
+Frame loop running the phases of a trial
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+class Phase:
+    """One part of a trial (e.g. the ITI, waiting for the audio, the response window or the feedback)
+
+    Every frame the scheduler calls frame(tNow, tNextFlip), if the phase has
+    one. The phase ends without another flip when frame returns True, or with
+    the first flip at or after the deadline. end() is called just before that
+    flip, so it can tie something to it (e.g. start a sound and send a TTL).
+
+    Args:
+        name: Name of the phase in the frame timer and the data, e.g. 'response'
+        deadline: Time (s, core clock) the phase ends at. None to only end when frame returns True
+        frame: Optional function(tNow, tNextFlip) doing the phase's work for one frame.
+            Returns True to end the phase
+        end: Optional function called before the flip at the deadline
+    """
+
+    def __init__(self, name, deadline=None, frame=None, end=None):
+        self.name = name
+        self.deadline = deadline
+        self.frame = frame
+        self.end = end
+
+
+class PhaseScheduler:
+    """Runs trial phases in one frame loop and records when they end and what they cost
+
+    Each frame does only the work of the current phase, then spends the time
+    left before the next flip on the idle tasks (see add_idle), then flips.
+    For every phase of a trial it records the time of its first flip, how late
+    its last flip was against the deadline, the CPU time it used and the spare
+    time there was before its flips. end_trial adds these to the data and
+    report() summarises them over the session.
+
+    Args:
+        win: The window to flip
+        clock: Function returning the current time in seconds (core.getTime)
+        frameTimer: Optional timing.FrameTimer to flip through, so flips are recorded per phase
+        idleMargin: Idle tasks are only started while more than this many seconds are left before the flip
+    """
+
+    def __init__(self, win, clock, frameTimer=None, idleMargin=0.004):
+        self.win = win
+        self.clock = clock
+        self.frameTimer = frameTimer
+        self.idleMargin = idleMargin
+        self.framePeriod = getattr(win, 'monitorFramePeriod', None) or 1 / 60
+        self.trials = [] # per trial, dict of phase name -> record
+        self.phaseNames = []
+        self._idle = deque()
+        self._trial = {}
+
+    def add_idle(self, task):
+        """Run task() in spare time before flips until it returns False
+
+        The task should do a small piece of work per call (well under a
+        frame) and return True while it has more to do. Each task is called
+        at most once per frame. A task that always returns True runs for the
+        rest of the session, once per frame with spare time, e.g. main.py's
+        stream_gaze, which hands new gaze samples to the writer thread.
+        """
+        self._idle.append(task)
+
+    def idle_pending(self):
+        """Number of idle tasks that have not finished"""
+        return len(self._idle)
+
+    def _run_idle(self, tNextFlip):
+        for ii in range(len(self._idle)):
+            if tNextFlip - self.clock() <= self.idleMargin:
+                break
+            task = self._idle.popleft()
+            if task():
+                self._idle.append(task)
+        return max(tNextFlip - self.clock(), 0.)
+
+    def run(self, phase):
+        """Run a phase until it ends
+
+        Returns: Time of the phase's last flip, or None if it ended before flipping
+        """
+        win, clock = self.win, self.clock
+        flip = win.flip if self.frameTimer is None else lambda: self.frameTimer.flip(win, phase.name)
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        onset = lastFlip = None
+        frames = 0
+        spare = 0.
+        while True:
+            tNow = clock()
+            tNextFlip = win.getFutureFlipTime(clock=None)
+            if phase.frame is not None and phase.frame(tNow, tNextFlip):
+                break
+            due = phase.deadline is not None and tNextFlip >= phase.deadline
+            if due and phase.end is not None:
+                phase.end()
+            spare += self._run_idle(tNextFlip)
+            lastFlip = flip()
+            frames += 1
+            if onset is None:
+                onset = lastFlip
+            if due:
+                break
+        if phase.name not in self.phaseNames:
+            self.phaseNames.append(phase.name)
+        self._trial[phase.name] = {
+            'onset': np.nan if onset is None else onset,
+            'late': np.nan if phase.deadline is None or lastFlip is None else lastFlip - phase.deadline,
+            'frames': frames,
+            'cpu': time.process_time() - cpu0,
+            'wall': time.perf_counter() - wall0,
+            'spare': spare}
+        return lastFlip
+
+    def end_trial(self, thisExp=None):
+        """Add each phase's onset (s), lateness, CPU time and spare time (ms) to thisExp and start a new trial"""
+        if thisExp is not None:
+            for name, record in self._trial.items():
+                thisExp.addData(name + '_onset', record['onset'])
+                thisExp.addData(name + '_late', record['late'] * 1e3)
+                thisExp.addData(name + '_cpu', record['cpu'] * 1e3)
+                thisExp.addData(name + '_spare', record['spare'] * 1e3)
+        self.trials.append(self._trial)
+        self._trial = {}
+
+    def summary(self):
+        """Per phase, over all trials
+
+        Returns: Dict of phase name -> dict with
+            trials: Trials the phase ran in
+            late_mean, late_max: Lateness of the last flip against the deadline (ms)
+            cpu_load: CPU time / wall time while the phase ran
+            cpu_per_frame: CPU time per frame (ms)
+            spare: Fraction of frame time that was left before the flips
+        """
+        summary = {}
+        for name in self.phaseNames:
+            records = [trial[name] for trial in self.trials if name in trial]
+            late = np.array([r['late'] for r in records]) * 1e3
+            late = late[~np.isnan(late)]
+            cpu = sum(r['cpu'] for r in records)
+            wall = sum(r['wall'] for r in records)
+            frames = sum(r['frames'] for r in records)
+            summary[name] = {
+                'trials': len(records),
+                'late_mean': late.mean() if late.size else np.nan,
+                'late_max': late.max() if late.size else np.nan,
+                'cpu_load': cpu / wall if wall else np.nan,
+                'cpu_per_frame': cpu / frames * 1e3 if frames else np.nan,
+                'spare': sum(r['spare'] for r in records) / (frames * self.framePeriod) if frames else np.nan}
+        return summary
+
+    def report(self):
+        """The summary as printable text"""
+        lines = ['Trial phases over %d trials' % len(self.trials),
+                 '%-10s %6s %10s %10s %8s %12s %7s' % ('', 'trials', 'late mean', 'late max', 'CPU', 'CPU/frame', 'spare'),
+                 '%-10s %6s %10s %10s %8s %12s %7s' % ('', '', '(ms)', '(ms)', '', '(ms)', '')]
+        for name, s in self.summary().items():
+            lines.append('%-10s %6d %10.3f %10.3f %7.1f%% %12.3f %6.1f%%' % (name, s['trials'], s['late_mean'],
+                         s['late_max'], 100 * s['cpu_load'], s['cpu_per_frame'], 100 * s['spare']))
+        return '\n'.join(lines)
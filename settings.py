@@ -9,5 +9,24 @@ SETTINGS = {
     "tone_dur": 0.05,
     "tone_reps": 15,
     "tone_blank_dur": 0.05,
-    "response_fixation_time": 0.5
+    "response_fixation_time": 0.5,
+    "et_buffer_time": 120, # Seconds of gaze samples held in memory between writes to file. Raised to the longest trial (plus validation) if that is longer
+    "et_write_chunk": 12000, # Number of gaze samples written to file at once
+    "et_write_latency": 5, # Longest time (in seconds) a gaze sample waits before being written
+    "et_sync_window": 2, # Seconds of gaze samples the fastest callback is taken from when correcting sample times (see eyetracking.ClockSync)
+    "et_file_format": "csv", # Eyetracker output. 'csv' (_et.csv), 'binary' (_et.bin, see gazeio.py) or 'both'
+    "stim_workers": 0, # Worker processes used to render the session's sounds before the first trial (0 = none)
+    "click_playback": "loop", # Response window clicks. 'loop' (one SOA repeated by the audio backend) or 'rendered'
+    "wav_cache_dir": "wavcache", # Folder (relative to main.py) for resampled wav files. None to only cache in memory
+    "wav_cache_mb": 512, # Memory budget (in MB) of the in-memory wav cache
+    "wav_resample": "auto", # Resampling of wav stimuli. 'poly' (polyphase), 'fft' or 'auto' (poly when the rates have a rational ratio)
+    "stim_load_workers": 4, # Threads used to load the wav stimuli before the first trial (0 = one file at a time)
+    "stim_scan_dir": False, # Also load every sound file in stimuli/, not only those named in the conditions file
+    "frame_timing": False, # Record every flip of the trial loop. Dropped frames per trial are saved with the data, all frames in _frames.csv
+    "simulation": None, # Run headless on a virtual clock instead, e.g. {"response_type": "saccade", "eyetracker": "600"}. See simulation.py
+    "ttl_pulse_width": 0.001, # Seconds a parallel port code is held before being reset to 0. send_ttl spins for this long in the flip callback
+    "ttl_log": True, # Write the time every TTL code was requested and written to _ttl.csv
+    "trial_log": True, # Append every trial to _trials.csv as soon as it ends. The wide .csv is then copied from it at the end
+    "trial_log_fsync": 10, # Trials between forcing _trials.csv to disk (it is also forced at least every 30 s)
+    "save_pickle": True # Also pickle the whole ExperimentHandler (.psydat) at the end. Slow for long sessions
 }
\ No newline at end of file
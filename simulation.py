@@ -0,0 +1,560 @@
+"""
+Headless simulation of a session
+
+Runs main.run() on a virtual clock with stand-ins for the window, audio,
+TTL port, keyboard, mouse and tobii eyetracker, so a whole session can be
+profiled or regression-tested without a display, PTB audio, a parallel port
+or an eyetracker. Time only moves when the task flips the window or waits,
+so sessions run much faster than real time. psychopy itself is still needed
+for the data handlers.
+
+A simulated participant answers each trial after a random response time,
+with the keyboard, the mouse or by looking at a box (synthetic gaze at the
+eyetracker's rate, aimed at whatever is on screen).
+
+Usage: python simulation.py [responseType] [eyetracker] [refreshRate]
+    or set SETTINGS['simulation'] and run main.py
+"""
+
+import json
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+from eyetracking import GAZE_FIELDS
+
+# Values of psychopy.constants
+NOT_STARTED, STARTED, FINISHED = 0, 1, -1
+
+EYETRACKER_GAZE_DATA = 'eyetracker_gaze_data'
+
+# Answer key for each response type
+RESPONSE_KEYS = {'same': 'c', 'diff': 'm'}
+
+
+class VirtualClock:
+    """The session's time (s). Moving it forward delivers the gaze samples that became due"""
+
+    def __init__(self, start=1.0):
+        self.now = start
+        self.eyetrackers = []
+
+    def getTime(self):
+        return self.now
+
+    def advance_to(self, t):
+        for tracker in self.eyetrackers:
+            tracker.pump(t)
+        self.now = max(self.now, t)
+
+    def wait(self, secs, hogCPUperiod=0):
+        self.advance_to(self.now + secs)
+
+
+class SimWindow:
+    """Stand-in for visual.Window. flip() moves the clock to the next refresh"""
+
+    def __init__(self, session, size=(800, 800), refreshRate=60):
+        self.session = session
+        self.size = np.array(size)
+        self.monitorFramePeriod = 1 / refreshRate
+        self.lastFlip = session.clock.now
+        self.nFlips = 0
+        self._toCall = []
+        self._toTime = []
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        period = self.monitorFramePeriod
+        nextFlip = self.lastFlip + period
+        if self.session.clock.now > nextFlip:
+            nextFlip = self.lastFlip + np.ceil((self.session.clock.now - self.lastFlip) / period) * period
+        return nextFlip + targetTime
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._toCall.append((function, args, kwargs))
+
+    def timeOnFlip(self, obj, attrib):
+        self._toTime.append((obj, attrib))
+
+    def flip(self, clearBuffer=True):
+        t = self.getFutureFlipTime()
+        self.session.clock.advance_to(t)
+        self.lastFlip = t
+        self.nFlips += 1
+        for function, args, kwargs in self._toCall:
+            function(*args, **kwargs)
+        for obj, attrib in self._toTime:
+            setattr(obj, attrib, t)
+        self._toCall = []
+        self._toTime = []
+        return t
+
+    def close(self):
+        pass
+
+
+class SimMonitor:
+    """Stand-in for monitors.Monitor with the geometry setScreen gives it"""
+
+    def __init__(self, width, distance, sizePix):
+        self.width = width
+        self.distance = distance
+        self.sizePix = list(sizePix)
+
+    def getWidth(self):
+        return self.width
+
+    def getDistance(self):
+        return self.distance
+
+    def getSizePix(self):
+        return self.sizePix
+
+
+class SimStim:
+    """Stand-in for every psychopy visual stimulus the task draws"""
+
+    def __init__(self, session, win=None, name='', pos=(0, 0), units=None, **kwargs):
+        self.session = session
+        self.win = win
+        self.name = name
+        self.pos = np.array(pos, dtype=float)
+        self.units = units
+        self.size = kwargs.get('size')
+        self.width = kwargs.get('width')
+        self.height = kwargs.get('height')
+        self.text = kwargs.get('text')
+        self.autoDraw = False
+        self.status = NOT_STARTED
+
+    def setAutoDraw(self, value, log=None):
+        self.autoDraw = value
+        self.status = STARTED if value else FINISHED
+        self.session.participant.on_autodraw(self, value)
+
+    def draw(self, win=None):
+        pass
+
+    def setPos(self, pos, log=None):
+        self.pos = np.array(pos, dtype=float)
+
+    def setSize(self, size, log=None):
+        self.size = size
+
+    def setText(self, text, log=None):
+        self.text = text
+
+    def contains(self, mouse):
+        return self.session.participant.clicked(self)
+
+
+class SimTrack:
+    """What PsychPortAudio reports for a sound. StartTime is on the PTB clock"""
+
+    def __init__(self):
+        self.status = {'StartTime': 0, 'PredictedLatency': 0.005}
+
+
+class SimSound:
+    """Stand-in for sound.Sound. Plays for its duration from when it is scheduled
+
+    As with the PTB backend, a time given to play(when=...) is on the PTB
+    (GetSecs) clock. The session times (core.getTime) the sound started at are kept in `starts`.
+    """
+
+    def __init__(self, session, value=None, name='', sampleRate=48000, stereo=True, loops=0, secs=None, **kwargs):
+        self.session = session
+        self.name = name
+        self.starts = []
+        session.sounds[name] = self
+        self.sampleRate = sampleRate
+        self.loops = loops
+        self.nSamples = 0
+        self.track = SimTrack()
+        self._status = NOT_STARTED
+        self._stop = None
+        if value is not None:
+            self.setSound(value)
+
+    def setSound(self, value, secs=None, hamming=True, log=True):
+        if self.name == 'trial_audio':
+            self.session.start_trial()
+        value = np.asarray(value)
+        self.nSamples = value.shape[0] if value.ndim else int((secs or 0.5) * self.sampleRate)
+
+    def play(self, when=None, loops=None, log=True):
+        clock = self.session.clock
+        if isinstance(when, SimWindow):
+            start = when.getFutureFlipTime()
+        elif when is not None:
+            start = max(when - self.session.ptbOffset, clock.now)
+        else:
+            start = clock.now
+        loops = self.loops if loops is None else loops
+        self._stop = start + self.nSamples / self.sampleRate * (loops + 1)
+        self._status = STARTED
+        self.starts.append(start)
+        self.track.status['StartTime'] = start + self.session.ptbOffset + self.session.audio_offset()
+
+    def stop(self, log=True):
+        self._status = FINISHED
+        self._stop = None
+
+    @property
+    def status(self):
+        if self._status == STARTED and self._stop is not None and self.session.clock.now >= self._stop:
+            self._status = FINISHED
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+        self._stop = None
+
+
+class SimKeyboard:
+    """Stand-in for psychopy.hardware.keyboard.Keyboard"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def getKeys(self, keyList=None, waitRelease=False, clear=True):
+        return self.session.participant.keys(keyList)
+
+    def clearEvents(self):
+        pass
+
+
+class SimMouse:
+    """Stand-in for event.Mouse. A button is held once the participant answers with a click"""
+
+    def __init__(self, session, win=None, visible=True):
+        self.session = session
+        self.status = NOT_STARTED
+
+    def getPressed(self, getTime=False):
+        return self.session.participant.buttons()
+
+    def setVisible(self, visible):
+        pass
+
+    def getPos(self):
+        return np.zeros(2)
+
+
+class SimEyeTracker:
+    """Stand-in for a tobii_research EyeTracker producing synthetic gaze samples
+
+    While subscribed, samples are delivered to the callback as dictionaries
+    (as with as_dictionary=True) at the output frequency. Each sample points at
+    the participant's current gaze target in display-area coordinates, with
+    Gaussian noise.
+    """
+
+    def __init__(self, session, frequency=600, noise=0.01):
+        self.session = session
+        self.frequency = float(frequency)
+        self.noise = noise
+        self.callback = None
+        self.nextSample = None
+        self.nSamples = 0
+        self._template = {}
+        for width, _, key in GAZE_FIELDS:
+            self._template[key] = 1 if key.endswith('validity') else (0.5 if width == 1 else (0.5,) * width)
+        self._template['left_pupil_diameter'] = self._template['right_pupil_diameter'] = 3.5
+
+    def set_gaze_output_frequency(self, frequency):
+        self.frequency = float(frequency)
+
+    def get_gaze_output_frequency(self):
+        return self.frequency
+
+    def subscribe_to(self, stream, callback, as_dictionary=False):
+        self.callback = callback
+        self.nextSample = self.session.clock.now
+
+    def unsubscribe_from(self, stream, callback=None):
+        self.callback = None
+
+    def pump(self, t):
+        """Deliver every sample due up to time t"""
+        if self.callback is None:
+            return
+        clock = self.session.clock
+        rng = self.session.rng
+        period = 1 / self.frequency
+        while self.nextSample <= t:
+            clock.now = max(clock.now, self.nextSample)
+            x, y = self.session.participant.gaze_target()
+            sample = dict(self._template)
+            sample['device_time_stamp'] = int(self.nextSample * 1e6)
+            sample['system_time_stamp'] = int(self.nextSample * 1e6)
+            for eye in ['left', 'right']:
+                dx, dy = rng.normal(0, self.noise, 2)
+                sample[eye + '_gaze_point_on_display_area'] = (x + dx, y + dy)
+            self.callback(sample)
+            self.nSamples += 1
+            self.nextSample += period
+
+
+class SimParticipant:
+    """Answers each trial 'same' or 'diff' after a random response time
+
+    The response window opens when the 'sameBox' stimulus is drawn. Then the
+    participant picks an answer (or lets the trial time out with probability
+    pMiss) and responds after rt seconds with the keyboard, a mouse click or a
+    look at the box, depending on responseType. Instruction and validation
+    screens are accepted with the space bar.
+
+    Args:
+        session: The SimSession
+        responseType: 'keyboard', 'mouse' or 'saccade'
+        rt: (min, max) response time in seconds
+        pMiss: Probability of not responding in a trial
+    """
+
+    def __init__(self, session, responseType='keyboard', rt=(0.4, 1.5), pMiss=0.0):
+        self.session = session
+        self.responseType = responseType
+        self.rt = rt
+        self.pMiss = pMiss
+        self.answer = None
+        self.answerTime = np.inf
+        self.visible = {}
+        self._keysGiven = False
+
+    def on_autodraw(self, stim, value):
+        if value:
+            self.visible[stim.name] = stim
+        else:
+            self.visible.pop(stim.name, None)
+        if stim.name == 'sameBox':
+            if value and self.session.rng.random() >= self.pMiss:
+                self.answer = 'same' if self.session.rng.random() < 0.5 else 'diff'
+                self.answerTime = self.session.clock.now + self.session.rng.uniform(*self.rt)
+            elif not value:
+                self.answer = None
+                self.answerTime = np.inf
+            self._keysGiven = False
+
+    def responding(self, responseType):
+        return self.responseType == responseType and self.session.clock.now >= self.answerTime
+
+    def keys(self, keyList=None):
+        """Keys pressed since the last call"""
+        if self.responding('keyboard') and not self._keysGiven:
+            self._keysGiven = True
+            return [RESPONSE_KEYS[self.answer]]
+        if keyList is not None and 'space' in keyList:
+            return ['space']
+        return []
+
+    def buttons(self):
+        return [1, 0, 0] if self.responding('mouse') else [0, 0, 0]
+
+    def clicked(self, stim):
+        return self.responding('mouse') and stim.name.startswith(self.answer)
+
+    def gaze_target(self):
+        """Where the participant is looking, in tobii display-area coordinates"""
+        win = self.session.win
+        if self.responding('saccade'):
+            box = self.visible.get(self.answer + 'Box')
+            if box is not None:
+                return box.pos[0] / 2 + 0.5, -box.pos[1] / 2 + 0.5
+        point = self.visible.get('point')
+        if point is not None and win is not None:
+            return point.pos[0] / win.size[0] + 0.5, -point.pos[1] / win.size[1] + 0.5
+        return 0.5, 0.5
+
+
+class SimSession:
+    """Virtual clock, stand-in devices and the per-trial record of a simulated session
+
+    Args:
+        responseType: 'keyboard', 'mouse' or 'saccade'
+        eyetracker: 'None' or the sampling rate ('300', '600' or '1200')
+        refreshRate: Refresh rate of the simulated monitor (Hz)
+        monitor: File in monitors/ to take the screen and audio settings from
+        outputDir: Where the data files go. A temporary folder by default
+        audioJitter: SD (s) of the simulated audio device start relative to the flip
+        ptbOffset: Time (s) of the PTB clock (GetSecs) when the session clock (core.getTime) is 0.
+            PTB counts from boot and PsychoPy from when it was loaded, so they differ
+        seed: Seed of the participant, gaze noise and audio jitter
+        participant: Keyword arguments for SimParticipant
+    """
+
+    def __init__(self, responseType='keyboard', eyetracker='None', refreshRate=60,
+                 monitor='debugging_monitor.json', outputDir=None, audioJitter=0.0002, ptbOffset=86400.0, seed=0,
+                 participant=None):
+        self.rng = np.random.default_rng(seed)
+        self.clock = VirtualClock()
+        self.refreshRate = refreshRate
+        self.eyetracker = eyetracker
+        self.monitor = monitor
+        self.outputDir = outputDir or tempfile.mkdtemp(prefix='tamy_sim_')
+        self.audioJitter = audioJitter
+        self.ptbOffset = ptbOffset
+        self.participant = SimParticipant(self, responseType, **(participant or {}))
+        self.win = None
+        self.tracker = None
+        self.sounds = {} # name -> SimSound
+        self.ttlLog = [] # (time, code)
+        self.trials = [] # one dict per trial, see end_trial
+        self._trialStart = None
+        self._saved = {}
+
+    def audio_offset(self):
+        return self.rng.normal(0, self.audioJitter) if self.audioJitter else 0.
+
+    def exp_info(self):
+        """What openingDlg would return for this session"""
+        _thisDir = op.dirname(op.abspath(__file__))
+        with open(op.join(_thisDir, 'monitors', self.monitor)) as f:
+            expInfo = json.load(f)
+        expInfo.update(runid='sim', ttl='None', monitor=self.monitor.split('.json')[0],
+                       responseType=self.participant.responseType, eyetracker=self.eyetracker,
+                       ttl_port='NaN', outputDir=op.join(self.outputDir, 'sim'), date='simulated',
+                       psychopy_version='simulated')
+        expInfo.setdefault('ttl_code', 255)
+        os.makedirs(expInfo['outputDir'], exist_ok=True)
+        return expInfo
+
+    def set_screen(self, screen_res, scrWidth, fullScr, monName, dist=60, color='black'):
+        self.win = SimWindow(self, size=screen_res, refreshRate=self.refreshRate)
+        return self.win, SimMonitor(scrWidth, dist, screen_res)
+
+    def set_ttl(self, trigger, address, pulseWidth=None, logFile=None):
+        def send_ttl(code):
+            self.ttlLog.append((self.clock.now, code))
+
+        def close_ttl():
+            None
+
+        return send_ttl, close_ttl
+
+    def pause_and_read_text(self, win, TxtToWrite, mouse=None, txtColor=[0, 0, 0], keys=['escape'], wait=2):
+        self.clock.wait(wait)
+        win.flip()
+        return 'space'
+
+    def find_all_eyetrackers(self):
+        if self.tracker is None:
+            self.tracker = SimEyeTracker(self, frequency=float(self.eyetracker))
+            self.clock.eyetrackers.append(self.tracker)
+        return [self.tracker]
+
+    def _now(self):
+        return self.clock.now, time.perf_counter(), time.process_time(), self.win.nFlips if self.win else 0
+
+    def start_trial(self):
+        """Called when a trial's audio is uploaded"""
+        self._trialStart = self._now()
+
+    def end_trial(self):
+        """Called when the ExperimentHandler moves to the next entry"""
+        if self._trialStart is not None:
+            now, start = self._now(), self._trialStart
+            self.trials.append({'virtual': now[0] - start[0], 'wall': now[1] - start[1],
+                                'cpu': now[2] - start[2], 'flips': now[3] - start[3]})
+        self._trialStart = None
+
+    def patch(self, module):
+        """Replace the devices and dialogs main.py uses with the simulated ones"""
+        ns = types.SimpleNamespace
+        session = self
+        base = module.ExperimentHandler
+        if base is None:
+            # main.py imports it after the opening dialog (see main.load_task_modules)
+            from psychopy.data import ExperimentHandler as base
+
+        class SimExperimentHandler(base):
+            def nextEntry(self):
+                session.end_trial()
+                base.nextEntry(self)
+
+        stim = lambda *args, **kwargs: SimStim(self, *args, **kwargs)
+        replacements = {
+            'core': ns(getTime=self.clock.getTime, wait=self.clock.wait, quit=self.quit),
+            'GetSecs': lambda: self.clock.now + self.ptbOffset,
+            'visual': ns(TextStim=stim, ShapeStim=stim, Rect=stim, Circle=stim, ElementArrayStim=stim),
+            'sound': ns(Sound=lambda *args, **kwargs: SimSound(self, *args, **kwargs)),
+            'keyboard': ns(Keyboard=lambda *args, **kwargs: SimKeyboard(self)),
+            'event': ns(Mouse=lambda *args, **kwargs: SimMouse(self, *args, **kwargs),
+                        getKeys=lambda keyList=None, **kwargs: self.participant.keys(keyList)),
+            'tobii': ns(find_all_eyetrackers=self.find_all_eyetrackers, EYETRACKER_GAZE_DATA=EYETRACKER_GAZE_DATA),
+            'openingDlg': self.exp_info,
+            'setScreen': self.set_screen,
+            'set_ttl': self.set_ttl,
+            'pauseAndReadText': self.pause_and_read_text,
+            'run_tracker_manager': lambda mode: None,
+            'ExperimentHandler': SimExperimentHandler,
+        }
+        for name, value in replacements.items():
+            self._saved[name] = getattr(module, name)
+            setattr(module, name, value)
+        self._module = module
+        self._wallStart = time.perf_counter()
+        self._cpuStart = time.process_time()
+
+    def restore(self):
+        """Undo patch()"""
+        for name, value in self._saved.items():
+            setattr(self._module, name, value)
+        self._saved = {}
+        self.wall = time.perf_counter() - self._wallStart
+        self.cpu = time.process_time() - self._cpuStart
+
+    def quit(self):
+        raise SystemExit(0)
+
+    def report(self):
+        """Session duration, speed-up over real time and per-trial CPU cost, as printable text"""
+        virtual = self.clock.now - 1.0
+        lines = ['Simulated %.1f s of session in %.2f s (x%.0f real time), %d trials, %d flips, %d TTLs'
+                 % (virtual, self.wall, virtual / max(self.wall, 1e-9), len(self.trials),
+                    self.win.nFlips if self.win else 0, len(self.ttlLog))]
+        if self.tracker is not None:
+            lines.append('%d gaze samples at %g Hz' % (self.tracker.nSamples, self.tracker.frequency))
+        if self.trials:
+            cpu = np.array([t['cpu'] for t in self.trials]) * 1e3
+            perFlip = cpu / np.maximum([t['flips'] for t in self.trials], 1)
+            lines.append('CPU per trial (ms): mean %.1f, max %.1f. Per flip: mean %.3f, max %.3f'
+                         % (cpu.mean(), cpu.max(), perFlip.mean(), perFlip.max()))
+        lines.append('Data in %s' % self.outputDir)
+        return '\n'.join(lines)
+
+
+def run_simulation(module=None, response_type='keyboard', eyetracker='None', refresh_rate=60, **kwargs):
+    """Run main.run() headless and return the SimSession
+
+    Args:
+        module: The main module to run. Imported if None
+        response_type: 'keyboard', 'mouse' or 'saccade'
+        eyetracker: 'None', '300', '600' or '1200'
+        refresh_rate: Refresh rate of the simulated monitor (Hz)
+        kwargs: Passed to SimSession
+    """
+    if module is None:
+        import main as module
+    session = SimSession(response_type, eyetracker, refresh_rate, **kwargs)
+    session.patch(module)
+    try:
+        module.run()
+    except SystemExit:
+        pass
+    finally:
+        session.restore()
+    return session
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    print(run_simulation(response_type=args[0] if args else 'keyboard',
+                         eyetracker=args[1] if len(args) > 1 else 'None',
+                         refresh_rate=float(args[2]) if len(args) > 2 else 60).report())
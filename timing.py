@@ -0,0 +1,243 @@
+"""
+Frame and audio timing of the trial loop
+"""
+
+import numpy as np
+
+# Parts of a trial the frames are tagged with
+PHASES = ('iti', 'pre_audio', 'response', 'feedback')
+
+# Frames flipped under a phase name FrameTimer was not given are tagged with this
+OTHER_PHASE = 'other'
+
+
+class FrameTimer:
+    """Records the time of every flip in a trial and counts dropped frames
+
+    Flip times are stored in a preallocated array, so recording costs one
+    array write per frame. At the end of each trial a summary per phase is
+    added to the ExperimentHandler and every frame is written to a side file
+    (<run>_frames.csv).
+
+    An interval counts as dropped frames when it is longer than
+    dropThreshold frame periods. It then counts as round(interval/period) - 1
+    dropped frames, and belongs to the phase of the frame that ends it.
+
+    Frames are tagged with the phase names given as phases (e.g. the names of
+    the scheduler's Phases). A flip under any other name is recorded as
+    'other', which has its own summary columns, so adding a phase to the
+    trial loop cannot break it.
+
+    When enabled is False, flip() only flips the window and nothing is recorded,
+    so the trial loop can call it either way.
+
+    Args:
+        framePeriod: Expected time between flips (s), e.g. win.monitorFramePeriod
+        maxFrames: Frames per trial to allocate for. The arrays grow if a trial is longer
+        framesPath: Where to write the per-frame file. None to not write one
+        dropThreshold: Intervals longer than this many frame periods are dropped frames
+        enabled: Record anything at all
+        phases: Names of the phases frames are tagged with
+    """
+
+    def __init__(self, framePeriod, maxFrames=4096, framesPath=None, dropThreshold=1.5, enabled=True,
+                 phases=PHASES):
+        phases = [phase for phase in phases if phase != OTHER_PHASE]
+        if len(set(phases)) != len(phases):
+            raise ValueError('FrameTimer phases must be unique, got %s' % phases)
+        self.phaseNames = tuple(phases) + (OTHER_PHASE,)
+        self.framePeriod = framePeriod
+        self.dropThreshold = dropThreshold
+        self.enabled = enabled
+        self.framesPath = framesPath if enabled else None
+        self.times = np.empty(int(maxFrames))
+        self.phases = np.empty(int(maxFrames), dtype=np.int8)
+        self.count = 0
+        self.trial = -1
+        self._phaseIds = {phase: ii for ii, phase in enumerate(self.phaseNames)}
+        self._otherId = self._phaseIds[OTHER_PHASE]
+        self._file = None
+        if self.framesPath is not None:
+            self._file = open(self.framesPath, 'w')
+            self._file.write('trial,frame,phase,flipTime,interval\n')
+
+    def start_trial(self):
+        """Forget the previous trial's frames"""
+        self.count = 0
+        self.trial += 1
+
+    def flip(self, win, phase):
+        """Flip the window and record the flip time under `phase`
+
+        Returns: The flip time win.flip() reports
+        """
+        t = win.flip()
+        if self.enabled:
+            self.record(t, phase)
+        return t
+
+    def record(self, t, phase):
+        """Record a flip at time t (s) during `phase`"""
+        if self.count == self.times.shape[0]:
+            self.times = np.concatenate((self.times, np.empty_like(self.times)))
+            self.phases = np.concatenate((self.phases, np.empty_like(self.phases)))
+        self.times[self.count] = t
+        self.phases[self.count] = self._phaseIds.get(phase, self._otherId)
+        self.count += 1
+
+    def intervals(self):
+        """Time between each recorded flip and the one before (s). The first is NaN"""
+        intervals = np.empty(self.count)
+        intervals[:1] = np.nan
+        np.subtract(self.times[1:self.count], self.times[:self.count - 1], out=intervals[1:])
+        return intervals
+
+    def dropped(self, intervals=None):
+        """Number of frames dropped before each recorded flip"""
+        intervals = self.intervals() if intervals is None else intervals
+        late = intervals > self.dropThreshold * self.framePeriod
+        dropped = np.zeros(self.count, dtype=int)
+        dropped[late] = np.maximum(np.round(intervals[late] / self.framePeriod).astype(int) - 1, 1)
+        return dropped
+
+    def summary(self):
+        """Per phase number of frames, dropped frames, and longest and SD of the intervals (ms)
+
+        Returns: Dict of column name -> value, e.g. 'response_dropped'
+        """
+        intervals = self.intervals()
+        dropped = self.dropped(intervals)
+        phases = self.phases[:self.count]
+        summary = {}
+        for phase, phaseId in self._phaseIds.items():
+            these = phases == phaseId
+            valid = intervals[these & ~np.isnan(intervals)]
+            summary[phase + '_frames'] = int(these.sum())
+            summary[phase + '_dropped'] = int(dropped[these].sum())
+            summary[phase + '_max_interval'] = valid.max() * 1e3 if valid.size else np.nan
+            summary[phase + '_interval_sd'] = valid.std() * 1e3 if valid.size else np.nan
+        return summary
+
+    def end_trial(self, thisExp=None):
+        """Add the trial's summary to thisExp and write its frames to the side file"""
+        if not self.enabled:
+            return
+        if thisExp is not None:
+            for column, value in self.summary().items():
+                thisExp.addData(column, value)
+        if self._file is not None and self.count:
+            intervals = self.intervals()
+            self._file.writelines('%d,%d,%s,%.6f,%.6f\n' % (self.trial, ii, self.phaseNames[phase], t, dt)
+                for ii, (phase, t, dt) in enumerate(zip(self.phases[:self.count], self.times[:self.count], intervals)))
+            self._file.flush()
+
+    def close(self):
+        """Close the side file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def ptb_start_time(snd, ptbOffset=0.):
+    """When a psychopy PTB Sound actually started playing, and the device's predicted latency
+
+    Reads PsychPortAudio's status of the sound's track. StartTime is on the
+    PTB clock (GetSecs). Subtracting ptbOffset = GetSecs() - core.getTime()
+    brings it onto the PsychoPy clock, so it can be compared with flip times.
+
+    Returns: (StartTime, PredictedLatency) in seconds, or NaNs when the sound has
+        not started or is not played by the PTB backend
+    """
+    track = getattr(snd, 'track', None)
+    try:
+        status = track.status
+    except AttributeError:
+        return np.nan, np.nan
+    startTime = status.get('StartTime', 0) or np.nan
+    return startTime - ptbOffset, status.get('PredictedLatency', np.nan)
+
+
+class AudioLatencyAudit:
+    """When each trial's audio was meant to start, and when it did
+
+    For every trial this holds the scheduled start (tStartAudio), the time of
+    the flip the sound was tied to (and the TTL sent with), the start time the
+    audio device reported, the time taken to upload the trial's audio, and the
+    device's predicted output latency. All times must be on the same clock
+    (core.getTime, see ptb_start_time). Trials whose audio started more than
+    `tolerance` away from the flip are flagged.
+
+    Args:
+        tolerance: Largest acceptable |device start - flip| (s), e.g. SETTINGS['frameTolerance']
+        maxTrials: Trials to allocate for. The arrays grow if there are more
+    """
+
+    COLUMNS = ('scheduled', 'flip', 'device_start', 'upload', 'device_latency')
+
+    def __init__(self, tolerance, maxTrials=256):
+        self.tolerance = tolerance
+        self.data = np.full((int(maxTrials), len(self.COLUMNS)), np.nan)
+        self.count = 0
+
+    def record(self, scheduled, flip, deviceStart, upload=np.nan, deviceLatency=np.nan):
+        """Record one trial. All in seconds
+
+        Returns: Dict of thisExp columns for the trial
+        """
+        if self.count == self.data.shape[0]:
+            self.data = np.concatenate((self.data, np.full_like(self.data, np.nan)))
+        row = self.data[self.count]
+        # The flip time is None when the sound never started
+        row[:] = [np.nan if v is None else v for v in (scheduled, flip, deviceStart, upload, deviceLatency)]
+        scheduled, flip, deviceStart, upload, deviceLatency = row.tolist()
+        self.count += 1
+        offset = deviceStart - flip
+        return {'audio_scheduled': scheduled,
+                'audio_device_start': deviceStart,
+                'audio_flip_delay': flip - scheduled,
+                'audio_device_offset': offset,
+                'audio_upload_time': upload,
+                'audio_device_latency': deviceLatency,
+                'audio_latency_flag': bool(abs(offset) > self.tolerance)}
+
+    def offsets(self):
+        """Dict of name -> per-trial offsets (s)"""
+        scheduled, flip, deviceStart, upload, latency = self.data[:self.count].T
+        return {'flip - scheduled': flip - scheduled,
+                'device - flip': deviceStart - flip,
+                'device - scheduled': deviceStart - scheduled,
+                'upload': upload,
+                'device latency': latency}
+
+    def flagged(self):
+        """Indices of the trials whose audio started more than tolerance away from the flip"""
+        offset = self.data[:self.count, 2] - self.data[:self.count, 1]
+        return np.flatnonzero(np.abs(offset) > self.tolerance)
+
+    def summary(self):
+        """Mean of each offset (s), and 95th percentile and max of its size, ignoring trials without a value
+
+        p95 and max are taken over the absolute offsets, so a large early
+        onset shows up as much as a late one.
+        """
+        summary = {}
+        for name, values in self.offsets().items():
+            values = values[~np.isnan(values)]
+            size = np.abs(values)
+            summary[name] = {'n': values.size,
+                             'mean': values.mean() if values.size else np.nan,
+                             'p95': np.percentile(size, 95) if values.size else np.nan,
+                             'max': size.max() if values.size else np.nan}
+        return summary
+
+    def report(self):
+        """The summary and flagged trials as printable text"""
+        lines = ['Audio onset latency over %d trials (ms)' % self.count,
+                 '%-20s %5s %9s %9s %9s' % ('', 'n', 'mean', '|p95|', '|max|')]
+        for name, stats in self.summary().items():
+            lines.append('%-20s %5d %9.3f %9.3f %9.3f' % (name, stats['n'], stats['mean']*1e3,
+                         stats['p95']*1e3, stats['max']*1e3))
+        flagged = self.flagged()
+        lines.append('%d trials with audio more than %.3g ms from the flip%s' % (flagged.size, self.tolerance*1e3,
+                     (': ' + ', '.join(str(ii) for ii in flagged)) if flagged.size else ''))
+        return '\n'.join(lines)
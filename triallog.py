@@ -0,0 +1,180 @@
+"""
+Crash-safe per-trial log of the behavioral data, and recovery of the wide csv from it
+"""
+
+import csv
+import io
+import os
+import os.path as op
+import shutil
+import sys
+import time
+
+
+class TrialLog:
+    """Append-only csv with one row per trial, written as the session runs
+
+    Call write() with each finished entry of the ExperimentHandler (the last
+    of thisExp.entries after thisExp.nextEntry()). Every row is flushed to the
+    OS straight away, so it survives the task crashing, and the file is
+    fsynced every fsyncRows rows or fsyncInterval seconds, so it also survives
+    the computer going down.
+
+    The columns are fixed when the log is opened, by set_columns() before the
+    first trial (e.g. with wide_text_columns(thisExp), so the wide csv has the
+    columns of saveAsWideText), or taken from the first entry if they are
+    still None. Keys missing from an entry are left empty. Keys that are not
+    columns are not written, and onError is told about each once.
+
+    Args:
+        path: Where to write the log, e.g. <run>_trials.csv
+        columns: Column names. None to take them from the first entry
+        fsyncRows: Rows between fsyncs. 1 to fsync after every trial
+        fsyncInterval: Longest time (s) between fsyncs while trials are written
+        bufferSize: Size (bytes) of the file's write buffer
+        onError: Function called with a message about dropped columns or rows. None to print it
+    """
+
+    def __init__(self, path, columns=None, fsyncRows=10, fsyncInterval=30.0, bufferSize=2**16, onError=None):
+        self.path = path
+        self.columns = None if columns is None else list(columns)
+        self.fsyncRows = fsyncRows
+        self.fsyncInterval = fsyncInterval
+        self.onError = onError or print
+        self.rows = 0
+        self._unsynced = 0
+        self._lastSync = time.monotonic()
+        self._dropped = set()
+        os.makedirs(op.dirname(op.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w', newline='', buffering=bufferSize)
+        self._writer = csv.writer(self._file)
+        if self.columns is not None:
+            self._writer.writerow(self.columns)
+
+    def set_columns(self, columns):
+        """Fix the columns of a log opened with columns=None, before the first trial"""
+        if self.columns is not None:
+            raise ValueError('The columns of %s are already set' % self.path)
+        self.columns = list(columns)
+        self._writer.writerow(self.columns)
+
+    def write(self, entry):
+        """Append one trial
+
+        Args:
+            entry: Dict of column -> value, e.g. thisExp.entries[-1]
+        """
+        if self.columns is None:
+            self.set_columns(entry)
+        for key in entry.keys() - self._dropped:
+            if key not in self.columns:
+                self._dropped.add(key)
+                self.onError('Trial log %s has no column %r. It is not written' % (self.path, key))
+        self._writer.writerow(['' if entry.get(column) is None else entry[column] for column in self.columns])
+        self._file.flush()
+        self.rows += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsyncRows or time.monotonic() - self._lastSync >= self.fsyncInterval:
+            self.sync()
+
+    def sync(self):
+        """Flush the log and make sure it is on disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._lastSync = time.monotonic()
+
+    def close(self):
+        """Sync and close the log"""
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def finalize(self, csvPath, columns=None):
+        """Close the log and write the wide csv of the session from it
+
+        Args:
+            csvPath: Where to write the wide csv
+            columns: Columns to write if the log has none yet (no trial was
+                written), e.g. wide_text_columns(thisExp). Without them the
+                wide csv of such a session is left empty
+
+        Returns: Number of trials in the wide csv
+        """
+        if self.columns is None and self._file is not None:
+            self.set_columns(columns or [])
+        self.close()
+        return recover(self.path, csvPath, self.onError)
+
+
+def wide_text_columns(exp):
+    """Columns of a psychopy ExperimentHandler in the order saveAsWideText writes them
+
+    The loop parameters (e.g. trials.thisN and the conditions), then the
+    names given to addData, then the extraInfo keys.
+    """
+    names = exp._getAllParamNames()
+    names += [name for name in exp.dataNames if name not in names]
+    extraInfo = exp.extraInfo if isinstance(exp.extraInfo, dict) else {}
+    names += [name for name in extraInfo if name not in names]
+    return names
+
+
+def recover(logPath, csvPath, onError=None):
+    """Rebuild the wide csv of a session from its trial log
+
+    The log may have been cut off mid-row by a crash. A last row without its
+    line ending or with the wrong number of fields is left out. The csv is
+    written to a temporary file and moved into place, so an existing csvPath
+    is never left half written.
+
+    Args:
+        logPath: The session's trial log (<run>_trials.csv)
+        csvPath: Where to write the wide csv (<run>.csv)
+        onError: Function called with a message about dropped rows. None to print it
+
+    Returns: Number of trials recovered
+    """
+    onError = onError or print
+    with open(logPath, newline='') as f:
+        text = f.read()
+    rows = list(csv.reader(io.StringIO(text, newline='')))
+    complete = text.endswith('\n')
+    if rows and not complete:
+        onError('%s: dropping the unfinished last row' % logPath)
+        rows.pop()
+    if not rows:
+        raise ValueError('%s has no header' % logPath)
+    header, trials = rows[0], rows[1:]
+    kept = [row for row in trials if len(row) == len(header)]
+    if len(kept) != len(trials):
+        onError('%s: dropping %d rows with the wrong number of fields' % (logPath, len(trials) - len(kept)))
+
+    tmpPath = csvPath + '.tmp'
+    if len(kept) == len(trials) and complete:
+        shutil.copyfile(logPath, tmpPath)
+    else:
+        with open(tmpPath, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(kept)
+    os.replace(tmpPath, csvPath)
+    return len(kept)
+
+
+if __name__ == '__main__':
+    # python triallog.py logs/<runid>/<runid>_trials.csv [logs/<runid>/<runid>.csv]
+    if len(sys.argv) < 2:
+        print('Usage: python triallog.py <run>_trials.csv [<run>.csv]')
+        sys.exit(1)
+    logPath = sys.argv[1]
+    if len(sys.argv) > 2:
+        csvPath = sys.argv[2]
+    elif logPath.endswith('_trials.csv'):
+        csvPath = logPath[:-len('_trials.csv')] + '.csv'
+    else:
+        csvPath = op.splitext(logPath)[0] + '_recovered.csv'
+    nTrials = recover(logPath, csvPath)
+    print('Recovered %d trials to %s' % (nTrials, csvPath))
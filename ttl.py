@@ -0,0 +1,415 @@
+"""
+TTL pulses, and the serial trigger boxes they are written to
+"""
+
+import atexit
+import os
+import os.path as op
+import queue
+import sys
+import threading
+import time
+
+# Spin instead of sleeping for the last part of a pulse, for sub-millisecond widths
+_SPIN_TIME = 0.0005
+
+# Serial trigger boxes kept open across the runs of a session. port -> SerialTriggerPort
+_serialPorts = {}
+
+# Whether raise_thread_priority has reported that it could not raise the priority
+_priorityWarned = False
+
+
+def raise_thread_priority(onError=None):
+    """Ask the OS to schedule the calling thread ahead of normal threads. Best effort
+
+    On Linux this needs CAP_SYS_NICE (or root). If the priority cannot be
+    raised, onError is called with the reason, once per session.
+
+    Returns: True if the priority was raised
+    """
+    global _priorityWarned
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            if not kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15): # THREAD_PRIORITY_TIME_CRITICAL
+                raise ctypes.WinError()
+        else:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+        return True
+    except (AttributeError, OSError) as e:
+        if onError is not None and not _priorityWarned:
+            _priorityWarned = True
+            onError('Could not raise the priority of the TTL output thread (%s). Queued codes can wait for the '
+                    'GIL for up to the %.0f ms switch interval' % (e, sys.getswitchinterval() * 1e3))
+        return False
+
+
+def wait_until(t, clock=time.perf_counter):
+    """Sleep until shortly before t, then spin until t"""
+    remaining = t - clock() - _SPIN_TIME
+    if remaining > 0:
+        time.sleep(remaining)
+    while clock() < t:
+        pass
+
+
+class FakePort:
+    """Stand-in for a TTL port. Records the time and value of every write
+
+    Args:
+        clock: Function returning the current time in seconds
+        latency: Seconds each write takes, to mimic a slow port
+    """
+
+    def __init__(self, clock=time.perf_counter, latency=0.0):
+        self.clock = clock
+        self.latency = latency
+        self.writes = [] # (time, value)
+
+    def setData(self, value):
+        self.writes.append((self.clock(), value))
+        if self.latency:
+            wait_until(self.clock() + self.latency, self.clock)
+
+    def close(self):
+        pass
+
+
+class SerialTriggerPort:
+    """A serial trigger box (USB or MMB) that reconnects when a write fails
+
+    A sequence of codes is written as one write of one byte per code. Writes
+    give up after writeTimeout, so a stalled box shows up as a failed write
+    rather than hanging the output thread. After a failed write the port is
+    closed and reopened (up to reconnectTries times). Codes that failed on a
+    port that had disconnected are written again once it is back. Codes that
+    timed out are not, since part of them may already have gone out. Codes
+    that could not be written are kept in `lost` and passed to onError.
+
+    The reconnect can take writeTimeout plus reconnectTries*reconnectDelay.
+    By default it runs in the thread that called write(). With
+    reconnectInBackground it runs in a thread of its own, so a write from a
+    flip callback (with writeTimeout=0, a non-blocking write) never blocks.
+    The codes that failed, and any written while the port is reconnecting,
+    are then lost rather than written late.
+
+    Args:
+        port: Serial port of the box, e.g. 'COM4' or '/dev/ttyUSB0'
+        baudrate: Baud rate of the box
+        timeout: Read timeout (s)
+        writeTimeout: Seconds a write may block before the box counts as stalled
+        reconnectTries: Times to try reopening the port after a failed write
+        reconnectDelay: Seconds to wait between tries
+        clock: Function returning the current time in seconds
+        onError: Function called with a message about lost codes. None to print it
+        reconnectInBackground: Reconnect from a thread of its own instead of in write()
+    """
+
+    def __init__(self, port, baudrate=9600, timeout=0, writeTimeout=0.05, reconnectTries=3,
+                 reconnectDelay=0.01, clock=time.perf_counter, onError=None, reconnectInBackground=False):
+        import serial
+        self._serial = serial
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.writeTimeout = writeTimeout
+        self.reconnectTries = reconnectTries
+        self.reconnectDelay = reconnectDelay
+        self.clock = clock
+        self.onError = onError or print
+        self.reconnectInBackground = reconnectInBackground
+        self.ser = None
+        self._reconnecting = None # thread reconnecting the port in the background
+        self.writes = 0
+        self.reconnects = 0
+        self.lost = [] # (time, codes, reason)
+        self.open()
+
+    def open(self):
+        """Open the port. Raises serial.SerialException if it cannot be opened"""
+        self.ser = self._serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout,
+                                       write_timeout=self.writeTimeout)
+
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    def reconnect(self):
+        """Close and reopen the port
+
+        Returns: True if the port is open again
+        """
+        for ii in range(self.reconnectTries):
+            try:
+                if self.ser is not None:
+                    self.ser.close()
+                self.open()
+                self.reconnects += 1
+                return True
+            except (self._serial.SerialException, OSError):
+                time.sleep(self.reconnectDelay)
+        return False
+
+    def _reconnect_later(self):
+        """Start reconnecting in the background, unless that is already going on"""
+        if self._reconnecting is None:
+            self._reconnecting = threading.Thread(target=self._reconnect_background, name='SerialReconnect',
+                                                  daemon=True)
+            self._reconnecting.start()
+
+    def _reconnect_background(self):
+        if self.reconnect():
+            self.onError('Reconnected to %s' % self.port)
+        else:
+            self.onError('Could not reconnect to %s. Trying again at the next code' % self.port)
+        self._reconnecting = None
+
+    def write(self, codes):
+        """Write a code, or a sequence of codes in a single write
+
+        Returns: True if the codes were written, False if they were lost
+        """
+        data = bytes([codes]) if isinstance(codes, int) else bytes(codes)
+        if self._reconnecting is not None:
+            return self._lose(data, 'reconnecting')
+        try:
+            if not self.is_open():
+                raise self._serial.SerialException('port not open')
+            self.ser.write(data)
+            self.writes += 1
+            return True
+        except self._serial.SerialTimeoutException as e:
+            reason = 'stalled: %s' % e
+            if self.reconnectInBackground:
+                self._reconnect_later()
+            else:
+                self.reconnect()
+        except (self._serial.SerialException, OSError) as e:
+            reason = 'disconnected: %s' % e
+            if self.reconnectInBackground:
+                self._reconnect_later()
+            elif self.reconnect():
+                try:
+                    self.ser.write(data)
+                    self.writes += 1
+                    return True
+                except (self._serial.SerialException, OSError) as e:
+                    reason = 'disconnected: %s' % e
+        return self._lose(data, reason)
+
+    def _lose(self, data, reason):
+        self.lost.append((self.clock(), list(data), reason))
+        shown = list(data) if len(data) <= 8 else '%d codes' % len(data)
+        self.onError('TTL codes %s lost on %s (%s)' % (shown, self.port, reason))
+        return False
+
+    def close(self):
+        """Close the port and drop it from the session's open ports"""
+        reconnecting = self._reconnecting
+        if reconnecting is not None:
+            reconnecting.join()
+        if self.ser is not None:
+            self.ser.close()
+        if _serialPorts.get(self.port) is self:
+            del _serialPorts[self.port]
+
+
+def get_serial_port(port, baudrate=9600, **kwargs):
+    """The session's open SerialTriggerPort for `port`, opened if there is none
+
+    The port stays open after a run so the next run of the session does not
+    have to open it again. A port that has closed since is reopened.
+
+    Args:
+        port: Serial port of the box, e.g. 'COM4'
+        baudrate: Baud rate of the box. A pooled port with another baud rate is reopened
+        **kwargs: Passed on to SerialTriggerPort
+
+    Returns: The SerialTriggerPort
+    """
+    trigger = _serialPorts.get(port)
+    if trigger is not None and trigger.baudrate != baudrate:
+        trigger.close()
+        trigger = None
+    if trigger is None:
+        trigger = SerialTriggerPort(port, baudrate, **kwargs)
+        _serialPorts[port] = trigger
+    elif not trigger.is_open() and not trigger.reconnect():
+        trigger.open() # Raises the reason it cannot be opened
+    return trigger
+
+
+@atexit.register
+def close_serial_ports():
+    """Close every serial trigger box opened this session"""
+    for trigger in list(_serialPorts.values()):
+        try:
+            trigger.close()
+        except Exception as e:
+            trigger.onError('Could not close %s: %s' % (trigger.port, e))
+
+
+class TTLSender:
+    """Writes TTL codes to a port, from the caller or from an output thread
+
+    By default (inline) send() writes the code straight away, so the onset
+    is as precise as the caller (e.g. a flip callback). If pulseWidth is set
+    send() then spins until pulseWidth has passed and writes 0, so every
+    pulse is pulseWidth wide and goes back to 0 before the next code. This
+    holds the caller up for pulseWidth, which is the cost of the pulse. An
+    output thread resetting the port instead would need the GIL, which the
+    frame loop may hold for the interpreter's whole switch interval
+    (sys.getswitchinterval, 5 ms by default), widening the pulses to that.
+
+    Inline is for ports whose write does not block: the parallel port's
+    register write, or a serial box opened with writeTimeout=0 that
+    reconnects in the background (see SerialTriggerPort).
+
+    Without inline, send() only puts the code on a queue and the output
+    thread writes it, which delays the onset by up to the switch interval.
+    With handoffTimeout, send() then waits up to that long for the write,
+    which hands the GIL over straight away at the cost of blocking the
+    caller (see benchmarks/bench_ttl_jitter.py).
+
+    The time of every write is recorded, along with the time the code was
+    requested. A write that returns False lost its codes, which are logged
+    with a written time of NaN.
+
+    With batch, codes are passed to write as a list, so a serial box gets a
+    multi-byte event code (a sequence given to send()) in one write. Without
+    inline, the codes queued by the time the output thread gets to them are
+    written together.
+
+    Args:
+        write: Function that writes a code to the port, e.g. parallel.setData
+        pulseWidth: Seconds to hold a code before writing 0. None for ports that
+            make their own pulse from each code (serial trigger boxes)
+        clock: Function returning the current time in seconds, e.g. core.getTime
+        logFile: Optional csv file to write (requested, written, code) to on close
+        close: Optional function closing the port, called by close()
+        handoffTimeout: Without inline, longest time (s) send() waits for the code to be written. 0 to not wait
+        batch: Write codes as one list. Only for ports without a pulseWidth
+        inline: Write codes in send(). False to write them from the output thread
+        onError: Function called with a message about failed writes. None to print it
+    """
+
+    def __init__(self, write, pulseWidth=0.001, clock=time.perf_counter, logFile=None, close=None,
+                 handoffTimeout=0, batch=False, inline=True, onError=None):
+        self.write = write
+        self.pulseWidth = pulseWidth
+        self.batch = batch and not pulseWidth
+        self.handoffTimeout = handoffTimeout
+        self.inline = inline
+        self.onError = onError or print
+        self.clock = clock
+        self.logFile = logFile
+        self.log = [] # (requested, written, code)
+        self.error = None
+        self._closePort = close
+        self._queue = queue.SimpleQueue()
+        self._written = threading.Event()
+        self._thread = None
+        if not inline:
+            self._thread = threading.Thread(target=self._run, name='TTLSender', daemon=True)
+            self._thread.start()
+
+    def send(self, code):
+        """Write a code now (or queue it to be written as soon as possible without inline)"""
+        if self.inline:
+            self._write_inline(self.clock(), code)
+            return
+        self._written.clear()
+        self._queue.put((self.clock(), code))
+        if self.handoffTimeout:
+            self._written.wait(self.handoffTimeout)
+
+    def _write_inline(self, requested, code):
+        codes = [code] if isinstance(code, int) else list(code)
+        try:
+            written = self.clock()
+            if self.write(codes if self.batch else code) is False:
+                written = float('nan')
+            elif self.pulseWidth:
+                wait_until(written + self.pulseWidth, self.clock)
+                self.write(0)
+        except Exception as e:
+            self.error = e
+            return
+        self.log.extend((requested, written, code) for code in codes)
+
+    def _next_batch(self):
+        """Block for the next code, then take whatever else is queued
+
+        Returns: List of (requested, code) with one code each, and whether to stop
+        """
+        items = [self._queue.get()]
+        while items[-1] is not None:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = items[-1] is None
+        if stop:
+            items.pop()
+        batch = []
+        for requested, codes in items:
+            codes = [codes] if isinstance(codes, int) else list(codes)
+            batch.extend((requested, code) for code in codes)
+        return batch, stop
+
+    def _run_batched(self):
+        raise_thread_priority(self.onError)
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            try:
+                written = self.clock()
+                if self.write([code for _, code in batch]) is False:
+                    written = float('nan')
+                self.log.extend((requested, written, code) for requested, code in batch)
+            except Exception as e:
+                self.error = e
+            self._written.set()
+
+    def _run(self):
+        if self.batch:
+            return self._run_batched()
+        raise_thread_priority(self.onError)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            requested, code = item
+            try:
+                written = self.clock()
+                if self.write(code) is False:
+                    written = float('nan')
+                self._written.set()
+                self.log.append((requested, written, code))
+                if self.pulseWidth:
+                    wait_until(written + self.pulseWidth, self.clock)
+                    self.write(0)
+            except Exception as e:
+                self.error = e
+                self._written.set()
+
+    def close(self, timeout=1.0):
+        """Send the queued codes, stop the thread, close the port and write the log"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+        if self._closePort is not None:
+            self._closePort()
+        if self.error is not None:
+            self.onError('TTL write failed: %s' % self.error)
+        if self.logFile is not None:
+            try:
+                os.makedirs(op.dirname(op.abspath(self.logFile)), exist_ok=True)
+                with open(self.logFile, 'w') as f:
+                    f.write('requested,written,code\n')
+                    f.writelines('%.6f,%.6f,%d\n' % row for row in self.log)
+            except OSError as e:
+                self.onError('Could not write TTL log %s: %s' % (self.logFile, e))
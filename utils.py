@@ -12,17 +12,16 @@ import glob
 import json
 import os
 
-import numpy as np
 import psychopy
-import soundfile as sf
-from psychopy import visual, monitors, event, gui, core, logging, sound
+from psychopy import gui, core, logging
 from psychopy.constants import NOT_STARTED, STARTED, FINISHED
-from psychopy.tools.monitorunittools import cm2pix
 from psychopy.tools.filetools import fromFile, toFile
-from scipy.signal import resample
 from collections import OrderedDict
 import json
 
+from audio import pulse_train, tone_sequence
+from ttl import TTLSender, get_serial_port
+
 
 def openingDlg():
     """The opening dialogue for AV40"""
@@ -139,7 +138,8 @@ def openingDlg():
     #expInfo['logfilename'] = outputFile
 
     expInfo['outputDir'] = outputDir
-    expInfo['date'] = psychopy.data.getDateStr()
+    from psychopy.data import getDateStr
+    expInfo['date'] = getDateStr()
     expInfo['psychopy_version'] = psychopy.__version__
 
     return expInfo
@@ -159,6 +159,8 @@ def setScreen(screen_res,scrWidth,fullScr,monName,dist=60, color="black"):
 
     """
 
+    from psychopy import visual, monitors
+
     # Set monitor parameters. If it doesn't exist, create it
     mon = monitors.Monitor(monName, width=scrWidth, distance=dist)
     mon.setSizePix((screen_res))
@@ -179,7 +181,7 @@ def setScreen(screen_res,scrWidth,fullScr,monName,dist=60, color="black"):
 
     return win, mon
 
-def createAudioStream(arr, soa, samplingRate, reps, blanks=[],prepare=True):
+def createAudioStream(arr, soa, samplingRate, reps, blanks=[],prepare=True, out=None):
     """
 
     Args:
@@ -187,44 +189,42 @@ def createAudioStream(arr, soa, samplingRate, reps, blanks=[],prepare=True):
         soa: Sound Onset Asynchrony. Time between sound onsets for each repetition
         samplingRate: Auditory samplingrate
         reps: Number of times audio stream should be repeated
-        missing: which repetitions should be blank
+        blanks: which repetitions (counting from 1) should be blank
+        prepare: Return a stereo (n,2) stream instead of mono
+        out: Optional preallocated float32 array to write the stream into
 
     Returns:
-        Audiostream to play
+        Audiostream to play (float32)
 
     """
 
     # The zero padding between each click
     dur = len(arr) / samplingRate
     offset2onset_time = soa - dur
-    offset2onset_padding = np.zeros(round(samplingRate * offset2onset_time))
+    period = len(arr) + round(samplingRate * offset2onset_time)
 
-    # The missing/absent repetitions
-    blankPeriod = np.zeros(arr.size)
+    # Create the whole audio stream in one preallocated array
     if not isinstance(blanks,list):
         blanks = [blanks]
-    blankReps = np.array(blanks) - 1
-
-    # Create the whole audio stream
-    audioStream = np.array([])
-    for ii in range(reps):
-        if ii in blankReps:
-            audioStream = np.concatenate((audioStream, blankPeriod, offset2onset_padding))
-        else:
-            audioStream = np.concatenate((audioStream, arr, offset2onset_padding))
-    
-    if prepare:
-        audioStream = np.vstack((audioStream,audioStream)).T.astype('float32')
-
-    return audioStream
+    return pulse_train(arr, period, reps, blanks=blanks, stereo=prepare, out=out)
 
-def set_ttl(trigger, address):
+def set_ttl(trigger, address, pulseWidth=0.001, logFile=None):
     """This is used to create an anonymous function that sends out TTL pulses
     or does nothing but act as a standin and displays when TTL pulses would be sent
 
+    send_ttl writes the code straight away, e.g. inside a flip callback (see
+    ttl.py). For a parallel port it then holds the code for pulseWidth and
+    writes 0, so it takes pulseWidth. A serial trigger box is written
+    without blocking and reconnected in the background if it stalls or
+    drops out, so it never holds up the flip. Serial trigger boxes stay open
+    after close_ttl for the next run of the session, and get a multi-byte
+    code in one write.
+
     Args:
-        trigger: Type of hardware that will be used to send TTL pulses. Options are ['None','MMB','ParallelPort']
+        trigger: Type of hardware that will be used to send TTL pulses. Options are ['None','USB','MMB','ParallelPort']
         address: Port address for the hardware
+        pulseWidth: How long (s) a parallel port code is held before it is reset to 0
+        logFile: Optional csv file the time of every code is written to when the port is closed
 
     Returns:
         Two function handles
@@ -236,51 +236,33 @@ def set_ttl(trigger, address):
         #send_ttl = lambda code: print(code)
         #close_ttl = lambda: print('Pseudo close TTL')
 
-        def send_ttl(code):
+        def write(code):
             None
 
-        def close_ttl():
-            None
+        closePort = None
+        pulseWidth = None
+        batch = False
 
-    elif trigger == 'USB':
+    elif trigger in ('USB', 'MMB'):
+        # Kept open for the rest of the session and reopened if it drops out (see ttl.py)
         try:
-            import serial
-            ser = serial.Serial()
-            ser.port = address # Must be something like 'COM4'
-            ser.timeout = 0.01
-            ser.baudrate = 128000
-            ser.open()
-
-            def send_ttl(code):
-                ser.write(bytes([code]))
-
-            def close_ttl():
-                ser.close()
-        except:
-            dlg = gui.Dlg(title="No USB TTL Found!", pos=(200, 400))
-            dlg.addText('Subject Info', color='Red')
-            dlg.show()
-            core.quit()
-    
-    elif trigger == 'MMB':
-        try:
-            import serial
-            ser = serial.Serial()
-            ser.port = address # Must be something like 'COM4'
-            ser.timeout = 0
-            ser.baudrate = 9600
-            ser.open()
-
-            def send_ttl(code):
-                ser.write(bytes([code]))
-
-            def close_ttl():
-                ser.close()
-        except:
-            dlg = gui.Dlg(title="No MMB Trigger Box Found!", pos=(200, 400))
+            if trigger == 'USB':
+                port = get_serial_port(address, baudrate=128000, timeout=0.01, writeTimeout=0, # Must be something like 'COM4'
+                                       reconnectInBackground=True, onError=logging.error)
+            else:
+                port = get_serial_port(address, baudrate=9600, timeout=0, writeTimeout=0,
+                                       reconnectInBackground=True, onError=logging.error)
+        except Exception:
+            title = "No USB TTL Found!" if trigger == 'USB' else "No MMB Trigger Box Found!"
+            dlg = gui.Dlg(title=title, pos=(200, 400))
             dlg.addText('Subject Info', color='Red')
             dlg.show()
             core.quit()
+
+        write = port.write
+        closePort = None
+        pulseWidth = None
+        batch = True
     
     # Direct parallel port
     elif trigger == 'ParallelPort':
@@ -290,53 +272,21 @@ def set_ttl(trigger, address):
         parallel.setData(0)
         #send_ttl = lambda code: parallel.setData(code)
 
-        def send_ttl(code):
-            from psychopy import parallel
-            parallel.setData(code)
-            core.wait(0.001)
-            parallel.setData(0)
+        write = parallel.setData
+        closePort = None
+        batch = False
 
-        def close_ttl():
-            None
+    sender = TTLSender(write, pulseWidth=pulseWidth, clock=core.getTime, logFile=logFile, close=closePort,
+                       batch=batch, onError=logging.warning)
+    return sender.send, sender.close
 
-    return send_ttl, close_ttl
-
-def read_wav(filename, new_fs=48000, dual=True):
-    """Read a wav file and adjust its sampling rate to desired rate
-
-    Args:
-        filename: wav filename
-        new_fs: the desired sampling rate
-
-    Returns: numpy array of audio file resampled to new_fs
-
-    """
-
-    soundArray, orig_fs = sf.read(filename, dtype='float32')
-    
-    if soundArray.ndim == 1 and dual:
-        soundArray = np.vstack((soundArray, soundArray)).T
-
-    if new_fs not in [orig_fs, None]:
-        audTime = soundArray.shape[0] / orig_fs
-        newNumSamples = round(audTime * new_fs)
-        audStream = resample(soundArray, newNumSamples)
-        return audStream
-    else:
-        return soundArray
-        
-
-def createToneReps(value="A",tone_dur=0.05, blank_dur=0.05, reps=2, sampleRate=44100):
+def createToneReps(value="A",tone_dur=0.05, blank_dur=0.05, reps=2, sampleRate=44100, out=None):
+    from psychopy import sound
     tmp = sound.Sound(value=value, secs=tone_dur, sampleRate=sampleRate,stereo=True, autoLog=False)
     tone = tmp.sndArr
-    blank = np.zeros(( round(blank_dur*sampleRate), 2))
-    for ii in range(reps):
-        if ii == 0:
-            arr = tone
-        else:
-            arr = np.vstack((arr, tone))
-        arr = np.vstack((arr, blank))
-    return arr
+    # Each repetition is the tone followed by blank_dur of silence
+    period = tone.shape[0] + round(blank_dur*sampleRate)
+    return pulse_train(tone, period, reps, out=out)
     
 def pauseAndReadText(win,TxtToWrite,mouse=None,txtColor = [0,0,0],keys=['escape'],wait=2):
     """Displays a message to the screen. Waits until users presses the mouse button
@@ -353,6 +303,7 @@ def pauseAndReadText(win,TxtToWrite,mouse=None,txtColor = [0,0,0],keys=['escape'
         Based on if the user clicked the mouse or clicked "escape" on the keyboard.
 
     """
+    from psychopy import visual, event
     continueRoutine = True
     pauseText = visual.TextStim(win = win, units = 'norm', height = 0.1,
                 pos = (0,0), text = TxtToWrite, alignHoriz = 'center',
@@ -401,39 +352,10 @@ def pauseAndReadText(win,TxtToWrite,mouse=None,txtColor = [0,0,0],keys=['escape'
     win.flip()
     return clickedBttn
 
-def generate_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5):
+def generate_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5, rng=None):
     # Example usage:
     #snd = generate_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, sampleRate=44100)
-    num_tones = int(sequence_duration / tone_duration)
-    num_coherent_tones = int(num_tones * coherence)
-
-    # Generate the coherent tone sequence
-    coherent_tones_tmp = [sound.Sound(value=frequency, secs=tone_duration, sampleRate=sampleRate, stereo=True, hamming=True) for _ in range(num_coherent_tones)]
-    coherent_tones = []
-    for ii in range( len(coherent_tones_tmp) ):
-        coherent_tones.append(coherent_tones_tmp[ii].sndArr)
-
-    # Generate the incoherent tone sequence with octave-based spacing
-    incoherent_tones = []
-    for ii in range(num_tones - num_coherent_tones):
-        random_octave_shift = np.random.uniform(-1, 1)
-        random_frequency = frequency * 2 ** (random_octave_shift * frequency_range)
-        tmp = sound.Sound(value=random_frequency, secs=tone_duration, hamming=True, sampleRate=sampleRate, stereo=True)
-        #tmpSnd = tmp.sndArr
-        #incoherent_tones.append(sound.Sound(value=random_frequency, secs=tone_duration, hamming=True))
-        incoherent_tones.append(tmp.sndArr)
-
-    # Combine the coherent and incoherent tone sequences
-    tone_sequence = coherent_tones + incoherent_tones
-    np.random.shuffle(tone_sequence)
-    
-    # Now put all the tones together to make a single sound
-    for ii in range( len(tone_sequence) ):
-        if ii == 0:
-            arr = tone_sequence[0]
-        else:
-            arr = np.vstack((arr, tone_sequence[ii]))
-            
-    return arr
-    #return sound.Sound(value=arr, sampleRate=sampleRate, hamming=False)
-
+    # All tones are rendered at once by audio.tone_sequence rather than one psychopy Sound per tone.
+    # Pass rng (np.random.RandomState) to make the random incoherent tones reproducible
+    return tone_sequence(coherence, frequency, frequency_range, sampleRate=sampleRate,
+        tone_duration=tone_duration, sequence_duration=sequence_duration, rng=rng)